@@ -0,0 +1,16 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def backend():
+    """The backend module, imported offline: no Groq key, contexts and data read from the repo."""
+    os.environ.pop("GROQ_API_KEY", None)
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    return importlib.import_module("vq-chat-backend")
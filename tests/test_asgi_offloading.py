@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+
+def test_chat_async_keeps_blocking_work_off_the_event_loop(backend, monkeypatch):
+    threads = {}
+
+    def recorded(name, fn):
+        def wrapper(*args, **kwargs):
+            threads.setdefault(name, threading.get_ident())
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    monkeypatch.setattr(backend, "resolve_history", recorded('session read', backend.resolve_history))
+    monkeypatch.setattr(backend, "_append_turn", recorded('session write', backend._append_turn))
+    monkeypatch.setattr(backend, "cached_response", recorded('cache lookup', backend.cached_response))
+    monkeypatch.setattr(backend, "remember_response", recorded('cache store', backend.remember_response))
+    monkeypatch.setattr(backend, "load_context", recorded('context', backend.load_context))
+
+    async def complete(completion_request):
+        message = types.SimpleNamespace(content="An answer.")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None), 'primary'
+
+    monkeypatch.setattr(backend, "complete_chat_async", complete)
+
+    async def run():
+        payload, status = await backend.chat_async({'message': 'who is VQ?', 'sessionId': None})
+        return payload, status, threading.get_ident()
+
+    payload, status, loop_thread = asyncio.run(run())
+    assert status == 200 and payload['response'] == "An answer."
+    assert set(threads) == {'session read', 'session write', 'cache lookup', 'cache store', 'context'}
+    assert loop_thread not in threads.values()
+
+
+def test_other_routes_are_served_by_flask_through_a2wsgi(backend):
+    pytest.importorskip("a2wsgi")
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/health', 'raw_path': b'/health', 'query_string': b'',
+        'root_path': '', 'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 5000), 'server': ('testserver', 80),
+    }
+    asyncio.run(backend.asgi_app(scope, receive, send))
+    assert sent[0]['type'] == 'http.response.start' and sent[0]['status'] == 200
+    assert b''.join(message.get('body', b'') for message in sent[1:])
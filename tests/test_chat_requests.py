@@ -0,0 +1,23 @@
+import types
+
+import pytest
+
+
+@pytest.fixture
+def client(backend, monkeypatch):
+    # Any client will do: these requests are rejected before a completion is made
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    return backend.app.test_client()
+
+
+@pytest.mark.parametrize("path", ['/chat', '/chat/stream'])
+@pytest.mark.parametrize("body, content_type", [
+    ("not json", "application/json"),
+    ("message=hi", "application/x-www-form-urlencoded"),
+    ('["a", "list"]', "application/json"),
+    ("", "application/json"),
+])
+def test_malformed_body_is_a_clean_400(client, path, body, content_type):
+    response = client.post(path, data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'No message provided'}
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+groq = pytest.importorskip("groq")
+httpx = pytest.importorskip("httpx")
+
+REQUEST = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+
+
+def timeout_error():
+    return groq.APITimeoutError(request=REQUEST)
+
+
+def server_error():
+    return groq.InternalServerError("upstream 503", response=httpx.Response(503, request=REQUEST), body=None)
+
+
+class StubClient:
+    """A Groq client whose create() plays back one outcome per call: an exception, a delay or a reply."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.cancelled = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def with_options(self, **options):
+        return self
+
+    def _next(self, model):
+        self.calls.append(model)
+        return self.outcomes.pop(0) if self.outcomes else 0
+
+    def create(self, model, timeout=None, **request):
+        outcome = self._next(model)
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return f"answer from {model} #{len(self.calls)}"
+
+
+class AsyncStubClient(StubClient):
+    async def create(self, model, timeout=None, **request):
+        outcome = self._next(model)
+        call = len(self.calls)
+        if isinstance(outcome, Exception):
+            raise outcome
+        try:
+            await asyncio.sleep(outcome)
+        except asyncio.CancelledError:
+            self.cancelled.append(call)
+            raise
+        return f"answer from {model} #{call}"
+
+
+@pytest.fixture
+def use_client(backend, monkeypatch):
+    """Installs a stub client (sync and async slots) with no retry backoff and hedging off."""
+    monkeypatch.setattr(backend, "COMPLETION_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(backend, "COMPLETION_MIN_ATTEMPT_SECONDS", 0.0)
+    monkeypatch.setattr(backend, "COMPLETION_HEDGE", False)
+    monkeypatch.setattr(backend, "completion_latency", backend.LatencyWindow())
+
+    def use(client):
+        monkeypatch.setattr(backend, "groq_client", client)
+        monkeypatch.setattr(backend, "groq_async_client", client)
+        return client
+
+    return use
+
+
+def request(backend):
+    return {"model": backend.FULL_MODEL, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_first_attempt_answers_on_the_primary_path(backend, use_client):
+    client = use_client(StubClient())
+    completion, path = backend.complete_chat(request(backend))
+    assert path == 'primary' and client.calls == [backend.FULL_MODEL]
+
+
+def test_retryable_error_is_retried(backend, use_client):
+    client = use_client(StubClient(server_error()))
+    completion, path = backend.complete_chat(request(backend))
+    assert path == 'retry'
+    assert client.calls == [backend.FULL_MODEL, backend.FULL_MODEL]
+    assert completion == f"answer from {backend.FULL_MODEL} #2"
+
+
+def test_timeouts_past_the_retries_fall_back_to_the_smaller_model(backend, use_client, monkeypatch):
+    monkeypatch.setattr(backend, "COMPLETION_RETRIES", 1)
+    client = use_client(StubClient(timeout_error(), timeout_error()))
+    completion, path = backend.complete_chat(request(backend))
+    assert path == 'fallback'
+    assert client.calls == [backend.FULL_MODEL, backend.FULL_MODEL, backend.FALLBACK_MODEL]
+
+
+def test_timeout_with_no_budget_left_falls_back_at_once(backend, use_client, monkeypatch):
+    monkeypatch.setattr(backend, "COMPLETION_MIN_ATTEMPT_SECONDS", backend.COMPLETION_DEADLINE_SECONDS)
+    client = use_client(StubClient(timeout_error()))
+    completion, path = backend.complete_chat(request(backend))
+    assert path == 'fallback' and client.calls == [backend.FULL_MODEL, backend.FALLBACK_MODEL]
+
+
+def test_other_errors_are_not_retried(backend, use_client):
+    client = use_client(StubClient(ValueError("bad request")))
+    with pytest.raises(ValueError):
+        backend.complete_chat(request(backend))
+    assert client.calls == [backend.FULL_MODEL]
+
+
+def test_async_retry_then_fallback(backend, use_client, monkeypatch):
+    monkeypatch.setattr(backend, "COMPLETION_RETRIES", 1)
+    client = use_client(AsyncStubClient(server_error(), timeout_error()))
+    completion, path = asyncio.run(backend.complete_chat_async(request(backend)))
+    assert path == 'fallback'
+    assert client.calls == [backend.FULL_MODEL, backend.FULL_MODEL, backend.FALLBACK_MODEL]
+
+
+def test_hedge_answers_when_the_first_call_stalls(backend, use_client, monkeypatch):
+    monkeypatch.setattr(backend, "COMPLETION_HEDGE", True)
+    monkeypatch.setattr(backend, "HEDGE_MIN_DELAY_SECONDS", 0.05)
+    client = use_client(StubClient(1.0, 0))
+    start = time.monotonic()
+    completion, path = backend.complete_chat(request(backend))
+    assert path == 'hedge' and completion == f"answer from {backend.FULL_MODEL} #2"
+    assert time.monotonic() - start < 0.5
+
+
+def test_async_hedge_win_cancels_the_slower_call(backend, use_client, monkeypatch):
+    monkeypatch.setattr(backend, "COMPLETION_HEDGE", True)
+    monkeypatch.setattr(backend, "HEDGE_MIN_DELAY_SECONDS", 0.05)
+    client = use_client(AsyncStubClient(5.0, 0))
+
+    async def main():
+        result = await backend.complete_chat_async(request(backend))
+        await asyncio.sleep(0)
+        return result
+
+    completion, path = asyncio.run(main())
+    assert path == 'hedge' and completion == f"answer from {backend.FULL_MODEL} #2"
+    assert client.cancelled == [1]
@@ -0,0 +1,76 @@
+import pytest
+
+
+def loaded(backend, message):
+    return backend.load_context(message, [])
+
+
+def loaded_files(backend, message):
+    return {label.split(' ')[0].split('#')[0] for label, _, _ in loaded(backend, message)}
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("who are you", {"developments.txt"}),
+    ("what is cai", {"ai_index.txt", "developments.txt"}),
+    ("tell me about yourself", {"developments.txt"}),
+    ("what are you working on right now", {"developments.txt"}),
+    ("how do I contact the team", {"contact_social.txt"}),
+    ("what is the mission of VQ", {"mission_vision.txt", "developments.txt"}),
+])
+def test_trigger_files_are_a_floor_under_retrieval(backend, message, expected):
+    files = loaded_files(backend, message)
+    assert "core.txt" in files
+    assert expected <= files
+
+
+def test_floor_sections_carry_content_not_banners(backend):
+    blocks = dict((label, text) for label, text, _ in loaded(backend, "how do I contact the team"))
+    contact = next(text for label, text in blocks.items() if label.startswith("contact_social.txt#"))
+    assert "veritasquaesitorai@gmail.com" in contact
+    who = next(text for label, text, _ in loaded(backend, "who are you") if label.startswith("developments.txt#"))
+    assert len(who) >= backend.SECTION_MIN_CHARS and "APPRECIATION FRAMEWORK" in who
+
+
+def test_sections_join_headings_to_their_body(backend):
+    for filename, section_no, text in backend.context_store.index.sections:
+        body = text.split("\n", 1)[1]
+        assert not backend._is_heading(body), (filename, section_no)
+        assert len(text) >= backend.SECTION_MIN_CHARS, (filename, section_no)
+        assert "[INSERT]" not in text and "========" not in text
+
+
+def test_split_sections_merges_stub_headings(backend):
+    text = "\n\n".join([
+        "A TITLE", "=" * 20, "Last Updated: today",
+        "=" * 20 + "\nFIRST TOPIC\n" + "=" * 20, "LATEST NEWS (2025):", "First body. " * 40,
+        "SECOND TOPIC:\n" + "Second body. " * 40,
+        "NOTES", "- Findings: [INSERT]", "[Add anything else here]",
+    ])
+    sections = backend.split_sections("x.txt", text)
+    assert len(sections) == 2
+    assert sections[0].startswith("[A TITLE]\nLast Updated: today\n\nFIRST TOPIC\n\nLATEST NEWS (2025):\n\nFirst body.")
+    assert "NOTES" not in sections[-1] and "INSERT" not in sections[-1]
+
+
+def test_floor_counts_against_the_retrieval_budget(backend, monkeypatch):
+    monkeypatch.setattr(backend, "RETRIEVAL_MAX_CHARS", 1500)
+    retrieved = [text for label, text, _ in loaded(backend, "who are you, what is cai, latest developments, mission")
+                 if '#' in label]
+    assert retrieved and sum(len(text) for text in retrieved) <= 1500
+
+
+def test_core_reference_blocks_are_retrieved_not_pinned(backend):
+    pinned = backend.context_store.core_pinned
+    whole = backend.context_store.get("core.txt")
+    assert "WHO I AM" in pinned and "TONE SCALE" in pinned
+    assert "TECHNICAL CHRISTIANITY CURRICULUM" not in pinned
+    assert len(pinned) < len(whole) * 0.6
+    labels = [label for label, _, _ in loaded(backend, "what lessons are in the technical christianity course")]
+    assert any(label.startswith("core.txt#") for label in labels)
+
+
+def test_retrieved_sections_are_not_whole_files(backend):
+    for label, text, _ in loaded(backend, "what is cai"):
+        if label.startswith("developments.txt"):
+            assert "#" in label
+            assert len(text) <= backend.SECTION_MAX_CHARS + backend.SECTION_MIN_CHARS + 200
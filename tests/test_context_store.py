@@ -0,0 +1,60 @@
+import os
+import time
+
+
+def write(path, text, bump=0):
+    path.write_text(text, encoding='utf-8')
+    if bump:
+        # Coarse filesystem clocks can leave a rewrite with the same mtime
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump))
+
+
+def test_loads_text_files_only(backend, tmp_path):
+    write(tmp_path / "core.txt", "CORE IDENTITY\n\nWe are VQ.")
+    write(tmp_path / "notes.md", "not context")
+    store = backend.ContextStore(str(tmp_path), reload_seconds=0)
+    assert store.names() == ['core.txt']
+    assert store.get('notes.md') is None
+
+
+def test_reload_is_a_no_op_until_a_file_changes(backend, tmp_path):
+    write(tmp_path / "core.txt", "CORE IDENTITY\n\nWe are VQ.")
+    write(tmp_path / "milestones.txt", "MILESTONES\n\nFirst beta shipped.")
+    store = backend.ContextStore(str(tmp_path), reload_seconds=0)
+    core = store.get('core.txt')
+    assert store.reload() is False
+
+    write(tmp_path / "milestones.txt", "MILESTONES\n\nRobot prototype walking.", bump=10**9)
+    assert store.reload() is True
+    assert "Robot prototype" in store.get('milestones.txt')
+    # Unchanged files are carried over, not re-read
+    assert store.get('core.txt') is core
+    assert any("Robot prototype" in text for name, _, text in store.index.sections if name == 'milestones.txt')
+
+
+def test_added_and_deleted_files_are_picked_up(backend, tmp_path):
+    write(tmp_path / "core.txt", "CORE IDENTITY\n\nWe are VQ.")
+    write(tmp_path / "vq1_robot.txt", "VQ-1\n\nA humanoid robot.")
+    store = backend.ContextStore(str(tmp_path), reload_seconds=0)
+    (tmp_path / "vq1_robot.txt").unlink()
+    write(tmp_path / "developments.txt", "DEVELOPMENTS\n\nNew tools.")
+    assert store.reload() is True
+    assert store.names() == ['core.txt', 'developments.txt']
+    assert store.get('vq1_robot.txt') is None
+    assert {name for name, _, _ in store.index.sections} == {'developments.txt'}
+
+
+def test_watcher_swaps_in_edits(backend, tmp_path):
+    write(tmp_path / "core.txt", "CORE IDENTITY\n\nWe are VQ.")
+    store = backend.ContextStore(str(tmp_path), reload_seconds=0.02)
+    write(tmp_path / "core.txt", "CORE IDENTITY\n\nWe are Veritas Quaesitor.", bump=10**9)
+    deadline = time.monotonic() + 5
+    while "Veritas" not in store.get('core.txt') and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert "Veritas" in store.get('core.txt')
+
+
+def test_missing_directory_gives_an_empty_store(backend, tmp_path):
+    store = backend.ContextStore(str(tmp_path / "absent"), reload_seconds=0)
+    assert store.names() == [] and store.core_pinned is None
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+
+class StubPool:
+    """ddgs_pool stand-in: counts queries and returns queued result lists."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.queries = []
+
+    def run(self, mode, query, **kwargs):
+        self.queries.append((mode, query))
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+@pytest.fixture
+def ddg(backend, monkeypatch):
+    def install(*results, ttl=None):
+        pool = StubPool(*results)
+        monkeypatch.setattr(backend, "ddgs_pool", pool)
+        monkeypatch.setattr(backend, "search_cache", backend.TTLCache(maxsize=16, ttl=3600))
+        if ttl:
+            monkeypatch.setattr(backend, "SEARCH_CACHE_TTL", dict(backend.SEARCH_CACHE_TTL, **ttl))
+        return pool
+    return install
+
+
+HITS = [{"title": "Pixel 8a", "href": "https://example.com/pixel"}]
+
+
+def test_repeat_queries_are_served_from_cache(backend, ddg):
+    pool = ddg(HITS)
+    assert backend.ddg_search('text', "Best budget phones", 8) == HITS
+    assert backend.ddg_search('text', "  best budget PHONES? ", 8) == HITS
+    assert pool.queries == [('text', "Best budget phones")]
+
+
+def test_modes_and_result_counts_are_cached_apart(backend, ddg):
+    pool = ddg(HITS)
+    backend.ddg_search('text', "phones", 8)
+    backend.ddg_search('news', "phones", 8)
+    backend.ddg_search('text', "phones", 6)
+    assert len(pool.queries) == 3
+
+
+def test_news_expires_on_its_own_ttl(backend, ddg):
+    pool = ddg(HITS, ttl={'news': 0.05})
+    backend.ddg_search('news', "AI regulation", 8)
+    backend.ddg_search('text', "AI regulation", 8)
+    time.sleep(0.1)
+    backend.ddg_search('news', "AI regulation", 8)
+    backend.ddg_search('text', "AI regulation", 8)
+    assert pool.queries == [('news', "AI regulation"), ('text', "AI regulation"), ('news', "AI regulation")]
+
+
+def test_empty_results_are_not_cached(backend, ddg):
+    pool = ddg([], HITS)
+    assert backend.ddg_search('images', "eiffel tower", 5) == []
+    assert backend.ddg_search('images', "eiffel tower", 5) == HITS
+    assert len(pool.queries) == 2
@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def engines(backend, monkeypatch):
+    """Replaces DDGS with a stub that records every instance built."""
+    built = []
+
+    class StubDDGS:
+        def __init__(self, timeout=None):
+            built.append(self)
+            self.queries = []
+
+        def text(self, query, max_results=8):
+            self.queries.append(query)
+            if query == "boom":
+                raise RuntimeError("engine error")
+            return iter([{"title": query}])
+
+    monkeypatch.setattr(backend, "DDGS", StubDDGS, raising=False)
+    return built
+
+
+def test_one_instance_serves_sequential_queries(backend, engines):
+    pool = backend.DDGSPool(4, 1)
+    assert pool.run('text', "phones", max_results=3) == [{"title": "phones"}]
+    pool.run('text', "laptops", max_results=3)
+    assert len(engines) == 1 and engines[0].queries == ["phones", "laptops"]
+
+
+def test_instance_goes_back_to_the_pool_after_an_error(backend, engines):
+    pool = backend.DDGSPool(1, 1)
+    with pytest.raises(RuntimeError):
+        pool.run('text', "boom")
+    pool.run('text', "phones")
+    assert len(engines) == 1
+
+
+def test_concurrent_queries_never_build_more_than_size(backend, engines, monkeypatch):
+    def slow_text(self, query, max_results=8):
+        time.sleep(0.05)
+        return [{"title": query}]
+
+    monkeypatch.setattr(backend.DDGS, "text", slow_text)
+    pool = backend.DDGSPool(2, 5)
+    threads = [threading.Thread(target=pool.run, args=('text', f"q{i}")) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(engines) == 2
@@ -0,0 +1,48 @@
+import pytest
+
+
+@pytest.mark.parametrize("message", [
+    "what time is it in paris texas",
+    "weather in london ontario",
+    "time in birmingham alabama",
+    "what's the weather in cambridge massachusetts",
+    "time in perth scotland",
+    "what time is it in san jose costa rica",
+    "weather in perth amboy",
+])
+def test_qualified_place_elsewhere_is_unresolved(backend, message):
+    assert backend.gazetteer.find_in_text(message) is None
+
+
+@pytest.mark.parametrize("message, name, country", [
+    ("what time is it in Tokyo right now?", "Tokyo", "JP"),
+    ("weather in Paris, France", "Paris", "FR"),
+    ("time in london uk please", "London", "GB"),
+    ("weather in Durban today", "Durban", "ZA"),
+    ("time in perth australia", "Perth", "AU"),
+    ("what time is it in san jose california", "San Jose", "US"),
+    ("whats the time in amanzimtoti", "Amanzimtoti", "ZA"),
+    ("weather in reading berkshire", "Reading", "GB"),
+])
+def test_places_resolve(backend, message, name, country):
+    place = backend.gazetteer.find_in_text(message)
+    assert place is not None
+    assert (place.name, place.country) == (name, country)
+
+
+def test_unresolved_place_falls_through_to_the_router(backend, monkeypatch):
+    routed = []
+
+    def route(message):
+        routed.append(message)
+        return None
+
+    monkeypatch.setattr(backend, "route_message", route)
+    prepared = backend.prepare_chat("what time is it in paris texas", [])
+    assert routed == ["what time is it in paris texas"]
+    assert "live_time" not in prepared.live_blocks
+
+    routed.clear()
+    prepared = backend.prepare_chat("what time is it in Tokyo", [])
+    assert routed == []
+    assert "live_time" in prepared.live_blocks
@@ -0,0 +1,59 @@
+import types
+
+
+def test_histogram_buckets_are_cumulative(backend):
+    hist = backend.Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 0.5, 7.0):
+        hist.observe(value)
+    cumulative, total, count = hist.snapshot()
+    assert cumulative == [2, 3, 4, 5]
+    assert count == 5 and abs(total - 7.565) < 1e-9
+
+
+def test_render_is_prometheus_text(backend):
+    registry = backend.Metrics()
+    registry.describe("vq_test_seconds", "histogram", "Test latency.")
+    registry.describe("vq_test_total", "counter", "Test events.")
+    registry.observe("vq_test_seconds", 0.02, phase="a")
+    registry.inc("vq_test_total", phase="a")
+    registry.inc("vq_test_total", 2, phase="a")
+    text = registry.render({("vq_test_entries", (("cache", "x"),)): 3})
+    lines = text.splitlines()
+    assert lines.count("# TYPE vq_test_seconds histogram") == 1
+    assert 'vq_test_seconds_bucket{phase="a",le="0.025"} 1' in lines
+    assert 'vq_test_seconds_bucket{phase="a",le="+Inf"} 1' in lines
+    assert 'vq_test_seconds_count{phase="a"} 1' in lines
+    assert 'vq_test_total{phase="a"} 3' in lines
+    assert 'vq_test_entries{cache="x"} 3' in lines
+
+
+def test_phases_land_on_the_request_that_ran_them(backend):
+    with backend.request_timing('test') as timer:
+        with backend.timed_phase('context_load'):
+            pass
+        backend.record_phase('web_search', 0.25)
+        timer.status = 503
+    assert [phase for phase, _ in timer.phases] == ['context_load', 'web_search']
+    header = timer.server_timing()
+    assert header.startswith("context_load;dur=") and header.endswith(", web_search;dur=250.0")
+    lines = backend.metrics.render().splitlines()
+    assert any(line.startswith('vq_requests_total{endpoint="test",status="503"}') for line in lines)
+    assert any(line.startswith('vq_request_duration_seconds_count{endpoint="test"}') for line in lines)
+
+
+def test_chat_response_carries_server_timing(backend, monkeypatch):
+    message = types.SimpleNamespace(content="Hello friend.")
+    completion = types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    monkeypatch.setattr(backend, "complete_chat", lambda request: (completion, 'primary'))
+    monkeypatch.setattr(backend, "RESPONSE_CACHE", False)
+    monkeypatch.setattr(backend, "SEMANTIC_CACHE", False)
+    response = backend.app.test_client().post('/chat', json={'message': 'hey VQ, how are you today?'})
+    assert response.status_code == 200
+    phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert {'context_load', 'prompt_budget', 'completion', 'postprocess'} <= set(phases)
+
+    scrape = backend.app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'vq_phase_duration_seconds_count{phase="completion"}' in scrape
+    assert 'vq_requests_total{endpoint="chat",status="200"}' in scrape
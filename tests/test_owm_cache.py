@@ -0,0 +1,92 @@
+import time
+import types
+
+import pytest
+
+
+class StubSession:
+    """http_session stand-in that answers OWM requests with queued payloads."""
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.queries = []
+
+    def get(self, url, params=None, **kwargs):
+        self.queries.append(params["q"])
+        payload = self.payloads.pop(0) if len(self.payloads) > 1 else self.payloads[0]
+        return types.SimpleNamespace(json=lambda: payload)
+
+
+@pytest.fixture
+def owm(backend, monkeypatch):
+    def install(*payloads, ttl=600):
+        session = StubSession(*payloads)
+        monkeypatch.setattr(backend, "http_session", session)
+        monkeypatch.setattr(backend, "owm_cache", backend.TTLCache(maxsize=16, ttl=ttl))
+        return session
+    return install
+
+
+def payload(name):
+    return {"cod": 200, "name": name}
+
+
+def test_repeat_lookups_are_served_from_cache(backend, owm):
+    session = owm(payload("Durban"))
+    assert backend.fetch_owm("Durban") == payload("Durban")
+    assert backend.fetch_owm("  durban. ") == payload("Durban")
+    assert session.queries == ["Durban"]
+
+
+def test_cached_payload_expires(backend, owm):
+    session = owm(payload("Durban"), ttl=0.05)
+    backend.fetch_owm("Durban")
+    time.sleep(0.1)
+    backend.fetch_owm("Durban")
+    assert session.queries == ["Durban", "Durban"]
+
+
+def test_unknown_city_is_cached_but_errors_are_not(backend, owm):
+    session = owm({"cod": "404", "message": "city not found"})
+    backend.fetch_owm("Atlantis")
+    backend.fetch_owm("Atlantis")
+    assert session.queries == ["Atlantis"]
+
+    session = owm({"cod": 429, "message": "rate limited"}, payload("Durban"))
+    assert backend.fetch_owm("Durban")["cod"] == 429
+    assert backend.fetch_owm("Durban") == payload("Durban")
+    assert session.queries == ["Durban", "Durban"]
+
+
+@pytest.fixture
+def major_city(backend, monkeypatch):
+    calls = []
+
+    def create(**request):
+        calls.append(request["messages"][-1]["content"])
+        message = types.SimpleNamespace(content="Durban")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "groq_create", create)
+    monkeypatch.setattr(backend, "gazetteer", backend.Gazetteer("missing.json"))
+
+    def install(ttl=3600):
+        monkeypatch.setattr(backend, "major_city_cache", backend.TTLCache(maxsize=16, ttl=ttl))
+        return calls
+    return install
+
+
+def test_major_city_answers_are_cached(backend, major_city):
+    calls = major_city()
+    assert backend.get_nearest_major_city("Amanzimtoti") == "Durban"
+    assert backend.get_nearest_major_city("amanzimtoti") == "Durban"
+    assert calls == ["Amanzimtoti"]
+
+
+def test_major_city_answers_expire(backend, major_city):
+    calls = major_city(ttl=0.05)
+    backend.get_nearest_major_city("Amanzimtoti")
+    time.sleep(0.1)
+    backend.get_nearest_major_city("Amanzimtoti")
+    assert calls == ["Amanzimtoti", "Amanzimtoti"]
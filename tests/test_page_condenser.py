@@ -0,0 +1,57 @@
+PSALM_23 = """Psalm 23
+The Lord is my shepherd;
+I shall not want.
+He makes me lie down
+in green pastures.
+He leads me beside still waters.
+He restores my soul.
+He leads me in paths of righteousness
+for his name's sake.
+"""
+
+NAV = "Home\nAbout\nProducts\nBlog\nContact\n"
+
+
+def test_content_within_budget_is_returned_untouched(backend):
+    content = ("A long line of article text that keeps going without a break. " * 32).strip()
+    assert len(content) > backend.PAGE_PASSAGE_MAX_CHARS
+    assert backend.condense_page_content("https://example.com/a", content, "", 6000) == content
+
+
+def test_long_lines_are_split_not_cut(backend):
+    line = " ".join(f"Sentence number {i} of a very long single-line paragraph." for i in range(120))
+    page = backend.extract_passages(line)
+    assert len(page.passages) > 1
+    assert all(len(p) <= backend.PAGE_PASSAGE_MAX_CHARS for p in page.passages)
+    assert " ".join(page.passages) == line
+
+
+def test_verses_and_lists_survive_condensing(backend):
+    filler = "\n\n".join(f"Commentary paragraph {i}: " + "the psalmist reflects on trust and provision. " * 6
+                         for i in range(30))
+    content = PSALM_23 + "\n" + filler
+    condensed = backend.condense_page_content("https://example.com/psalm", content, "psalm 23 shepherd", 3000)
+    assert "I shall not want." in condensed
+    assert "in green pastures." in condensed
+
+    recipe = "Ingredients\n2 cups flour\n1 tsp salt\n3 eggs\n250 ml milk\n\n"
+    page = backend.extract_passages(recipe + filler)
+    assert "2 cups flour\n1 tsp salt\n3 eggs\n250 ml milk" in page.passages[0]
+
+
+def test_navigation_and_repeated_blocks_are_dropped(backend):
+    article = "Article body sentence with real content in it. " * 5
+    page = backend.extract_passages(NAV + "\n" + article + "\n\nFooter links\nTerms\nCareers\n\n"
+                                    + article.upper() + "\n\nFooter links\nTerms\nCareers\n")
+    text = "\n".join(page.passages)
+    assert "Products" not in text
+    assert "Careers" not in text
+    assert "Article body sentence" in text
+
+
+def test_never_empty_when_input_has_text(backend):
+    content = (NAV * 3) + ("Home\n" * 2000)
+    condensed = backend.condense_page_content("https://example.com/nav", content, "", 500)
+    assert condensed
+    assert len(condensed) <= 500
+    assert backend.condense_page_content("https://example.com/psalm23", PSALM_23 * 40, "", 500)
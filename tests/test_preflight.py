@@ -0,0 +1,66 @@
+import asyncio
+import time
+from functools import partial
+
+
+def nap(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def fail():
+    raise RuntimeError("upstream down")
+
+
+def test_tasks_run_at_the_same_time(backend):
+    start = time.monotonic()
+    results = backend.run_concurrently({'a': partial(nap, 0.2, 1), 'b': partial(nap, 0.2, 2)}, start + 5)
+    assert results == {'a': 1, 'b': 2}
+    assert time.monotonic() - start < 0.35
+
+
+def test_late_and_failed_tasks_get_their_defaults_by_the_deadline(backend):
+    start = time.monotonic()
+    results = backend.run_concurrently(
+        {'fast': partial(nap, 0, 'ok'), 'slow': partial(nap, 1, 'late'), 'broken': fail},
+        start + 0.2, {'slow': 'default', 'broken': 'fallback'},
+    )
+    assert results == {'fast': 'ok', 'slow': 'default', 'broken': 'fallback'}
+    assert time.monotonic() - start < 0.6
+
+
+def test_deadline_is_shared_across_stages(backend):
+    deadline = time.monotonic() + 0.2
+    first = backend.run_concurrently({'route': partial(nap, 0.15, 'routed')}, deadline)
+    second = backend.run_concurrently({'weather': partial(nap, 0.15, 'sunny')}, deadline)
+    assert first == {'route': 'routed'} and second == {'weather': None}
+
+
+def test_async_late_and_failed_tasks_get_their_defaults(backend):
+    async def main():
+        start = time.monotonic()
+        results = await backend.run_concurrently_async(
+            {'fast': partial(nap, 0, 'ok'), 'slow': partial(nap, 1, 'late'), 'broken': partial(fail)},
+            start + 0.2, {'slow': 'default'},
+        )
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(main())
+    assert results == {'fast': 'ok', 'slow': 'default', 'broken': None}
+    assert elapsed < 0.6
+
+
+def test_slow_router_does_not_hold_up_the_request(backend, monkeypatch):
+    called = []
+
+    def stalled_router(message):
+        called.append(message)
+        time.sleep(1)
+        return {'needs_search': True, 'search_query': message}
+
+    monkeypatch.setattr(backend, "PREFLIGHT_DEADLINE_SECONDS", 0.2)
+    monkeypatch.setattr(backend, "route_message", stalled_router)
+    start = time.monotonic()
+    prepared = backend.prepare_chat("what's the weather in tokyo?", [])
+    assert called and time.monotonic() - start < 0.9
+    assert 'search_results' not in prepared.live_blocks
@@ -0,0 +1,84 @@
+def section(backend, name, tokens, priority=0, trimmable=False, role=None):
+    return backend.PromptSection(name, "\n".join(["alpha beta gamma delta"] * (tokens // 4)),
+                                 priority=priority, trimmable=trimmable, role=role)
+
+
+def names(sections):
+    return [sec.name for sec in sections]
+
+
+def test_prompt_that_fits_is_untouched(backend):
+    sections = [section(backend, 'system', 400), section(backend, 'extra', 400, priority=3)]
+    assert backend.fit_prompt_budget(sections, 800) is sections
+
+
+def test_highest_priority_numbers_go_first(backend):
+    sections = [
+        section(backend, 'system', 400),
+        section(backend, 'core', 400, priority=1),
+        section(backend, 'page', 400, priority=2),
+        section(backend, 'retrieved', 400, priority=3),
+        section(backend, 'history[0]', 400, priority=4, role='user'),
+        section(backend, 'history[1]', 400, priority=4, role='assistant'),
+    ]
+    kept = backend.fit_prompt_budget(sections, 1600)
+    assert names(kept) == ['system', 'core', 'page', 'retrieved']
+
+
+def test_older_history_goes_before_newer_within_a_level(backend):
+    sections = [
+        section(backend, 'system', 400),
+        section(backend, 'history[0]', 400, priority=4, role='user'),
+        section(backend, 'history[1]', 400, priority=4, role='assistant'),
+    ]
+    assert names(backend.fit_prompt_budget(sections, 800)) == ['system', 'history[1]']
+
+
+def test_trimmable_section_is_cut_when_that_closes_the_gap(backend):
+    core = section(backend, 'core', 2000, priority=1, trimmable=True)
+    kept = backend.fit_prompt_budget([section(backend, 'system', 400), core], 1600)
+    assert names(kept) == ['system', 'core']
+    assert core.text.endswith("[... trimmed for length ...]")
+    assert backend.MIN_TRIMMED_SECTION_TOKENS <= core.tokens <= 1200
+    assert sum(sec.tokens for sec in kept) <= 1600
+
+
+def test_sections_are_dropped_whole_otherwise(backend):
+    history = section(backend, 'history[0]', 2000, priority=4, role='user')
+    page = section(backend, 'page', 400, priority=2, trimmable=True)
+    kept = backend.fit_prompt_budget([section(backend, 'system', 400), page, history], 550)
+    # history is not trimmable; page would keep fewer than MIN_TRIMMED_SECTION_TOKENS
+    assert names(kept) == ['system']
+    assert "trimmed" not in page.text and "trimmed" not in history.text
+
+
+def test_required_sections_are_kept_even_over_budget(backend):
+    required = [section(backend, 'system', 1200), section(backend, 'user_message', 400, role='user')]
+    optional = [section(backend, 'core', 800, priority=1, trimmable=True),
+                section(backend, 'history[0]', 400, priority=4, role='user')]
+    kept = backend.fit_prompt_budget(required + optional, 1000)
+    assert names(kept) == ['system', 'user_message']
+    assert sum(sec.tokens for sec in kept) > 1000
+    assert "trimmed" not in kept[0].text
+
+
+def test_ordinary_turn_with_recent_history_fits_the_default_budget(backend, monkeypatch):
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    reply = "The earliest creed in 1 Corinthians 15 dates within a few years of the events. " * 55
+    history = []
+    for _ in range(3):
+        history += [{"role": "user", "content": "what about the empty tomb?"},
+                    {"role": "assistant", "content": reply}]
+    budgeted = []
+    fit = backend.fit_prompt_budget
+
+    def record(sections, budget):
+        before = names(sections)
+        kept = fit(sections, budget)
+        budgeted.append((before, names(kept)))
+        return kept
+
+    monkeypatch.setattr(backend, "fit_prompt_budget", record)
+    backend.prepare_chat("what evidence is there for the resurrection?", history)
+    before, after = budgeted[0]
+    assert after == before
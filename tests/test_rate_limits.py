@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncStream(FakeStream):
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, result):
+        self.chat = self.completions = self
+        self.result = result
+
+    def create(self, **request):
+        return self.result
+
+
+class FakeAsyncClient(FakeClient):
+    async def create(self, **request):
+        return self.result
+
+
+def test_stream_holds_its_slot_until_used_up(backend):
+    limiter = backend.groq_limiter(backend.FULL_MODEL)
+    before = limiter.in_flight
+    stream = backend._limited_create(FakeClient(FakeStream("abc")), {'model': backend.FULL_MODEL, 'stream': True}, 5.0)
+    assert limiter.in_flight == before + 1
+    assert list(stream) == ["a", "b", "c"]
+    assert limiter.in_flight == before
+
+
+def test_stream_closed_early_gives_its_slot_back(backend):
+    limiter = backend.groq_limiter(backend.FULL_MODEL)
+    before = limiter.in_flight
+    upstream = FakeStream("abc")
+    stream = backend._limited_create(FakeClient(upstream), {'model': backend.FULL_MODEL, 'stream': True}, 5.0)
+    chunks = iter(stream)
+    assert next(chunks) == "a"
+    assert limiter.in_flight == before + 1
+    stream.close()
+    assert upstream.closed and limiter.in_flight == before
+
+
+def test_async_stream_holds_its_slot_until_closed(backend):
+    limiter = backend.groq_limiter(backend.FULL_MODEL)
+    before = limiter.in_flight
+    upstream = FakeAsyncStream("abc")
+
+    async def run():
+        stream = await backend._limited_create_async(
+            FakeAsyncClient(upstream), {'model': backend.FULL_MODEL, 'stream': True}, 5.0)
+        async for _ in stream:
+            assert limiter.in_flight == before + 1
+            break
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert upstream.closed and limiter.in_flight == before
+
+
+def test_plain_completion_releases_immediately(backend):
+    limiter = backend.groq_limiter(backend.FULL_MODEL)
+    before = limiter.in_flight
+    assert backend._limited_create(FakeClient("done"), {'model': backend.FULL_MODEL}, 5.0) == "done"
+    assert limiter.in_flight == before
+
+
+def test_shared_buckets_are_read_off_the_event_loop(backend):
+    class RecordingBuckets:
+        blocking = True
+
+        def __init__(self):
+            self.threads = []
+
+        def take(self, name, rate, burst):
+            self.threads.append(threading.get_ident())
+            return 0.0
+
+    buckets = RecordingBuckets()
+    limiter = backend.UpstreamLimiter('test', 1.0, 1, 1, 1.0, buckets)
+
+    async def run():
+        async with limiter.slot_async():
+            pass
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert buckets.threads and loop_thread not in buckets.threads
+
+
+def test_malformed_rate_limit_falls_back_to_defaults(backend, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_OWM", "fast,,-2,nan")
+    assert backend._rate_limit_config('owm') == backend.RATE_LIMIT_DEFAULTS['owm']
+    monkeypatch.setenv("RATE_LIMIT_OWM", "2,,abc,0.5")
+    rate, burst, concurrency, max_wait = backend.RATE_LIMIT_DEFAULTS['owm']
+    assert backend._rate_limit_config('owm') == (2.0, burst, concurrency, 0.5)
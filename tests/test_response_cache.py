@@ -0,0 +1,71 @@
+import types
+
+import pytest
+
+
+@pytest.fixture
+def cache(backend, monkeypatch):
+    monkeypatch.setattr(backend, "RESPONSE_CACHE", True)
+    monkeypatch.setattr(backend, "SEMANTIC_CACHE", False)
+    monkeypatch.setattr(backend, "response_cache", backend.TTLCache(maxsize=16, ttl=60))
+    return backend.response_cache
+
+
+def turn(backend, live_blocks=(), message="who are you?"):
+    messages = [{"role": "system", "content": "You are VQ."}, {"role": "user", "content": message}]
+    prepared = backend.PreparedChat(messages, message, 0, set(live_blocks))
+    return prepared, backend.chat_completion_request(prepared)
+
+
+def test_repeated_prompt_is_answered_from_cache(backend, cache):
+    backend.remember_response(*turn(backend), "I am VQ.")
+    assert backend.cached_response(*turn(backend)) == "I am VQ."
+    assert backend.cached_response(*turn(backend, message="who made you?")) is None
+
+
+def test_sampling_settings_are_part_of_the_key(backend, cache):
+    prepared, request = turn(backend)
+    backend.remember_response(prepared, request, "I am VQ.")
+    assert backend.cached_response(prepared, dict(request, max_tokens=request['max_tokens'] + 1)) is None
+    assert backend.cached_response(prepared, dict(request, model="another-model")) is None
+
+
+@pytest.mark.parametrize("block", [
+    'live_weather_time', 'live_weather', 'live_time', 'live_data_missing',
+    'image_results', 'search_results', 'search_empty',
+])
+def test_live_data_turns_bypass_the_cache(backend, cache, block):
+    assert block in backend.LIVE_DATA_BLOCKS
+    prepared, request = turn(backend, [block])
+    assert backend.response_cache_key(prepared, request) is None
+    backend.remember_response(prepared, request, "It is 21°C.")
+    assert len(cache) == 0
+    assert backend.cached_response(prepared, request) is None
+
+
+def test_instruction_blocks_do_not_count_as_live_data(backend, cache):
+    backend.remember_response(*turn(backend, ['devotional_mode']), "Psalm 23.")
+    assert backend.cached_response(*turn(backend, ['devotional_mode'])) == "Psalm 23."
+
+
+def test_cache_is_off_by_default(backend, cache, monkeypatch):
+    monkeypatch.setattr(backend, "RESPONSE_CACHE", False)
+    prepared, request = turn(backend)
+    backend.remember_response(prepared, request, "I am VQ.")
+    assert len(cache) == 0
+
+
+def test_chat_searches_again_instead_of_replaying_an_answer(backend, cache, monkeypatch):
+    calls = []
+    message = types.SimpleNamespace(content="Here are today's phones.")
+    completion = types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "ddg_available", True)
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    monkeypatch.setattr(backend, "execute_web_search",
+                        lambda *args, **kwargs: "1. Pixel 8a\nA phone\nLink: https://example.com")
+    monkeypatch.setattr(backend, "complete_chat", lambda request: calls.append(request) or (completion, 'primary'))
+    client = backend.app.test_client()
+    for _ in range(2):
+        assert client.post('/chat', json={'message': '[DDG SEARCH] best budget phones'}).status_code == 200
+    assert len(calls) == 2 and len(cache) == 0
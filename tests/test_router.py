@@ -0,0 +1,74 @@
+import types
+
+import pytest
+
+
+def completion(content):
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def router(backend, monkeypatch):
+    """Points route_message() at a canned router reply; returns a setter for the reply."""
+    replies = []
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "route_cache", backend.TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(backend, "groq_create", lambda **request: completion(replies[-1]))
+    return replies.append
+
+
+def test_router_reply_is_normalized(backend, router):
+    router('{"needs_search": "YES", "search_query": " AI news ", "is_news": true, '
+           '"location": "UNKNOWN", "wants_time": "no", "wants_weather": 0, "image_query": null}')
+    assert backend.route_message("latest AI news") == {
+        'needs_search': True, 'search_query': 'AI news', 'is_news': True, 'location': '',
+        'wants_time': False, 'wants_weather': False, 'image_query': '',
+    }
+
+
+@pytest.mark.parametrize("reply", ["not json at all", '{"needs_search": tru', ""])
+def test_unparseable_router_reply_falls_back(backend, router, reply):
+    router(reply)
+    assert backend.route_message("latest AI news") is None
+
+
+def test_failed_router_call_falls_back(backend, monkeypatch):
+    def down(**request):
+        raise ConnectionError("groq unreachable")
+
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace())
+    monkeypatch.setattr(backend, "route_cache", backend.TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(backend, "groq_create", down)
+    assert backend.route_message("latest AI news") is None
+
+
+@pytest.fixture
+def searches(backend, monkeypatch):
+    """Records execute_web_search() calls made by the pipeline, with the local model undecided."""
+    calls = []
+
+    def search(message, num_results=8, force_news=False, extracted=None):
+        calls.append(extracted)
+        return "1. Result\nSome text\nLink: https://example.com"
+
+    monkeypatch.setattr(backend, "ddg_available", True)
+    monkeypatch.setattr(backend.search_intent, "predict", lambda message: None)
+    monkeypatch.setattr(backend, "execute_web_search", search)
+    monkeypatch.setattr(backend, "extract_search_query", lambda message: pytest.fail("extra 8B call"))
+    return calls
+
+
+def test_pipeline_falls_back_to_per_intent_classifiers(backend, monkeypatch, searches):
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    monkeypatch.setattr(backend, "needs_search", lambda message: True)
+    prepared = backend.prepare_chat("who won the match last night", [])
+    assert searches == [None] and 'search_results' in prepared.live_blocks
+
+
+def test_search_without_a_query_uses_the_message(backend, monkeypatch, searches):
+    route = {'needs_search': True, 'search_query': '', 'is_news': True, 'location': '',
+             'wants_time': False, 'wants_weather': False, 'image_query': ''}
+    monkeypatch.setattr(backend, "route_message", lambda message: dict(route))
+    backend.prepare_chat("who won the match last night", [])
+    assert searches == [("who won the match last night", True)]
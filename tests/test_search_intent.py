@@ -0,0 +1,24 @@
+import json
+
+
+def test_bundled_model_matches_the_features(backend):
+    assert backend.search_intent.available
+    with open(backend.SEARCH_INTENT_MODEL_PATH, encoding='utf-8') as f:
+        assert json.load(f)["features"] == backend.intent_features_fingerprint()
+
+
+def test_model_for_other_features_is_ignored(backend, tmp_path):
+    with open(backend.SEARCH_INTENT_MODEL_PATH, encoding='utf-8') as f:
+        model = json.load(f)
+    model["features"] = "0" * 16
+    path = tmp_path / "stale.json"
+    path.write_text(json.dumps(model), encoding='utf-8')
+    stale = backend.SearchIntentModel(str(path), backend.SEARCH_INTENT_CONFIDENCE)
+    assert not stale.available and stale.predict("latest news on AI") is None
+
+
+def test_semantic_cache_features_do_not_move_predictions(backend, monkeypatch):
+    message = "what is the latest news about the election"
+    before = backend.search_intent.probability(message)
+    monkeypatch.setattr(backend, "embed_text", lambda text: {})
+    assert backend.search_intent.probability(message) == before
@@ -0,0 +1,75 @@
+import pytest
+
+# Calibration pairs for the semantic cache: real paraphrases seen on the site, and
+# questions that read alike but must never share an answer
+PARAPHRASES = [
+    ("is evolution true", "is evolution real"),
+    ("who built you", "who created you"),
+    ("who are you", "who are you?"),
+    ("what is CAI", "what's CAI"),
+    ("did Jesus rise from the dead", "did Jesus really rise from the dead"),
+    ("what evidence is there for the resurrection", "what is the evidence for the resurrection"),
+    ("hey VQ how are you", "hey VQ, how are you?"),
+    ("how do I contact the team", "how can I contact the team"),
+    ("what is your mission", "what's your mission"),
+]
+OPPOSITES = [
+    ("Is God real?", "Is God not real?"),
+    ("is evolution true", "is evolution not true"),
+    ("does God exist", "God doesn't exist?"),
+    ("did Jesus exist", "did Jesus never exist"),
+    ("should I pray", "should I not pray"),
+    ("is the Bible reliable", "is the Bible unreliable"),
+    ("can science prove God", "can science disprove God"),
+    ("is the resurrection true", "is the resurrection false"),
+    ("is God good", "is God evil"),
+    ("is AI dangerous", "is AI safe"),
+    ("evidence for God", "evidence against God"),
+    ("what is the strongest evidence for the resurrection", "what is the strongest evidence against the resurrection"),
+    ("arguments pro abortion", "arguments anti abortion"),
+    ("read me psalm 23", "read me psalm 91"),
+    ("explain what john 3:16 means", "explain what john 3:17 means"),
+    ("what does the bible say about divorce", "what does the bible say about abortion"),
+    ("write a prayer for my mother", "write a prayer for my father"),
+    ("how old is the universe", "how old is the earth"),
+    ("top 3 arguments for God", "top 5 arguments for God"),
+]
+
+
+def prepared(backend, message):
+    live_blocks = {'devotional_mode'} if backend.is_devotional_query(message.lower()) else set()
+    return backend.PreparedChat([], message, 0, live_blocks)
+
+
+def cache_with(backend, monkeypatch, message, answer):
+    monkeypatch.setattr(backend, "SEMANTIC_CACHE", True)
+    monkeypatch.setattr(backend, "semantic_cache", backend.SemanticCache(16, 60, backend.SEMANTIC_CACHE_THRESHOLD))
+    request = {"model": "m", "temperature": 0.7, "max_tokens": 100}
+    backend.remember_response(prepared(backend, message), request, answer)
+    return request
+
+
+@pytest.mark.parametrize("a, b", PARAPHRASES)
+def test_paraphrases_share_an_answer(backend, monkeypatch, a, b):
+    request = cache_with(backend, monkeypatch, a, "cached")
+    assert backend.cached_response(prepared(backend, b), request) == "cached"
+
+
+@pytest.mark.parametrize("a, b", OPPOSITES)
+def test_look_alike_questions_never_share_an_answer(backend, monkeypatch, a, b):
+    request = cache_with(backend, monkeypatch, a, "cached")
+    assert backend.cached_response(prepared(backend, b), request) is None
+
+
+def test_negated_question_is_not_served_the_cached_answer(backend, monkeypatch):
+    request = cache_with(backend, monkeypatch, "Is God real?", "answer to 'is God real'")
+    assert backend.cached_response(prepared(backend, "is God real"), request) == "answer to 'is God real'"
+    assert backend.cached_response(prepared(backend, "Is God not real?"), request) is None
+    assert backend.cached_response(prepared(backend, "Isn't God real?"), request) is None
+
+
+@pytest.mark.parametrize("message", ["read me psalm 23", "what does john 3:16 mean", "pray for my family"])
+def test_scripture_and_devotional_turns_are_not_cached(backend, monkeypatch, message):
+    request = cache_with(backend, monkeypatch, message, "a reading")
+    assert len(backend.semantic_cache) == 0
+    assert backend.cached_response(prepared(backend, message), request) is None
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+
+def test_client_invented_session_id_is_replaced(backend):
+    made_up = "client-picked-session-0001"
+    history, summary, session_id = backend.resolve_history({'sessionId': made_up, 'message': 'hi'})
+    assert session_id != made_up
+    assert backend.session_store.exists(session_id)
+    assert not backend.session_store.exists(made_up)
+
+
+def test_issued_session_id_is_kept(backend):
+    _, _, session_id = backend.resolve_history({'sessionId': None})
+    backend.session_store.append(session_id, {'role': 'user', 'content': 'hello'})
+    history, _, again = backend.resolve_history({'sessionId': session_id})
+    assert again == session_id
+    assert history == [{'role': 'user', 'content': 'hello'}]
+
+
+def test_unknown_id_cannot_be_seeded_under_its_own_name(backend):
+    made_up = "someone-elses-session-42"
+    _, _, session_id = backend.resolve_history({
+        'sessionId': made_up, 'history': [{'role': 'user', 'content': 'planted'}]})
+    assert session_id != made_up
+    assert backend.session_store.get(made_up) == ("", [])
+
+
+@pytest.fixture
+def offline_client(backend, monkeypatch):
+    def create(**request):
+        raise AssertionError("the test image reply needs no completion")
+
+    completions = types.SimpleNamespace(create=create)
+    monkeypatch.setattr(backend, "groq_client", types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    return backend.app.test_client()
+
+
+def stream_events(response):
+    return [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+            if line.startswith('data: ')]
+
+
+def test_stream_test_image_keeps_the_session(backend, offline_client):
+    response = offline_client.post('/chat/stream', json={'message': 'test image rendering', 'sessionId': None})
+    done = stream_events(response)[-1]
+    assert done['done'] and done['response'] == backend.TEST_IMAGE_RESPONSE
+    assert backend.session_store.exists(done['sessionId'])
+    _, turns = backend.session_store.get(done['sessionId'])
+    assert turns[-1] == {'role': 'assistant', 'content': backend.TEST_IMAGE_RESPONSE}
+
+
+@pytest.mark.parametrize("path", ['/chat', '/chat/stream'])
+def test_lost_session_asks_the_client_to_resend_its_history(backend, offline_client, path):
+    lost = backend.SessionStore.new_id()   # well formed, but this server never issued it (e.g. before a restart)
+    response = offline_client.post(path, json={'message': 'and what about the second one?', 'sessionId': lost})
+    assert response.status_code == 409
+    assert response.get_json()['sessionExpired'] is True
+
+
+def test_resent_history_rebuilds_the_lost_session(backend, offline_client):
+    history = [{'role': 'user', 'content': 'tell me about the empty tomb'},
+               {'role': 'assistant', 'content': 'Here are three lines of evidence...'}]
+    response = offline_client.post('/chat/stream', json={
+        'message': 'test image rendering', 'sessionId': None, 'history': history})
+    done = stream_events(response)[-1]
+    _, turns = backend.session_store.get(done['sessionId'])
+    assert turns[:2] == history
+
+
+def test_background_summary_task_is_held_until_done(backend, monkeypatch):
+    release = asyncio.Event()
+
+    async def summarize(session_id):
+        await release.wait()
+        with backend._summaries_lock:
+            backend._summaries_running.discard(session_id)
+
+    monkeypatch.setattr(backend, "summarize_session_async", summarize)
+
+    async def run():
+        backend.schedule_summary("summary-task-session-01")
+        held = len(backend._summary_tasks)
+        release.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return held
+
+    assert asyncio.run(run()) == 1
+    assert not backend._summary_tasks
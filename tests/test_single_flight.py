@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+
+FOLLOWERS = 4
+
+
+def watched(backend, name):
+    """A SingleFlight whose followers release a semaphore once they have joined a flight."""
+    flights = backend.SingleFlight(name)
+    joined = threading.Semaphore(0)
+    join = flights._join
+
+    def _join(key):
+        flight, leader = join(key)
+        if not leader:
+            joined.release()
+        return flight, leader
+
+    flights._join = _join
+    return flights, joined
+
+
+def run_together(flights, joined, fn):
+    """Start a leader blocked in fn, let FOLLOWERS callers join it, then release it."""
+    release = threading.Event()
+    calls, results = [], []
+
+    def call():
+        calls.append(threading.current_thread().name)
+        release.wait(5)
+        return fn()
+
+    def caller():
+        try:
+            results.append(flights.do('key', call))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(FOLLOWERS + 1)]
+    threads[0].start()
+    while flights.in_flight() == 0:
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    for _ in range(FOLLOWERS):
+        assert joined.acquire(timeout=5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return calls, results
+
+
+def test_concurrent_callers_share_one_call(backend):
+    flights, joined = watched(backend, 'test')
+    calls, results = run_together(flights, joined, lambda: object())
+    assert len(calls) == 1
+    assert len(results) == FOLLOWERS + 1 and all(r is results[0] for r in results)
+    assert flights.in_flight() == 0
+
+
+def test_leader_exception_reaches_every_follower(backend):
+    flights, joined = watched(backend, 'test')
+    error = ValueError("upstream down")
+
+    def fail():
+        raise error
+
+    calls, results = run_together(flights, joined, fail)
+    assert len(calls) == 1
+    assert results == [error] * (FOLLOWERS + 1)
+    assert flights.in_flight() == 0
+
+
+def test_key_is_free_again_after_a_call(backend):
+    flights = backend.SingleFlight('test')
+    assert flights.do('key', lambda: 1) == 1
+    with pytest.raises(ValueError):
+        flights.do('key', lambda: int("x"))
+    assert flights.in_flight() == 0
+    assert flights.do('key', lambda: 2) == 2
+
+
+def test_async_callers_share_one_call_and_its_exception(backend):
+    flights = backend.SingleFlight('test')
+    calls = []
+
+    async def fetch(outcome):
+        calls.append(outcome)
+        await asyncio.sleep(0.05)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def main(outcome):
+        return await asyncio.gather(*(flights.do_async('key', fetch, outcome) for _ in range(FOLLOWERS + 1)),
+                                    return_exceptions=True)
+
+    value = object()
+    assert asyncio.run(main(value)) == [value] * (FOLLOWERS + 1)
+    error = RuntimeError("upstream down")
+    assert asyncio.run(main(error)) == [error] * (FOLLOWERS + 1)
+    assert calls == [value, error]
+    assert flights.in_flight() == 0
+
+
+def test_cancelled_leader_fails_followers_and_frees_the_key(backend):
+    flights = backend.SingleFlight('test')
+
+    async def slow():
+        await asyncio.sleep(5)
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do_async('key', slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do_async('key', slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(TimeoutError):
+            await follower
+        assert flights.in_flight() == 0
+
+    asyncio.run(main())
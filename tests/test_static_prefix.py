@@ -0,0 +1,52 @@
+def test_static_prefix_is_memoized(backend):
+    files = (('core.txt', "CORE", 1),)
+    first = backend.static_prefix("frame", files)
+    assert backend.static_prefix("frame", files) is first
+    assert backend.static_prefix("other frame", files) is not first
+    assert first.text.startswith(backend.VQ_SYSTEM_PROMPT) and first.text.endswith("CORE\n\n")
+
+
+def test_whole_files_come_back_in_canonical_order(backend):
+    blocks = [
+        ('milestones.txt', "M", 3),
+        ('core.txt', "C", 1),
+        ('ets_full.txt [PREFIX]', "E", 1),
+        ('ets_full.txt', "E", 2),
+        ('ai_index.txt#2', "second best", 3),
+        ('ai_index.txt#0', "best", 3),
+    ]
+    files, retrieved = backend.split_context_blocks(blocks)
+    assert files == (('core.txt', "C", 1), ('ets_full.txt [PREFIX]', "E", 1), ('milestones.txt', "M", 3))
+    assert retrieved == [('ai_index.txt#2', "second best", 3), ('ai_index.txt#0', "best", 3)]
+
+
+def test_budget_trimming_never_touches_the_shared_prefix(backend):
+    prefix = backend.StaticPrefix([
+        backend.PromptSection('system_prompt', "SYSTEM "),
+        backend.PromptSection('core.txt', "core " * 50, priority=1, trimmable=True, sep="\n\n"),
+    ])
+    sections = prefix.fresh_sections()
+    extra = backend.PromptSection('page_context', "PAGE")
+    assert prefix.join(sections + [extra]) == prefix.text + "PAGE"
+
+    sections[1].text = "core"
+    assert prefix.join(sections + [extra]) == "SYSTEM core\n\nPAGE"
+    assert prefix.sections[1].text == "core " * 50
+    assert prefix.text == "SYSTEM " + "core " * 50 + "\n\n"
+
+
+def test_turns_loading_the_same_files_share_the_system_prompt_head(backend, monkeypatch):
+    monkeypatch.setattr(backend, "route_message", lambda message: None)
+    heads = []
+    build = backend.static_prefix
+
+    def record(frame, files):
+        heads.append(build(frame, files))
+        return heads[-1]
+
+    monkeypatch.setattr(backend, "static_prefix", record)
+    first = backend.prepare_chat("hey VQ, how are you today?", [])
+    second = backend.prepare_chat("good morning VQ!", [])
+    assert heads[0] is heads[1]
+    for prepared in (first, second):
+        assert prepared.messages[0]["content"].startswith(heads[0].text)
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.mark.parametrize("live_blocks", [
+    {'live_weather'},
+    {'live_time'},
+    {'live_weather_time'},
+])
+def test_fetched_weather_or_time_is_a_readout(backend, live_blocks):
+    assert backend.choose_tier("weather in tokyo", "", [], live_blocks).name == 'readout'
+
+
+@pytest.mark.parametrize("message, live_blocks", [
+    ("what's the weather like", {'weather_instruction'}),
+    ("what time is it", {'time_instruction'}),
+    ("weather in atlantis", {'live_data_missing'}),
+    ("weather in tokyo and the latest news", {'live_weather', 'search_results'}),
+])
+def test_turns_without_fetched_data_use_the_full_tier(backend, message, live_blocks):
+    assert backend.choose_tier(message, "", [], live_blocks).name == 'full'
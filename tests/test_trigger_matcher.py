@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+
+def substring_groups(groups, text):
+    """The matching loop TriggerMatcher replaced."""
+    text = text.lower()
+    return frozenset(g for g, phrases in groups.items() if any(p.lower() in text for p in phrases))
+
+
+def random_message(rng, phrases):
+    """Phrase fragments, whole phrases and noise glued together at random."""
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        phrase = rng.choice(phrases)
+        roll = rng.random()
+        if roll < 0.4:
+            parts.append(phrase.upper() if rng.random() < 0.2 else phrase)
+        elif roll < 0.7:
+            start = rng.randrange(len(phrase))
+            parts.append(phrase[start:rng.randint(start + 1, len(phrase))])
+        else:
+            parts.append("".join(rng.choice("abcdeilmnorstw ?'") for _ in range(rng.randint(1, 12))))
+    return rng.choice(["", " ", "-"]).join(parts)
+
+
+def test_matches_the_substring_loop_on_the_real_triggers(backend):
+    rng = random.Random(7)
+    phrases = [p for ps in backend.TRIGGER_GROUPS.values() for p in ps]
+    for _ in range(20000):
+        text = random_message(rng, phrases)
+        assert backend.TRIGGERS.match(text) == substring_groups(backend.TRIGGER_GROUPS, text), text
+
+
+@pytest.mark.parametrize("text", [
+    "what time is it in tokyo",    # 'what time' and 'time is it' overlap
+    "Hello there",                 # 'hell' inside a longer word
+    "Read me John 3:16",
+    "",
+])
+def test_matches_the_substring_loop_on_edge_cases(backend, text):
+    assert backend.TRIGGERS.match(text) == substring_groups(backend.TRIGGER_GROUPS, text)
+
+
+def test_nested_and_shared_phrases(backend):
+    groups = {'a': ['time', 'time is'], 'b': ['time is it'], 'c': ['is it'], 'd': ['e i']}
+    matcher = backend.TriggerMatcher(groups)
+    rng = random.Random(11)
+    for _ in range(2000):
+        text = "".join(rng.choice("time is it ") for _ in range(rng.randint(0, 20)))
+        assert matcher.match(text) == substring_groups(groups, text), text
@@ -1,7 +1,22 @@
 import os
 import sys
+import copy
+import re
 import json
-from flask import Flask, request, jsonify
+import time
+import math
+import random
+import zlib
+import hashlib
+import asyncio
+import threading
+from types import MappingProxyType
+from contextlib import contextmanager, asynccontextmanager, closing, aclosing
+from contextvars import ContextVar
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait as futures_wait
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 # 1. Initialize App FIRST (before any imports that might fail)
@@ -23,16 +38,686 @@ def health():
 
 print("Health route registered", flush=True)
 
+# 2b. In-process TTL + LRU cache shared by the upstream integrations
+class TTLCache:
+    """
+    Thread-safe, size-bounded cache: entries expire after `ttl` seconds and the
+    least recently used entry is evicted once `maxsize` is reached.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# Single-flight: concurrent identical upstream calls (same normalized arguments) share one
+# in-flight request instead of each going out — a breaking story or a city's weather asked by
+# many users at once costs one call. Per process; SINGLE_FLIGHT=0 turns it off.
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "1") != "0"
+
+class SingleFlight:
+    """
+    The first caller for a key runs the call; callers arriving while it is in flight wait for
+    it and get the same result (or exception). Threads use do(), coroutines do_async(); both
+    share one table, so a thread can wait on a coroutine's call and vice versa.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}   # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+
+    def _join(self, key) -> tuple:
+        """(flight, leader): the in-flight future for `key`, and whether this caller must run it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                metrics.inc("vq_singleflight_shared_total", upstream=self.name)
+                return flight, False
+            flight = self._flights[key] = Future()
+            # Running futures cannot be cancelled, so one waiter giving up never fails the rest
+            flight.set_running_or_notify_cancel()
+            return flight, True
+
+    def _land(self, key, flight: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is None:
+            flight.set_result(result)
+        elif isinstance(error, Exception):
+            flight.set_exception(error)
+        else:
+            # The leader was cancelled or interrupted; waiters see an ordinary failure
+            flight.set_exception(TimeoutError(f"shared {self.name} call was abandoned"))
+
+    def do(self, key, fn, *args, **kwargs):
+        if not SINGLE_FLIGHT:
+            return fn(*args, **kwargs)
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """do() for a coroutine function `fn`."""
+        if not SINGLE_FLIGHT:
+            return await fn(*args, **kwargs)
+        flight, leader = self._join(key)
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(flight))
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+# 2c. Keyword trigger registry — every routing phrase list, compiled once into one matcher
+TRIGGER_GROUPS = {
+    # Live-data / mode detectors
+    'weather': ['weather', 'temperature', 'temp', 'forecast', 'rain', 'raining',
+                'sunny', 'cloudy', 'wind', 'humidity', 'hot', 'cold', 'degrees',
+                'climate today', 'outside like', 'umbrella'],
+    'time': ['what time', 'current time', "what's the time", 'whats the time',
+             'time is it', 'time in ', 'time at ', 'what date', 'current date',
+             "today's date", 'todays date', 'day is it', 'what day'],
+    'devotional': ['read me', 'read the', 'verse', 'scripture', 'psalm', 'proverbs',
+                   'gospel', 'passage', 'bible', 'devotional', 'pray', 'prayer',
+                   'worship', 'meditate', 'meditation', 'reflect', 'john ', 'matthew ',
+                   'romans ', 'genesis ', 'isaiah ', 'philippians ', 'corinthians ',
+                   'ephesians ', 'hebrews '],
+    'image': ['show me', 'image of', 'picture of', 'photo of', 'pic of',
+              'images of', 'pictures of', 'photos of', 'what does', 'look like',
+              'show a', 'show an', 'display', 'see a', 'see an', 'see what'],
+
+    # Context file loaders
+    'about': ['what is cai', 'what is christ-anchored', 'who are you', 'about',
+              'safe harbor', 'character', 'alignment', 'imago dei', 'image-bearer',
+              'servant leadership', 'dignity', 'bias', 'naturalistic', 'symmetric',
+              'epistemic symmetry', 'operational excellence', 'why cai',
+              'what makes cai different', 'traditional ai', 'hallucinate'],
+    'ai_index': ['cai', 'framework', 'methodology', 'bayesian', 'evidence', 'symmetric',
+                 'standards', 'resurrection', 'probability', 'mechanism', 'epistemic',
+                 'singularity', 'abiogenesis', 'naturalism', 'how does', 'why', 'explain'],
+    'beta_tools': ['tool', 'engine', 'crucible', 'calculator', 'beta', 'test',
+                   'huggingface', 'space', 'interactive', 'try', 'use'],
+    'mission_vision': ['mission', 'vision', 'safe harbor', 'agi', 'cagi', 'alignment',
+                       'goal', 'purpose', 'why', 'mandate', 'values', 'character'],
+    'milestones': ['milestone', 'project', 'achievement', 'grok', 'gemini', 'copilot',
+                   'november', 'breakthrough', 'persuasion', 'latest', 'news', 'recent'],
+    'vq1_robot': ['robot', 'vq-1', 'vq1', 'reachy', 'physical', 'february', 'launch',
+                  'embodiment', 'robotics'],
+    'contact_social': ['contact', 'email', 'social', 'twitter', 'linkedin', 'github',
+                       'huggingface', 'reach', 'connect', 'follow', 'collaboration',
+                       'grokipedia', 'grok', 'indexed', 'knowledge base', 'validation', 'recognition'],
+    'developments': ['latest', 'recent', 'update', 'news', 'reachy', 'assembly',
+                     'progress', 'twitter', 'x.com', 'new', 'development', 'eat',
+                     'announcement', 'launched', 'deployed', 'release', 'robot body',
+                     'what have you been', 'programming', 'physical', 'vq-1', 'vq1',
+                     'who are you', 'what are you', 'tell me about yourself', 'what is cai',
+                     'what is vq', 'identity', 'cai', 'christ-anchored', 'mission',
+                     'currently', 'right now', 'today', 'this week', 'happening',
+                     'working on', 'building', 'veritas', 'quaesitor'],
+    # CAI VQA fires only when BOTH of these match
+    'ai_confrontation': ['grok says', 'grok said', 'chatgpt says', 'chatgpt said',
+                         'gemini says', 'gemini said', 'ai says', 'ai said', 'ai told me',
+                         'another ai', 'it responded', 'it said that', 'how do i counter',
+                         'how do i respond', 'what should i say', 'ai responded',
+                         'llm says', 'copilot says', 'perplexity says', 'the ai',
+                         'ai thinks', 'ai claims'],
+    'theological': ['resurrection', 'evidence', 'naturalism', 'abiogenesis', 'mechanism',
+                    'christian', 'christianity', 'god', 'jesus', 'bible', 'theism',
+                    'theistic', 'bayesian', 'epistemic', 'probability', 'proof'],
+    'appreciation_full': ['appreciation framework', 'full appreciation', 'run appreciation',
+                          'appreciation depth', 'appreciation mode', 'deploy appreciation'],
+    'ets_full': ['full ets', 'ets protocol', 'run ets', 'tier system full',
+                 'decision flow', 'corruption resistance', 'ets framework',
+                 'deploy ets', 'load ets'],
+    'evolution': ['evolution', 'evolutionary', 'darwin', 'darwinian', 'natural selection',
+                  'macro-evolution', 'macro evolution', 'abiogenesis', 'origin of life',
+                  'intelligent design', 'creationism', 'cambrian', 'fossil record',
+                  'survival of the fittest', 'common descent', 'richard dawkins',
+                  'pseudo-science', 'pseudoscience', 'science vs religion',
+                  'science vs faith', 'faith vs science', 'religion vs science',
+                  'conflict thesis', 'did god create', 'how did life begin',
+                  'how did life start', 'where did life come from', 'primordial soup',
+                  'random mutation', 'undirected', 'irreducible complexity',
+                  'stephen meyer', 'michael behe', 'douglas axe', 'fred hoyle'],
+    'eschatology': ['heaven', 'hell', 'afterlife', 'judgment', 'damnation',
+                    'salvation', 'eternal', 'eternity', 'unreached', 'condemned',
+                    'damned', 'saved', 'perish', 'lake of fire', 'second death'],
+
+    # Matched against VQ's previous reply: was it asking the user for a location?
+    'asked_weather_location': ['which city', 'which area', 'what city', 'what location',
+                               'weather for', 'want the weather', 'city or area'],
+    'asked_time_location': ['which city', 'which timezone', 'what city', 'city or timezone',
+                            'time for', 'want the time', 'particular city'],
+}
+
+def _trie_pattern(node: dict) -> str:
+    """Regex for a character trie; greedy, so the longest phrase at a position wins."""
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    return '(?:' + body + ')?' if '' in node else body
+
+class TriggerMatcher:
+    """
+    All trigger phrases compiled into a single trie-shaped regex.
+    One scan of the text reports every group with a phrase occurring anywhere in it —
+    the same plain-substring semantics as `any(p in text for p in phrases)`.
+    """
+
+    def __init__(self, groups: dict):
+        owners = {}
+        for group, phrases in groups.items():
+            for phrase in phrases:
+                owners.setdefault(phrase.lower(), set()).add(group)
+        # The scan reports the longest phrase at each position; every other phrase
+        # matching there is a prefix of it, so fold their groups in up front.
+        self._groups_for = {
+            phrase: frozenset().union(*(owners.get(phrase[:i], ()) for i in range(1, len(phrase) + 1)))
+            for phrase in owners
+        }
+        trie = {}
+        for phrase in owners:
+            node = trie
+            for ch in phrase:
+                node = node.setdefault(ch, {})
+            node[''] = {}
+        self._regex = re.compile('(?=(' + _trie_pattern(trie) + '))')
+
+    def match(self, text: str) -> frozenset:
+        found = set()
+        for m in self._regex.finditer(text.lower()):
+            found.update(self._groups_for[m.group(1)])
+        return frozenset(found)
+
+TRIGGERS = TriggerMatcher(TRIGGER_GROUPS)
+
+@lru_cache(maxsize=256)
+def match_triggers(text: str) -> frozenset:
+    """Trigger groups present in `text`. Memoized, so every detector on the same message shares one scan."""
+    return TRIGGERS.match(text)
+
+# 2d. Shared outbound HTTP session — keep-alive connections, bounded pool, reused by every integration
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "5"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+GROQ_TIMEOUT_SECONDS = float(os.environ.get("GROQ_TIMEOUT_SECONDS", "60"))
+http_session = None
+try:
+    import httpx
+    http_session = httpx.Client(
+        timeout=HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+            keepalive_expiry=90
+        )
+    )
+    print("✓ Shared HTTP session ready", flush=True)
+except Exception as e:
+    print(f"⚠ Shared HTTP session unavailable: {e} — using per-call connections", flush=True)
+
+# Async twin for the ASGI serving mode (section 6b). Connections bind to the
+# event loop on first use, so it is only ever awaited from that one loop.
+http_async_session = None
+if http_session is not None:
+    http_async_session = httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+            keepalive_expiry=90
+        )
+    )
+
+# 2e. Request-phase timings — in-process histograms, exported in Prometheus text format on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Thread-safe cumulative-bucket histogram (Prometheus semantics)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            cumulative, running = [], 0
+            for n in self.counts:
+                running += n
+                cumulative.append(running)
+            return cumulative, self.sum, self.count
+
+class Metrics:
+    """Process-wide metric registry: labelled histograms and counters, rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._counters = {}     # (name, labels) -> float
+        self._help = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        hist.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self, gauges: dict = None) -> str:
+        """Prometheus text exposition. `gauges` maps (name, labels) -> value for values read at scrape time."""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._help:
+                kind, help_text = self._help[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        for (name, labels), hist in histograms:
+            header(name)
+            cumulative, total, count = hist.snapshot()
+            for bound, n in zip(list(hist.buckets) + ["+Inf"], cumulative):
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {count}")
+        for (name, labels), value in counters + sorted((gauges or {}).items()):
+            header(name)
+            lines.append(f"{name}{fmt_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("vq_phase_duration_seconds", "histogram", "Time spent in each phase of a chat request.")
+metrics.describe("vq_request_duration_seconds", "histogram", "End-to-end chat request latency.")
+metrics.describe("vq_requests_total", "counter", "Chat requests by endpoint and status.")
+metrics.describe("vq_preflight_failures_total", "counter", "Pre-flight calls that failed or missed the deadline.")
+metrics.describe("vq_cache_hits_total", "counter", "Upstream cache hits.")
+metrics.describe("vq_cache_misses_total", "counter", "Upstream cache misses.")
+metrics.describe("vq_cache_entries", "gauge", "Entries currently held by each upstream cache.")
+metrics.describe("vq_sessions_active", "gauge", "Conversation sessions held in this process.")
+metrics.describe("vq_semantic_cache_hits_total", "counter", "Semantic cache lookups answered from a paraphrase.")
+metrics.describe("vq_semantic_cache_misses_total", "counter", "Semantic cache lookups with no close enough entry.")
+metrics.describe("vq_semantic_cache_evictions_total", "counter", "Semantic cache entries evicted for size.")
+metrics.describe("vq_semantic_cache_entries", "gauge", "Entries currently held by the semantic cache.")
+metrics.describe("vq_semantic_cache_hit_ratio", "gauge", "Semantic cache hits / lookups since start.")
+metrics.describe("vq_search_intent_total", "counter", "Search-intent decisions by the local model, and messages it left to the LLM.")
+metrics.describe("vq_tier_requests_total", "counter", "Answer completions by model tier.")
+metrics.describe("vq_tier_completion_seconds", "histogram", "Answer completion latency by model tier.")
+metrics.describe("vq_tier_tokens_total", "counter", "Tokens used by answer completions, by model tier and kind.")
+metrics.describe("vq_completion_path_total", "counter", "Answer completions by the path that produced them.")
+metrics.describe("vq_completion_errors_total", "counter", "Failed answer-completion attempts by model and error.")
+metrics.describe("vq_completion_hedges_total", "counter", "Hedged second requests fired for slow completions.")
+metrics.describe("vq_upstream_throttled_total", "counter", "Upstream calls skipped because their rate/concurrency budget was spent.")
+metrics.describe("vq_upstream_wait_seconds", "histogram", "Time upstream calls waited for a rate/concurrency slot.")
+metrics.describe("vq_upstream_in_flight", "gauge", "Upstream calls currently running in this process.")
+metrics.describe("vq_singleflight_shared_total", "counter", "Upstream calls answered by another caller's identical in-flight call.")
+metrics.describe("vq_singleflight_in_flight", "gauge", "Distinct coalesced upstream calls currently in flight.")
+
+class RequestTimer:
+    """Phase durations for one request. Each phase also feeds the process-wide histogram."""
+
+    def __init__(self):
+        self.phases = []
+        self.status = 200
+
+    def record(self, phase: str, seconds: float):
+        self.phases.append((phase, seconds))
+        metrics.observe("vq_phase_duration_seconds", seconds, phase=phase)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds."""
+        return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases)
+
+_request_timer = ContextVar("request_timer", default=None)
+
+def record_phase(phase: str, seconds: float, timer: RequestTimer = None):
+    """Attribute a phase duration to the current request (or just the histogram outside one)."""
+    timer = timer or _request_timer.get()
+    if timer is not None:
+        timer.record(phase, seconds)
+    else:
+        metrics.observe("vq_phase_duration_seconds", seconds, phase=phase)
+
+@contextmanager
+def timed_phase(phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+@contextmanager
+def request_timing(endpoint: str):
+    """Install a RequestTimer for the duration of one chat request and record its total latency."""
+    timer = RequestTimer()
+    token = _request_timer.set(timer)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        metrics.observe("vq_request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc("vq_requests_total", endpoint=endpoint, status=str(timer.status))
+        _request_timer.reset(token)
+
+# 2f. Upstream rate limits — each upstream gets a token bucket (sustained rate + burst) and a
+# per-process cap on concurrent calls. With RATE_LIMIT_DB the buckets live in SQLite, so every
+# worker on the host spends one shared budget. A call that cannot get a slot within its wait
+# raises UpstreamBusy, which the integrations treat like any other upstream failure.
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "")
+RATE_LIMIT_DEFAULTS = {
+    # upstream: (tokens per second, burst, concurrent calls per process, max seconds to wait)
+    'groq_8b': (20.0, 40, 32, 1.0),
+    'groq_70b': (5.0, 15, 16, 10.0),
+    'ddg_text': (1.0, 4, 4, 2.0),
+    'ddg_news': (1.0, 4, 4, 2.0),
+    'ddg_images': (1.0, 4, 4, 2.0),
+    'owm': (1.0, 10, 8, 2.0),
+}
+
+class UpstreamBusy(Exception):
+    """An upstream's rate or concurrency budget was not available within the allowed wait."""
+
+class LocalBuckets:
+    """Token buckets for this process only."""
+
+    blocking = False   # take() never waits on I/O
+
+    def __init__(self):
+        self._state = {}   # name -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, name: str, rate: float, burst: int) -> float:
+        """Take one token: 0.0 on success, else the seconds until one will be available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._state.get(name, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._state[name] = (tokens - 1 if not wait else tokens, now)
+        return wait
+
+class SharedBuckets:
+    """Token buckets in SQLite — every process that opens the same file draws from the same budget."""
+
+    blocking = True    # take() waits on the database lock; keep it off the event loop
+
+    def __init__(self, db_path: str):
+        import sqlite3
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def take(self, name: str, rate: float, burst: int) -> float:
+        """LocalBuckets.take() inside one write transaction, so concurrent workers serialize on it."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                self._db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                 (name, tokens - 1 if not wait else tokens, now))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return wait
+
+class UpstreamLimiter:
+    """Token bucket + concurrency cap for one upstream. Use slot() / slot_async() around each call."""
+
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int, max_wait: float, buckets):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _try(self) -> float:
+        """Claim a concurrency slot and a token: 0.0 on success, else seconds to wait before trying again."""
+        with self._lock:
+            if self.in_flight >= self.concurrency:
+                return 0.02
+            self.in_flight += 1
+        wait = 0.0
+        if self.rate > 0:
+            try:
+                wait = self._buckets.take(self.name, self.rate, self.burst)
+            except Exception as e:
+                # A broken shared store must not take the integrations down with it
+                print(f"[RATE LIMIT] Bucket store error for {self.name}: {e} — not limiting", flush=True)
+        if wait:
+            self.release()
+        return wait
+
+    def _busy(self, waited: float):
+        metrics.inc("vq_upstream_throttled_total", upstream=self.name)
+        print(f"[RATE LIMIT] {self.name} busy after {waited:.2f}s — skipping call", flush=True)
+        return UpstreamBusy(f"{self.name} rate limit reached")
+
+    def acquire(self, max_wait: float = None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        while True:
+            wait = self._try()
+            waited = time.monotonic() - start
+            if not wait:
+                if waited:
+                    metrics.observe("vq_upstream_wait_seconds", waited, upstream=self.name)
+                return
+            if waited + wait > max_wait:
+                raise self._busy(waited)
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait: float = None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        while True:
+            wait = await asyncio.to_thread(self._try) if self._buckets.blocking else self._try()
+            waited = time.monotonic() - start
+            if not wait:
+                if waited:
+                    metrics.observe("vq_upstream_wait_seconds", waited, upstream=self.name)
+                return
+            if waited + wait > max_wait:
+                raise self._busy(waited)
+            await asyncio.sleep(wait)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self, max_wait: float = None):
+        self.acquire(max_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, max_wait: float = None):
+        await self.acquire_async(max_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+class LimitedStream:
+    """A streamed completion that keeps its upstream slot until it is used up or closed."""
+
+    def __init__(self, stream, limiter: UpstreamLimiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._held = True
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._limiter.release()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.aclose()
+
+    def close(self):
+        if self._held:
+            try:
+                self._stream.close()
+            finally:
+                self._release()
+
+    async def aclose(self):
+        if self._held:
+            try:
+                await self._stream.close()
+            finally:
+                self._release()
+
+    def __del__(self):
+        # An abandoned stream must not leak its slot
+        self._release()
+
+def _rate_limit_config(name: str) -> tuple:
+    """RATE_LIMIT_<NAME>="rate,burst,concurrency,max_wait" overrides the defaults field by field."""
+    config = list(RATE_LIMIT_DEFAULTS[name])
+    variable = f"RATE_LIMIT_{name.upper()}"
+    override = os.environ.get(variable, "")
+    for i, value in enumerate(override.split(",")[:4]):
+        if not value.strip():
+            continue
+        try:
+            number = float(value)
+            if not math.isfinite(number) or number < 0:
+                raise ValueError("must be a non-negative number")
+            config[i] = type(config[i])(number)
+        except ValueError as e:
+            print(f"⚠ Ignoring {variable} field {i + 1} ({value.strip()!r}: {e}) — using {config[i]}", flush=True)
+    return tuple(config)
+
+_buckets = LocalBuckets()
+if RATE_LIMIT_DB:
+    try:
+        _buckets = SharedBuckets(RATE_LIMIT_DB)
+        print(f"✓ Upstream rate limits shared through SQLite at {RATE_LIMIT_DB}", flush=True)
+    except Exception as e:
+        print(f"⚠ Rate limit SQLite unavailable ({e}) — limits are per process", flush=True)
+upstream_limits = {name: UpstreamLimiter(name, *_rate_limit_config(name), _buckets) for name in RATE_LIMIT_DEFAULTS}
+
 # 3. Import Groq AFTER basic routes are set up
 groq_client = None
+groq_async_client = None
+GROQ_RETRYABLE = ()
 try:
     print("Attempting to import Groq...", flush=True)
-    from groq import Groq
+    from groq import Groq, AsyncGroq
+    from groq import APIConnectionError, RateLimitError, InternalServerError
+    # Worth another attempt: timeouts (an APIConnectionError), dropped connections, 429s and 5xx
+    GROQ_RETRYABLE = (APIConnectionError, RateLimitError, InternalServerError)
     
     raw_key = os.environ.get("GROQ_API_KEY")
     if raw_key:
         GROQ_API_KEY = raw_key.strip()
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        if http_session is not None:
+            groq_client = Groq(api_key=GROQ_API_KEY, http_client=http_session, timeout=GROQ_TIMEOUT_SECONDS)
+            groq_async_client = AsyncGroq(api_key=GROQ_API_KEY, http_client=http_async_session, timeout=GROQ_TIMEOUT_SECONDS)
+        else:
+            groq_client = Groq(api_key=GROQ_API_KEY, timeout=GROQ_TIMEOUT_SECONDS)
+            groq_async_client = AsyncGroq(api_key=GROQ_API_KEY, timeout=GROQ_TIMEOUT_SECONDS)
         print("✓ Groq client initialized successfully", flush=True)
     else:
         print("⚠ GROQ_API_KEY not found in environment", flush=True)
@@ -42,6 +727,41 @@ except Exception as e:
     import traceback
     traceback.print_exc()
 
+def groq_limiter(model: str) -> UpstreamLimiter:
+    return upstream_limits['groq_70b' if '70b' in model else 'groq_8b']
+
+# Temperature-0 classifier calls are deterministic reads of their prompt, so identical
+# concurrent requests share one call
+classifier_flights = SingleFlight('groq_classifier')
+
+def _classifier_key(request: dict):
+    """Single-flight key for a deterministic request, or None when it must run on its own."""
+    if request.get('temperature') != 0 or request.get('stream'):
+        return None
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _groq_create(request: dict):
+    with groq_limiter(request['model']).slot():
+        return groq_client.chat.completions.create(**request)
+
+async def _groq_create_async(request: dict):
+    async with groq_limiter(request['model']).slot_async():
+        return await groq_async_client.chat.completions.create(**request)
+
+def groq_create(**request):
+    """groq_client.chat.completions.create() inside the model's rate-limit slot."""
+    key = _classifier_key(request)
+    if key is None:
+        return _groq_create(request)
+    return classifier_flights.do(key, _groq_create, request)
+
+async def groq_create_async(**request):
+    """groq_create() on the event loop."""
+    key = _classifier_key(request)
+    if key is None:
+        return await _groq_create_async(request)
+    return await classifier_flights.do_async(key, _groq_create_async, request)
+
 # 3b. Import DuckDuckGo search
 ddg_available = False
 try:
@@ -51,6 +771,82 @@ try:
 except Exception as e:
     print(f"⚠ DDGS search unavailable: {e}", flush=True)
 
+# Shared DDG result cache: news goes stale fast, text/image results don't
+SEARCH_CACHE_TTL = {
+    'news': float(os.environ.get("SEARCH_CACHE_TTL_NEWS", "300")),
+    'text': float(os.environ.get("SEARCH_CACHE_TTL_TEXT", "3600")),
+    'images': float(os.environ.get("SEARCH_CACHE_TTL_IMAGES", "3600")),
+}
+search_cache = TTLCache(maxsize=int(os.environ.get("SEARCH_CACHE_SIZE", "1024")), ttl=SEARCH_CACHE_TTL['text'])
+
+def normalize_query(query: str) -> str:
+    """Cache key for a search query: lowercase, single-spaced, no surrounding quotes/punctuation."""
+    return " ".join(query.lower().split()).strip(" \"'.,!?")
+
+# DDGS instances keep their engines' HTTP clients (and connections) alive between
+# queries, so they are pooled per worker instead of being built for every search
+DDGS_POOL_SIZE = int(os.environ.get("DDGS_POOL_SIZE", "4"))
+
+class DDGSPool:
+    """Bounded pool of long-lived DDGS instances; callers borrow one per query."""
+
+    def __init__(self, size: int, timeout: float):
+        import queue
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        import queue
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return DDGS(timeout=int(self.timeout))
+        return self._idle.get(timeout=self.timeout)
+
+    def run(self, mode: str, query: str, **kwargs) -> list:
+        ddgs = self._acquire()
+        try:
+            return list(getattr(ddgs, mode)(query, **kwargs))
+        finally:
+            self._idle.put(ddgs)
+
+ddgs_pool = DDGSPool(DDGS_POOL_SIZE, HTTP_TIMEOUT_SECONDS) if ddg_available else None
+
+ddg_flights = SingleFlight('ddg')
+
+def ddg_search(mode: str, query: str, max_results: int, optional: bool = False, **kwargs) -> list:
+    """
+    Run one DDGS text/news/images query, served from search_cache when fresh.
+    An `optional` query does not wait for the rate limiter: it returns [] when DDG is busy.
+    """
+    cache_key = (normalize_query(query), mode, max_results)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        print(f"[DDG CACHE] Hit {mode} '{cache_key[0]}' ({search_cache.hits} hits / {search_cache.misses} misses)", flush=True)
+        return cached
+    flight_key = cache_key + (optional, tuple(sorted(kwargs.items())))
+    return ddg_flights.do(flight_key, _ddg_fetch, cache_key, mode, query, max_results, optional, kwargs)
+
+def _ddg_fetch(cache_key: tuple, mode: str, query: str, max_results: int, optional: bool, kwargs: dict) -> list:
+    try:
+        with upstream_limits[f"ddg_{mode}"].slot(max_wait=0 if optional else None):
+            results = ddgs_pool.run(mode, query, max_results=max_results, **kwargs)
+    except UpstreamBusy:
+        if optional:
+            return []
+        raise
+    # Empty lists are often rate-limit artefacts — don't pin them
+    if results:
+        search_cache.set(cache_key, results, ttl=SEARCH_CACHE_TTL[mode])
+    return results
+
 # 3c. OpenWeatherMap integration
 OWM_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "")
 owm_available = bool(OWM_API_KEY)
@@ -59,40 +855,194 @@ if owm_available:
 else:
     print("⚠ OPENWEATHER_API_KEY not set — weather via DDG fallback", flush=True)
 
+OWM_WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+# Raw OWM payloads change slowly; small-town → major-city answers essentially never do
+owm_cache = TTLCache(maxsize=512, ttl=float(os.environ.get("OWM_CACHE_TTL", "600")))
+major_city_cache = TTLCache(maxsize=4096, ttl=float(os.environ.get("MAJOR_CITY_CACHE_TTL", str(7 * 24 * 3600))))
+
+def normalize_location(location: str) -> str:
+    """Cache key for a free-text location: lowercase, single-spaced, no trailing punctuation."""
+    return " ".join(location.lower().split()).strip(" .,!?")
+
+# Offline gazetteer — city/alias -> country, coordinates, IANA zone and nearest major city,
+# bundled as data/gazetteer.json. Places named in a message are found without an LLM call,
+# and time-only questions about them are answered from pytz with no upstream call at all.
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join("data", "gazetteer.json"))
+GAZETTEER_MAX_WORDS = 4
+GAZETTEER_FUZZY_CUTOFF = 0.8
+_PLACE_PREPOSITIONS = frozenset(["in", "at", "for", "from", "to", "near", "of"])
+# Words that may follow a place name without qualifying it ("in Tokyo right now")
+_PLACE_TRAILING_WORDS = frozenset("""
+right now today tonight tomorrow yesterday currently later this next weekend week morning afternoon
+evening night time weather forecast temperature temp like looking please thanks vs versus near area
+""".split())
+_PLACE_STRIP_RE = re.compile(r"[^\w\s'-]+")
+try:
+    import pytz
+except ImportError:
+    pytz = None
+    print("⚠ pytz unavailable — local time lookups go through OpenWeatherMap", flush=True)
+
+def normalize_place(name: str) -> str:
+    """Lookup key for a place name: lowercase, accents and punctuation removed, single-spaced."""
+    import unicodedata
+    folded = unicodedata.normalize('NFKD', name.lower())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return " ".join(_PLACE_STRIP_RE.sub(" ", folded).replace("'", "").split())
+
+class Place:
+    """One gazetteer entry. `near` names the major city to use for weather, if this is a small town."""
+    __slots__ = ("name", "country", "lat", "lon", "tz", "near", "ambiguous")
+
+    def __init__(self, entry: dict):
+        self.name = entry["name"]
+        self.country = entry["country"]
+        self.lat = entry["lat"]
+        self.lon = entry["lon"]
+        self.tz = entry["tz"]
+        self.near = entry.get("near", "")
+        self.ambiguous = entry.get("ambiguous", False)
+
+class Gazetteer:
+    """
+    In-memory place index: exact lookup by normalized name or alias, and a difflib
+    fallback for misspellings that only compares names sharing the first letter.
+    """
+
+    def __init__(self, path: str):
+        self.places = []
+        self._names = {}       # normalized name/alias -> Place
+        self._by_initial = {}  # first character -> [normalized names]
+        self._regions = {}     # normalized country/state/province name -> country code
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = data["places"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Gazetteer unavailable ({e}) — locations go through the LLM extractors", flush=True)
+            return
+        for country, names in data.get("regions", {}).items():
+            for name in names:
+                self._regions.setdefault(normalize_place(name), country)
+        for entry in entries:
+            place = Place(entry)
+            self.places.append(place)
+            for name in [place.name] + entry.get("aliases", []):
+                key = normalize_place(name)
+                if key and key not in self._names:
+                    self._names[key] = place
+                    self._by_initial.setdefault(key[0], []).append(key)
+        print(f"✓ Gazetteer loaded: {len(self.places)} places, {len(self._names)} names", flush=True)
+
+    def lookup(self, name: str, fuzzy: bool = True):
+        """The Place called `name`, allowing small misspellings when fuzzy, or None."""
+        import difflib
+        key = normalize_place(name)
+        if not key:
+            return None
+        place = self._names.get(key)
+        if place is not None or not fuzzy or len(key) < 4:
+            return place
+        match = difflib.get_close_matches(key, self._by_initial.get(key[0], ()), n=1, cutoff=GAZETTEER_FUZZY_CUTOFF)
+        return self._names[match[0]] if match else None
+
+    def find_in_text(self, text: str):
+        """
+        The place a message asks about, or None. Known names are matched word-aligned, longest
+        first; ambiguous names ('Nice', 'Reading') and short aliases only count after 'in',
+        'at', 'for'... or as the whole message. A match followed by a region or country it is
+        not in ('Paris Texas'), or by words that name nothing known, is left unresolved for the
+        LLM. Failing a match, the words after the last such preposition (or a short whole
+        message) get a fuzzy lookup.
+        """
+        words = normalize_place(text).split()
+        best = None
+        for i in range(len(words)):
+            anchored_here = i > 0 and words[i - 1] in _PLACE_PREPOSITIONS
+            for n in range(min(GAZETTEER_MAX_WORDS, len(words) - i), 0, -1):
+                key = " ".join(words[i:i + n])
+                place = self._names.get(key)
+                if place is None:
+                    continue
+                anchored = anchored_here or n == len(words)
+                if (place.ambiguous or len(key) <= 3) and not anchored:
+                    continue
+                if best is None or (anchored, n) > best[:2]:
+                    best = (anchored, n, place, i + n)
+                break
+        if best is not None:
+            place = best[2]
+            country = self.qualifier_country(words[best[3]:])
+            if country == "" or country == place.country:
+                return place
+            qualifier = " ".join(words[best[3]:best[3] + 3])
+            print(f"[GAZETTEER] '{place.name}, {place.country}' qualified by '{qualifier}' — unresolved", flush=True)
+            return None
+        tail = words
+        for i in range(len(words) - 1, -1, -1):
+            if words[i] in _PLACE_PREPOSITIONS:
+                tail = words[i + 1:]
+                break
+        if not tail or len(tail) > GAZETTEER_MAX_WORDS:
+            return None
+        return self.lookup(" ".join(tail))
+
+    def qualifier_country(self, words: list):
+        """
+        Country code of the region/country named by the words right after a place name
+        ('texas' → 'US'); "" when they are not a qualifier at all ('right now', 'today');
+        None when they look like one but name nothing known.
+        """
+        qualifier = []
+        for word in words:
+            if word in _STOPWORDS or word in _PLACE_TRAILING_WORDS or word in _PLACE_PREPOSITIONS:
+                break
+            qualifier.append(word)
+        if not qualifier:
+            return ""
+        for n in range(min(3, len(qualifier)), 0, -1):
+            country = self._regions.get(" ".join(qualifier[:n]))
+            if country:
+                return country
+        return None
+
+gazetteer = Gazetteer(GAZETTEER_PATH)
+
+def local_time_block(place: Place) -> str:
+    """LOCAL TIME prompt block for a gazetteer place (same shape as the OWM one), or "" without pytz."""
+    from datetime import datetime
+    if pytz is None:
+        return ""
+    local_dt = datetime.now(pytz.timezone(place.tz))
+    return (
+        f"LOCAL TIME for {place.name}, {place.country}:\n"
+        f"Time: {local_dt.strftime('%I:%M %p')}\n"
+        f"Date: {local_dt.strftime('%A, %B %d, %Y')}"
+    )
+
 def is_weather_query(message: str) -> bool:
     """Detect if message is asking about weather."""
-    weather_words = ['weather', 'temperature', 'temp', 'forecast', 'rain', 'raining',
-                     'sunny', 'cloudy', 'wind', 'humidity', 'hot', 'cold', 'degrees',
-                     'climate today', 'outside like', 'umbrella']
-    msg_lower = message.lower()
-    return any(w in msg_lower for w in weather_words)
+    return 'weather' in match_triggers(message)
 
 def is_time_query(message: str) -> bool:
     """Detect if message is asking about current time or date."""
-    time_words = ['what time', 'current time', "what's the time", 'whats the time',
-                  'time is it', 'time in ', 'time at ', 'what date', 'current date',
-                  "today's date", 'todays date', 'day is it', 'what day']
-    msg_lower = message.lower()
-    return any(w in msg_lower for w in time_words)
+    return 'time' in match_triggers(message)
 
 def is_devotional_query(message: str) -> bool:
     """Detect if message is devotional — scripture reading, prayer, worship, reflection."""
-    devotional_words = [
-        'read me', 'read the', 'verse', 'scripture', 'psalm', 'proverbs',
-        'gospel', 'passage', 'bible', 'devotional', 'pray', 'prayer',
-        'worship', 'meditate', 'meditation', 'reflect', 'john ', 'matthew ',
-        'romans ', 'genesis ', 'isaiah ', 'philippians ', 'corinthians ',
-        'ephesians ', 'hebrews '
-    ]
-    msg_lower = message.lower()
-    return any(w in msg_lower for w in devotional_words)
+    return 'devotional' in match_triggers(message)
 
 def extract_location(message: str) -> str:
-    """Use fast LLM to extract location from weather query."""
+    """Extract location from weather query: the gazetteer first, else a fast LLM."""
+    place = gazetteer.find_in_text(message)
+    if place is not None:
+        print(f"[WEATHER] Gazetteer location: '{place.name}'", flush=True)
+        return place.name
     if not groq_client:
         return ""
     try:
-        result = groq_client.chat.completions.create(
+        result = groq_create(
             model="llama-3.1-8b-instant",
             messages=[
                 {
@@ -119,11 +1069,15 @@ def extract_location(message: str) -> str:
         return ""
 
 def extract_time_location(message: str) -> str:
-    """Use fast LLM to extract location from time query."""
+    """Extract location from time query: the gazetteer first, else a fast LLM."""
+    place = gazetteer.find_in_text(message)
+    if place is not None:
+        print(f"[TIME] Gazetteer location: '{place.name}'", flush=True)
+        return place.name
     if not groq_client:
         return ""
     try:
-        result = groq_client.chat.completions.create(
+        result = groq_create(
             model="llama-3.1-8b-instant",
             messages=[
                 {
@@ -149,51 +1103,171 @@ def extract_time_location(message: str) -> str:
         print(f"[TIME] Location extraction error: {e}", flush=True)
         return ""
 
+MAJOR_CITY_SYSTEM_PROMPT = (
+    "Given a small town or suburb name, reply with ONLY the nearest major city "
+    "that would have weather data. Reply with just the city name, nothing else. "
+    "Examples: 'Amanzimtoti' → 'Durban', 'Sandton' → 'Johannesburg', "
+    "'Brentwood' → 'London', 'Hoboken' → 'New York'. "
+    "If it is already a major city, reply with the same city."
+)
+
+def _major_city_request(location: str) -> dict:
+    return dict(
+        model="llama-3.1-8b-instant",
+        messages=[
+            {"role": "system", "content": MAJOR_CITY_SYSTEM_PROMPT},
+            {"role": "user", "content": location}
+        ],
+        temperature=0.0,
+        max_tokens=20
+    )
+
+def _remember_major_city(location: str, result) -> str:
+    major_city = result.choices[0].message.content.strip()
+    print(f"[WEATHER] Nearest major city for '{location}': '{major_city}'", flush=True)
+    if major_city:
+        major_city_cache.set(normalize_location(location), major_city)
+    return major_city
+
+def _cached_major_city(location: str) -> str:
+    place = gazetteer.lookup(location)
+    if place is not None and place.near:
+        print(f"[WEATHER] Nearest major city for '{location}': '{place.near}' (gazetteer)", flush=True)
+        return place.near
+    cached = major_city_cache.get(normalize_location(location))
+    if cached:
+        print(f"[WEATHER] Nearest major city for '{location}': '{cached}' (cached)", flush=True)
+    return cached
+
 def get_nearest_major_city(location: str) -> str:
-    """Use LLM to find the nearest major city for OWM fallback."""
+    """Nearest major city for OWM fallback: the gazetteer, else an LLM (cached per town)."""
+    cached = _cached_major_city(location)
+    if cached:
+        return cached
     if not groq_client:
         return ""
     try:
-        result = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Given a small town or suburb name, reply with ONLY the nearest major city "
-                        "that would have weather data. Reply with just the city name, nothing else. "
-                        "Examples: 'Amanzimtoti' → 'Durban', 'Sandton' → 'Johannesburg', "
-                        "'Brentwood' → 'London', 'Hoboken' → 'New York'. "
-                        "If it is already a major city, reply with the same city."
-                    )
-                },
-                {"role": "user", "content": location}
-            ],
-            temperature=0.0,
-            max_tokens=20
-        )
-        major_city = result.choices[0].message.content.strip()
-        print(f"[WEATHER] Nearest major city for '{location}': '{major_city}'", flush=True)
-        return major_city
+        return _remember_major_city(location, groq_create(**_major_city_request(location)))
+    except Exception as e:
+        print(f"[WEATHER] Major city lookup error: {e}", flush=True)
+        return ""
+
+async def get_nearest_major_city_async(location: str) -> str:
+    """get_nearest_major_city() on the event loop."""
+    cached = _cached_major_city(location)
+    if cached:
+        return cached
+    if not groq_async_client:
+        return ""
+    try:
+        result = await groq_create_async(**_major_city_request(location))
+        return _remember_major_city(location, result)
     except Exception as e:
         print(f"[WEATHER] Major city lookup error: {e}", flush=True)
         return ""
 
+def _cached_owm(location: str):
+    cache_key = normalize_location(location)
+    cached = owm_cache.get(cache_key)
+    if cached is not None:
+        print(f"[OWM] Cache hit for '{cache_key}'", flush=True)
+    return cached
+
+def _remember_owm(location: str, data: dict) -> dict:
+    # Only cache stable answers: real weather, or "city not found"
+    if str(data.get('cod')) in ('200', '404'):
+        owm_cache.set(normalize_location(location), data)
+    return data
+
+owm_flights = SingleFlight('owm')
+
+def fetch_owm(location: str) -> dict:
+    """Raw OpenWeatherMap current-weather payload for a location, served from cache when fresh."""
+    cached = _cached_owm(location)
+    if cached is not None:
+        return cached
+    return owm_flights.do(normalize_location(location), _fetch_owm, location)
+
+def _fetch_owm(location: str) -> dict:
+    import urllib.request
+    import urllib.parse
+    import urllib.error
+
+    with upstream_limits['owm'].slot():
+        if http_session is not None:
+            # OWM reports unknown cities as HTTP 404 with a JSON body — keep it as a payload
+            response = http_session.get(OWM_WEATHER_URL, params={"q": location, "appid": OWM_API_KEY, "units": "metric"})
+            data = response.json()
+        else:
+            encoded = urllib.parse.quote(location)
+            url = f"{OWM_WEATHER_URL}?q={encoded}&appid={OWM_API_KEY}&units=metric"
+            try:
+                with urllib.request.urlopen(url, timeout=HTTP_TIMEOUT_SECONDS) as response:
+                    data = json.loads(response.read().decode())
+            except urllib.error.HTTPError as e:
+                try:
+                    data = json.loads(e.read().decode())
+                except ValueError:
+                    raise e
+    return _remember_owm(location, data)
+
+async def fetch_owm_async(location: str) -> dict:
+    """fetch_owm() on the event loop."""
+    cached = _cached_owm(location)
+    if cached is not None:
+        return cached
+    if http_async_session is None:
+        return await asyncio.get_running_loop().run_in_executor(_preflight_pool, fetch_owm, location)
+    return await owm_flights.do_async(normalize_location(location), _fetch_owm_async, location)
+
+async def _fetch_owm_async(location: str) -> dict:
+    async with upstream_limits['owm'].slot_async():
+        response = await http_async_session.get(OWM_WEATHER_URL, params={"q": location, "appid": OWM_API_KEY, "units": "metric"})
+    return _remember_owm(location, response.json())
+
+def format_weather_and_time(data: dict) -> tuple:
+    """(weather_str, time_str) prompt blocks for an OWM payload with cod 200."""
+    from datetime import datetime, timezone, timedelta
+
+    name = data['name']
+    country = data['sys']['country']
+    temp = round(data['main']['temp'])
+    feels_like = round(data['main']['feels_like'])
+    humidity = data['main']['humidity']
+    description = data['weather'][0]['description'].capitalize()
+    wind_speed = round(data['wind']['speed'] * 3.6)
+    temp_min = round(data['main']['temp_min'])
+    temp_max = round(data['main']['temp_max'])
+
+    # Payload may come from cache — compute "now" from the zone offset, not the observation time
+    tz_offset = data['timezone']
+    local_dt = datetime.now(tz=timezone(timedelta(seconds=tz_offset)))
+    formatted_time = local_dt.strftime('%I:%M %p')
+    formatted_date = local_dt.strftime('%A, %B %d, %Y')
+
+    weather_str = (
+        f"LIVE WEATHER for {name}, {country}:\n"
+        f"Condition: {description}\n"
+        f"Temperature: {temp}°C (feels like {feels_like}°C)\n"
+        f"High: {temp_max}°C | Low: {temp_min}°C\n"
+        f"Humidity: {humidity}%\n"
+        f"Wind: {wind_speed} km/h"
+    )
+
+    time_str = (
+        f"LOCAL TIME for {name}, {country}:\n"
+        f"Time: {formatted_time}\n"
+        f"Date: {formatted_date}"
+    )
+
+    print(f"[OWM] Weather+time for {name}: {temp}°C, {description}, {formatted_time}", flush=True)
+    return weather_str, time_str
+
 def get_weather_and_time(location: str) -> tuple:
     """Fetch live weather AND local time from a single OpenWeatherMap API call."""
     if not owm_available or not location:
         return "", "", location
     try:
-        import urllib.request
-        import urllib.parse
-        from datetime import datetime, timezone, timedelta
-
-        def fetch_owm(loc):
-            encoded = urllib.parse.quote(loc)
-            url = f"https://api.openweathermap.org/data/2.5/weather?q={encoded}&appid={OWM_API_KEY}&units=metric"
-            with urllib.request.urlopen(url, timeout=5) as response:
-                return json.loads(response.read().decode())
-
         data = fetch_owm(location)
 
         if data.get('cod') != 200:
@@ -208,39 +1282,32 @@ def get_weather_and_time(location: str) -> tuple:
             else:
                 return "", "", location
 
-        name = data['name']
-        country = data['sys']['country']
-        temp = round(data['main']['temp'])
-        feels_like = round(data['main']['feels_like'])
-        humidity = data['main']['humidity']
-        description = data['weather'][0]['description'].capitalize()
-        wind_speed = round(data['wind']['speed'] * 3.6)
-        temp_min = round(data['main']['temp_min'])
-        temp_max = round(data['main']['temp_max'])
-
-        dt_unix = data['dt']
-        tz_offset = data['timezone']
-        local_dt = datetime.fromtimestamp(dt_unix, tz=timezone(timedelta(seconds=tz_offset)))
-        formatted_time = local_dt.strftime('%I:%M %p')
-        formatted_date = local_dt.strftime('%A, %B %d, %Y')
-
-        weather_str = (
-            f"LIVE WEATHER for {name}, {country}:\n"
-            f"Condition: {description}\n"
-            f"Temperature: {temp}°C (feels like {feels_like}°C)\n"
-            f"High: {temp_max}°C | Low: {temp_min}°C\n"
-            f"Humidity: {humidity}%\n"
-            f"Wind: {wind_speed} km/h"
-        )
+        return (*format_weather_and_time(data), location)
 
-        time_str = (
-            f"LOCAL TIME for {name}, {country}:\n"
-            f"Time: {formatted_time}\n"
-            f"Date: {formatted_date}"
-        )
+    except Exception as e:
+        print(f"[OWM] Fetch error: {e}", flush=True)
+        return "", "", location
+
+async def get_weather_and_time_async(location: str) -> tuple:
+    """get_weather_and_time() on the event loop."""
+    if not owm_available or not location:
+        return "", "", location
+    try:
+        data = await fetch_owm_async(location)
+
+        if data.get('cod') != 200:
+            print(f"[OWM] '{location}' not found ({data.get('message')}) — trying nearest major city", flush=True)
+            major_city = await get_nearest_major_city_async(location)
+            if major_city and major_city.lower() != location.lower():
+                data = await fetch_owm_async(major_city)
+                if data.get('cod') != 200:
+                    print(f"[OWM] Major city '{major_city}' also failed", flush=True)
+                    return "", "", location
+                location = f"{location} (nearest: {major_city})"
+            else:
+                return "", "", location
 
-        print(f"[OWM] Weather+time for {name}: {temp}°C, {description}, {formatted_time}", flush=True)
-        return weather_str, time_str, location
+        return (*format_weather_and_time(data), location)
 
     except Exception as e:
         print(f"[OWM] Fetch error: {e}", flush=True)
@@ -248,49 +1315,47 @@ def get_weather_and_time(location: str) -> tuple:
 
 def is_image_query(message: str) -> bool:
     """Detect if message is asking to show/find an image."""
-    image_words = ['show me', 'image of', 'picture of', 'photo of', 'pic of',
-                   'images of', 'pictures of', 'photos of', 'what does', 'look like',
-                   'show a', 'show an', 'display', 'see a', 'see an', 'see what']
-    msg_lower = message.lower()
-    return any(w in msg_lower for w in image_words)
+    return 'image' in match_triggers(message)
+
+def extract_image_query(user_message: str) -> str:
+    """Use fast LLM to extract a concise image search query."""
+    if not groq_client:
+        return user_message
+    try:
+        result = groq_create(
+            model="llama-3.1-8b-instant",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "Extract a concise image search query (2-5 words) from the user message. "
+                        "Reply with ONLY the search query, nothing else. "
+                        "Examples: 'show me a golden retriever' → 'golden retriever', "
+                        "'what does the Eiffel Tower look like' → 'Eiffel Tower Paris', "
+                        "'picture of a black hole' → 'black hole space'"
+                    )
+                },
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.0,
+            max_tokens=15
+        )
+        return result.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"[IMAGE SEARCH] Query extraction error: {e}", flush=True)
+        return user_message
 
-def execute_image_search(user_message: str, num_results: int = 5) -> list:
+def execute_image_search(user_message: str, num_results: int = 5, query: str = None) -> list:
     """Search DuckDuckGo for images and return URLs with titles."""
     if not ddg_available:
         return []
     try:
-        if groq_client:
-            result = groq_client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Extract a concise image search query (2-5 words) from the user message. "
-                            "Reply with ONLY the search query, nothing else. "
-                            "Examples: 'show me a golden retriever' → 'golden retriever', "
-                            "'what does the Eiffel Tower look like' → 'Eiffel Tower Paris', "
-                            "'picture of a black hole' → 'black hole space'"
-                        )
-                    },
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.0,
-                max_tokens=15
-            )
-            query = result.choices[0].message.content.strip()
-        else:
-            query = user_message
+        if not query:
+            query = extract_image_query(user_message)
 
         print(f"[IMAGE SEARCH] Query: '{query}'", flush=True)
 
-        with DDGS() as ddgs:
-            results = list(ddgs.images(
-                query,
-                max_results=num_results,
-                safesearch='moderate',
-                size='Medium'
-            ))
+        results = ddg_search('images', query, num_results, safesearch='moderate', size='Medium')
 
         blocked_domains = [
             'wikimedia.org', 'wikipedia.org', 'upload.wiki',
@@ -316,12 +1381,116 @@ def execute_image_search(user_message: str, num_results: int = 5) -> list:
         print(f"[IMAGE SEARCH] Error: {e}", flush=True)
         return []
 
+# Local search-intent classifier — logistic regression over its own hashed n-gram features,
+# trained by vq-intent-train.py and bundled as data/search_intent.json. A confident prediction
+# settles needs_search on the CPU; only messages it is unsure about still pay for a Groq round
+# trip. The model file records a fingerprint of the features it was trained on and is ignored
+# when they no longer match. Set ROUTER_LOG_PATH to collect more training data.
+SEARCH_INTENT_MODEL_PATH = os.environ.get("SEARCH_INTENT_MODEL_PATH", os.path.join("data", "search_intent.json"))
+SEARCH_INTENT_CONFIDENCE = float(os.environ.get("SEARCH_INTENT_CONFIDENCE", "0.85"))
+ROUTER_LOG_PATH = os.environ.get("ROUTER_LOG_PATH", "")
+_router_log_lock = threading.Lock()
+INTENT_FEATURE_DIM = 1 << 20
+_INTENT_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+_INTENT_PROBES = (
+    "What's the latest news on AI?", "who are you", "Is God real?", "weather in Tokyo tomorrow",
+    "bitcoin price today, 2026", "Can't you look it up?",
+)
+
+def intent_features(text: str) -> dict:
+    """
+    L2-normalized {bucket: weight} of a message's hashed words, word pairs and character
+    trigrams. Separate from embed_text() so semantic-cache tuning cannot move these.
+    """
+    words = _INTENT_WORD_RE.findall(text.lower().replace("’", "'"))
+    features = {}
+
+    def add(feature, weight):
+        h = zlib.crc32(feature.encode('utf-8'))
+        bucket = h % INTENT_FEATURE_DIM
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        features[bucket] = features.get(bucket, 0.0) + sign * weight
+
+    for i, word in enumerate(words):
+        add(f"w:{word}", 1.0)
+        if i:
+            add(f"b:{words[i - 1]} {word}", 0.5)
+        padded = f"^{word}$"
+        for j in range(len(padded) - 2):
+            add(f"c:{padded[j:j + 3]}", 0.25)
+    norm = sum(w * w for w in features.values()) ** 0.5
+    return {b: w / norm for b, w in features.items() if w} if norm else {}
+
+def intent_features_fingerprint() -> str:
+    """Hash of intent_features() on fixed probe messages; changes whenever the features do."""
+    probes = [sorted((b, round(w, 6)) for b, w in intent_features(text).items()) for text in _INTENT_PROBES]
+    return hashlib.sha256(json.dumps(probes).encode('utf-8')).hexdigest()[:16]
+
+class SearchIntentModel:
+    """Sparse linear model: P(needs search) = sigmoid(bias + w · intent_features(message))."""
+
+    def __init__(self, path: str, confidence: float):
+        self.confidence = confidence
+        self.weights = {}
+        self.bias = 0.0
+        self.available = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                model = json.load(f)
+            if model.get("features") != intent_features_fingerprint():
+                raise ValueError("trained on different features; retrain with vq-intent-train.py")
+            self.weights = {int(bucket): weight for bucket, weight in model["weights"].items()}
+            self.bias = model["bias"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Search intent model unavailable ({e}) — every message goes through the LLM router", flush=True)
+            return
+        self.available = True
+        print(f"✓ Search intent model loaded: {len(self.weights)} weights, "
+              f"trained on {model.get('examples', '?')} examples", flush=True)
+
+    def probability(self, message: str) -> float:
+        weights = self.weights
+        z = self.bias + sum(value * weights.get(bucket, 0.0) for bucket, value in intent_features(message).items())
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+    def predict(self, message: str):
+        """True/False when the model is confident either way, None when the LLM should decide."""
+        if not self.available:
+            return None
+        p = self.probability(message)
+        if p >= self.confidence:
+            decision = True
+        elif p <= 1.0 - self.confidence:
+            decision = False
+        else:
+            metrics.inc("vq_search_intent_total", source="uncertain")
+            return None
+        metrics.inc("vq_search_intent_total", source="local")
+        print(f"[SEARCH INTENT] '{message[:60]}' → {'YES' if decision else 'NO'} (p={p:.2f})", flush=True)
+        return decision
+
+search_intent = SearchIntentModel(SEARCH_INTENT_MODEL_PATH, SEARCH_INTENT_CONFIDENCE)
+
+def log_router_decision(message: str, needs: bool, source: str):
+    """Append an LLM search decision to ROUTER_LOG_PATH (JSONL) as training data."""
+    if not ROUTER_LOG_PATH:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "message": message, "needs_search": needs, "source": source})
+    try:
+        with _router_log_lock, open(ROUTER_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"[ROUTER LOG] Error: {e}", flush=True)
+
 def needs_search(message: str) -> bool:
-    """Ask a fast LLM classifier: does this question need a live web search?"""
+    """Does this question need a live web search? The local model answers when confident, else a fast LLM."""
+    local = search_intent.predict(message)
+    if local is not None:
+        return local
     if not groq_client:
         return False
     try:
-        result = groq_client.chat.completions.create(
+        result = groq_create(
             model="llama-3.1-8b-instant",
             messages=[
                 {
@@ -344,6 +1513,7 @@ def needs_search(message: str) -> bool:
         answer = result.choices[0].message.content.strip().upper()
         needs = answer.startswith("YES")
         print(f"[SEARCH ROUTER] '{message[:60]}...' → {answer}", flush=True)
+        log_router_decision(message, needs, "needs_search")
         return needs
     except Exception as e:
         print(f"[SEARCH ROUTER] Error: {e} — skipping search", flush=True)
@@ -354,7 +1524,7 @@ def extract_search_query(user_message: str) -> tuple:
     if not groq_client:
         return user_message, False
     try:
-        result = groq_client.chat.completions.create(
+        result = groq_create(
             model="llama-3.1-8b-instant",
             messages=[
                 {
@@ -388,33 +1558,138 @@ def extract_search_query(user_message: str) -> tuple:
         print(f"[SEARCH QUERY] Error: {e}", flush=True)
         return user_message, False
 
-def execute_web_search(user_message: str, num_results: int = 8, force_news: bool = False) -> str:
-    """Execute two DuckDuckGo searches and combine results for richer context."""
+ROUTER_SYSTEM_PROMPT = (
+    "You are a router for a chat assistant. Read the user message and reply with ONLY a JSON object "
+    "with exactly these keys:\n"
+    '{"needs_search": bool, "search_query": str, "is_news": bool, "location": str, '
+    '"wants_time": bool, "wants_weather": bool, "image_query": str}\n'
+    "Rules:\n"
+    "- needs_search: true for current events, breaking news, sports scores, stock prices, "
+    "latest/newest/recent products or releases, anything asking about right now. "
+    "false for general knowledge, theology, philosophy, how-to questions, personal conversation, "
+    "jokes, greetings, or timeless facts.\n"
+    "- search_query: a concise web search query (3-6 words). For product, tech, or 'best/latest/top' "
+    "queries, append '2026'. Empty string if needs_search is false.\n"
+    "- is_news: true if this is a NEWS request (current events, headlines, latest news).\n"
+    "- location: the city or place name the user asks about (e.g. 'weather in London' → 'London', "
+    "'what time is it in amanzimtoti' → 'Amanzimtoti'). Empty string if none.\n"
+    "- wants_time: true if asking for the current time or date somewhere.\n"
+    "- wants_weather: true if asking about weather, temperature or forecast.\n"
+    "- image_query: if the user wants to see an image, a 2-5 word image search query "
+    "(e.g. 'what does the Eiffel Tower look like' → 'Eiffel Tower Paris'). Empty string otherwise."
+)
+
+def _router_request(message: str) -> dict:
+    return dict(
+        model="llama-3.1-8b-instant",
+        messages=[
+            {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
+            {"role": "user", "content": message}
+        ],
+        temperature=0.0,
+        max_tokens=120,
+        response_format={"type": "json_object"}
+    )
+
+def _parse_route(message: str, result) -> dict:
+    raw = json.loads(result.choices[0].message.content)
+
+    def _str(key):
+        value = raw.get(key) or ""
+        value = value.strip() if isinstance(value, str) else ""
+        return "" if value.upper() == "UNKNOWN" else value
+
+    def _bool(key):
+        value = raw.get(key)
+        if isinstance(value, str):
+            return value.strip().upper() in ("YES", "TRUE")
+        return bool(value)
+
+    route = {
+        'needs_search': _bool('needs_search'),
+        'search_query': _str('search_query'),
+        'is_news': _bool('is_news'),
+        'location': _str('location'),
+        'wants_time': _bool('wants_time'),
+        'wants_weather': _bool('wants_weather'),
+        'image_query': _str('image_query'),
+    }
+    print(f"[ROUTER] '{message[:60]}' → {route}", flush=True)
+    log_router_decision(message, route['needs_search'], "router")
+    return route
+
+# Router decisions are temperature-0 reads of the message alone, so repeats reuse them
+route_cache = TTLCache(maxsize=1024, ttl=float(os.environ.get("ROUTE_CACHE_TTL", "3600")))
+
+def route_message(message: str):
+    """
+    One structured-output 8B call that answers every pre-flight question at once.
+    Returns a normalized decision dict, or None if the router is unavailable/failed
+    (chat() then falls back to the per-intent classifiers).
+    """
+    if not groq_client:
+        return None
+    cached = route_cache.get(message)
+    if cached is not None:
+        return dict(cached)
+    try:
+        route = _parse_route(message, groq_create(**_router_request(message)))
+        route_cache.set(message, route)
+        return dict(route)
+    except Exception as e:
+        print(f"[ROUTER] Error: {e} — falling back to per-intent classifiers", flush=True)
+        return None
+
+async def route_message_async(message: str):
+    """route_message() on the event loop."""
+    if not groq_async_client:
+        return None
+    cached = route_cache.get(message)
+    if cached is not None:
+        return dict(cached)
+    try:
+        route = _parse_route(message, await groq_create_async(**_router_request(message)))
+        route_cache.set(message, route)
+        return dict(route)
+    except Exception as e:
+        print(f"[ROUTER] Error: {e} — falling back to per-intent classifiers", flush=True)
+        return None
+
+web_search_flights = SingleFlight('web_search')
+
+def execute_web_search(user_message: str, num_results: int = 8, force_news: bool = False,
+                       extracted: tuple = None) -> str:
+    """Execute two DuckDuckGo searches and combine results for richer context.
+    `extracted` is an optional (query, is_news) pair already produced by extract_search_query."""
     if not ddg_available:
         return "Web search is currently unavailable."
+    key = (normalize_query(user_message), num_results, force_news,
+           (normalize_query(extracted[0]), extracted[1]) if extracted else None)
+    return web_search_flights.do(key, _execute_web_search, user_message, num_results, force_news, extracted)
+
+def _execute_web_search(user_message: str, num_results: int, force_news: bool, extracted: tuple) -> str:
     try:
-        query, is_news = extract_search_query(user_message)
+        query, is_news = extracted or extract_search_query(user_message)
         if force_news:
             is_news = True
         print(f"[WEB SEARCH] Query: '{query}' | News: {is_news} | Results: {num_results}", flush=True)
         all_results = []
         seen_urls = set()
-        with DDGS() as ddgs:
-            if is_news:
-                results = list(ddgs.news(query, max_results=num_results))
-                all_results.extend(results)
-            else:
-                primary = list(ddgs.text(query, max_results=num_results))
-                all_results.extend(primary)
-                detail_query = query + " review specs features"
-                secondary = list(ddgs.text(detail_query, max_results=6))
-                for r in primary:
-                    seen_urls.add(r.get('href', ''))
-                for r in secondary:
-                    url = r.get('href', '')
-                    if url not in seen_urls:
-                        all_results.append(r)
-                        seen_urls.add(url)
+        if is_news:
+            results = ddg_search('news', query, num_results)
+            all_results.extend(results)
+        else:
+            primary = ddg_search('text', query, num_results)
+            all_results.extend(primary)
+            detail_query = query + " review specs features"
+            secondary = ddg_search('text', detail_query, 6, optional=True)
+            for r in primary:
+                seen_urls.add(r.get('href', ''))
+            for r in secondary:
+                url = r.get('href', '')
+                if url not in seen_urls:
+                    all_results.append(r)
+                    seen_urls.add(url)
         if not all_results:
             return f"No results found for: {query}"
         formatted = f"Web search results for '{query}':\n\n"
@@ -431,23 +1706,604 @@ def execute_web_search(user_message: str, num_results: int = 8, force_news: bool
         print(f"[WEB SEARCH] Error: {e}", flush=True)
         return f"Search failed: {str(e)}"
 
-# 4. Context Loading System
-def load_context(user_message, conversation_history=None):
-    """Load relevant context files based on user message keywords"""
-    import os
-    
-    context_dir = 'contexts'
-    context = ""
-    loaded_files = []
-    
-    # Always load core identity
-    core_path = os.path.join(context_dir, 'core.txt')
-    if os.path.exists(core_path):
-        with open(core_path, 'r', encoding='utf-8') as f:
-            context += f.read() + "\n\n"
-        loaded_files.append('core.txt')
-    
-    msg_lower = user_message.lower()
+# 3d. Pre-flight stage — independent upstream calls run concurrently under one deadline
+PREFLIGHT_DEADLINE_SECONDS = float(os.environ.get("PREFLIGHT_DEADLINE_SECONDS", "10"))
+PREFLIGHT_WORKERS = int(os.environ.get("PREFLIGHT_WORKERS", "16"))
+_preflight_pool = ThreadPoolExecutor(max_workers=PREFLIGHT_WORKERS, thread_name_prefix="preflight")
+
+# Metric phase name for each pre-flight task
+PREFLIGHT_PHASES = {
+    'route': 'classify_router',
+    'weather_location': 'classify_weather_location',
+    'time_location': 'classify_time_location',
+    'image_query': 'classify_image_query',
+    'needs_search': 'classify_needs_search',
+    'search_query': 'classify_search_query',
+    'weather': 'weather',
+    'images': 'image_search',
+    'search': 'web_search',
+}
+
+def _timed_task(name: str, fn, timer):
+    """Wrap a pre-flight callable so its duration lands on the request that started it."""
+    def run():
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            record_phase(PREFLIGHT_PHASES.get(name, name), time.perf_counter() - start, timer)
+    return run
+
+def run_concurrently(tasks: dict, deadline: float, defaults: dict = None) -> dict:
+    """
+    Run independent callables at the same time and collect their results by name.
+    `deadline` is an absolute time.monotonic() value shared across stages; any task
+    still running (or failing) when it passes gets its entry from `defaults` (or None).
+    """
+    defaults = defaults or {}
+    if not tasks:
+        return {}
+    timer = _request_timer.get()
+    futures = {name: _preflight_pool.submit(_timed_task(name, fn, timer)) for name, fn in tasks.items()}
+    done, _ = futures_wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            future.cancel()
+            print(f"[PREFLIGHT] '{name}' missed the deadline — using default", flush=True)
+            metrics.inc("vq_preflight_failures_total", phase=PREFLIGHT_PHASES.get(name, name), reason="deadline")
+            results[name] = defaults.get(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"[PREFLIGHT] '{name}' failed: {e}", flush=True)
+            metrics.inc("vq_preflight_failures_total", phase=PREFLIGHT_PHASES.get(name, name), reason="error")
+            results[name] = defaults.get(name)
+    return results
+
+# Native coroutine versions of pre-flight tasks; anything not listed (the legacy
+# per-intent classifiers, DDGS — which has no async client) runs on _preflight_pool
+ASYNC_VARIANTS = {
+    route_message: route_message_async,
+    get_weather_and_time: get_weather_and_time_async,
+    get_nearest_major_city: get_nearest_major_city_async,
+}
+
+async def _run_async_task(name: str, task: partial):
+    start = time.perf_counter()
+    try:
+        variant = ASYNC_VARIANTS.get(task.func)
+        if variant is not None:
+            return await variant(*task.args, **task.keywords)
+        return await asyncio.get_running_loop().run_in_executor(_preflight_pool, task)
+    finally:
+        record_phase(PREFLIGHT_PHASES.get(name, name), time.perf_counter() - start)
+
+async def run_concurrently_async(tasks: dict, deadline: float, defaults: dict = None) -> dict:
+    """run_concurrently() for the event loop. Tasks are functools.partial objects over the sync functions."""
+    defaults = defaults or {}
+    if not tasks:
+        return {}
+    futures = {name: asyncio.ensure_future(_run_async_task(name, task)) for name, task in tasks.items()}
+    done, _ = await asyncio.wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            future.cancel()
+            print(f"[PREFLIGHT] '{name}' missed the deadline — using default", flush=True)
+            metrics.inc("vq_preflight_failures_total", phase=PREFLIGHT_PHASES.get(name, name), reason="deadline")
+            results[name] = defaults.get(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"[PREFLIGHT] '{name}' failed: {e}", flush=True)
+            metrics.inc("vq_preflight_failures_total", phase=PREFLIGHT_PHASES.get(name, name), reason="error")
+            results[name] = defaults.get(name)
+    return results
+
+# 3e. Completion engine — the main answer call runs under a deadline. Retryable Groq errors
+# are retried with full-jitter backoff while the budget lasts, then the request falls back to
+# a smaller model. With COMPLETION_HEDGE=1 a non-streaming call that outlives the recent p95
+# gets a second, identical request and whichever answers first wins.
+COMPLETION_DEADLINE_SECONDS = float(os.environ.get("COMPLETION_DEADLINE_SECONDS", "25"))
+COMPLETION_RETRIES = int(os.environ.get("COMPLETION_RETRIES", "2"))
+COMPLETION_RETRY_BACKOFF = float(os.environ.get("COMPLETION_RETRY_BACKOFF", "0.5"))
+COMPLETION_MIN_ATTEMPT_SECONDS = 2.0
+FALLBACK_MODEL = os.environ.get("FALLBACK_MODEL", "llama-3.1-8b-instant")
+FALLBACK_DEADLINE_SECONDS = float(os.environ.get("FALLBACK_DEADLINE_SECONDS", "15"))
+COMPLETION_HEDGE = os.environ.get("COMPLETION_HEDGE", "0") == "1"
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("HEDGE_MIN_DELAY_SECONDS", "1.5"))
+HEDGE_MIN_SAMPLES = 20
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("HEDGE_WORKERS", "8")), thread_name_prefix="hedge")
+
+class LatencyWindow:
+    """The last `size` latencies of successful calls, for quantile estimates."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float):
+        """The q-quantile of the window, or None until HEDGE_MIN_SAMPLES have been seen."""
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+completion_latency = LatencyWindow()
+
+def hedge_delay() -> float:
+    p95 = completion_latency.quantile(0.95)
+    return HEDGE_MIN_DELAY_SECONDS if p95 is None else max(HEDGE_MIN_DELAY_SECONDS, p95)
+
+_single_shot_clients = {}
+
+def _single_shot(client):
+    """`client` with the SDK's own retries off — the engine retries under its deadline instead."""
+    entry = _single_shot_clients.get(id(client))
+    if entry is None or entry[0] is not client:
+        entry = (client, client.with_options(max_retries=0))
+        _single_shot_clients[id(client)] = entry
+    return entry[1]
+
+def _retry_delay(error, attempt: int, remaining: float):
+    """Seconds to wait before retry number `attempt`, or None when no retry fits the budget."""
+    if attempt > COMPLETION_RETRIES or isinstance(error, UpstreamBusy):
+        return None
+    delay = random.uniform(0, COMPLETION_RETRY_BACKOFF * 2 ** (attempt - 1))
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    if delay + COMPLETION_MIN_ATTEMPT_SECONDS > remaining:
+        return None
+    return delay
+
+def _completion_failed(request: dict, attempt: int, error):
+    metrics.inc("vq_completion_errors_total", model=request['model'], error=type(error).__name__)
+    print(f"[COMPLETION] {request['model']} attempt {attempt} failed: {error}", flush=True)
+
+def _completion_path(path: str, request: dict) -> str:
+    metrics.inc("vq_completion_path_total", path=path)
+    if path != 'primary':
+        print(f"[COMPLETION] Answered via {path} ({request['model']})", flush=True)
+    return path
+
+def _fallback_request(completion_request: dict, error) -> dict:
+    """The same request against FALLBACK_MODEL, or re-raise `error` when there is none."""
+    model = FALLBACK_MODEL
+    if model == completion_request['model']:
+        # Light-tier turns already run on the fallback model; the full model backs them up
+        model = FULL_MODEL
+    if not model or model == completion_request['model']:
+        metrics.inc("vq_completion_path_total", path='failed')
+        raise error
+    return dict(completion_request, model=model)
+
+def _slot_result(limiter: UpstreamLimiter, completion_request: dict, completion):
+    """A stream carries the slot with it; any other result gives it back now."""
+    if completion_request.get('stream'):
+        return LimitedStream(completion, limiter)
+    limiter.release()
+    return completion
+
+def _limited_create(client, completion_request: dict, timeout: float):
+    """One attempt inside the model's rate-limit slot; waiting for the slot spends the same timeout."""
+    limiter = groq_limiter(completion_request['model'])
+    start = time.monotonic()
+    limiter.acquire(max_wait=min(limiter.max_wait, timeout))
+    try:
+        completion = client.chat.completions.create(**completion_request, timeout=timeout - (time.monotonic() - start))
+    except BaseException:
+        limiter.release()
+        raise
+    return _slot_result(limiter, completion_request, completion)
+
+async def _limited_create_async(client, completion_request: dict, timeout: float):
+    limiter = groq_limiter(completion_request['model'])
+    start = time.monotonic()
+    await limiter.acquire_async(max_wait=min(limiter.max_wait, timeout))
+    try:
+        completion = await client.chat.completions.create(**completion_request, timeout=timeout - (time.monotonic() - start))
+    except BaseException:
+        limiter.release()
+        raise
+    return _slot_result(limiter, completion_request, completion)
+
+def _hedged_create(client, completion_request: dict, timeout: float) -> tuple:
+    """(completion, hedged) — fires a second request if the first outlives hedge_delay()."""
+    create = partial(_limited_create, client, completion_request, timeout)
+    first = _hedge_pool.submit(create)
+    if futures_wait([first], timeout=min(hedge_delay(), timeout)).done:
+        return first.result(), False
+    metrics.inc("vq_completion_hedges_total")
+    second = _hedge_pool.submit(create)
+    pending, error = {first, second}, None
+    while pending:
+        done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                # The loser cannot be interrupted; it finishes on the pool and is dropped
+                return future.result(), future is second
+            except Exception as e:
+                error = e
+    raise error
+
+def complete_chat(completion_request: dict) -> tuple:
+    """
+    Make the main answer call (streaming or not) under COMPLETION_DEADLINE_SECONDS.
+    Returns (completion, path) where path is 'primary', 'retry', 'hedge' or 'fallback'.
+    For streams the deadline covers opening the stream; tokens then flow as they come.
+    """
+    client = _single_shot(groq_client)
+    deadline = time.monotonic() + COMPLETION_DEADLINE_SECONDS
+    hedge = COMPLETION_HEDGE and not completion_request.get('stream')
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            if hedge:
+                completion, hedged = _hedged_create(client, completion_request, deadline - start)
+            else:
+                completion = _limited_create(client, completion_request, deadline - start)
+                hedged = False
+        except GROQ_RETRYABLE + (UpstreamBusy,) as e:
+            attempt += 1
+            _completion_failed(completion_request, attempt, e)
+            delay = _retry_delay(e, attempt, deadline - time.monotonic())
+            if delay is None:
+                fallback = _fallback_request(completion_request, e)
+                break
+            time.sleep(delay)
+            continue
+        if not completion_request.get('stream'):
+            completion_latency.add(time.monotonic() - start)
+        return completion, _completion_path('hedge' if hedged else 'retry' if attempt else 'primary', completion_request)
+    try:
+        completion = _limited_create(client, fallback, FALLBACK_DEADLINE_SECONDS)
+    except Exception:
+        metrics.inc("vq_completion_path_total", path='failed')
+        raise
+    return completion, _completion_path('fallback', fallback)
+
+async def _hedged_create_async(client, completion_request: dict, timeout: float) -> tuple:
+    """_hedged_create() on the event loop; the losing request is cancelled."""
+    def create():
+        return asyncio.ensure_future(_limited_create_async(client, completion_request, timeout))
+    first = create()
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=min(hedge_delay(), timeout))
+        if done:
+            return first.result(), False
+        metrics.inc("vq_completion_hedges_total")
+        second = create()
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), future is second
+                error = future.exception()
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+async def complete_chat_async(completion_request: dict) -> tuple:
+    """complete_chat() for the ASGI serving mode."""
+    client = _single_shot(groq_async_client)
+    deadline = time.monotonic() + COMPLETION_DEADLINE_SECONDS
+    hedge = COMPLETION_HEDGE and not completion_request.get('stream')
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            if hedge:
+                completion, hedged = await _hedged_create_async(client, completion_request, deadline - start)
+            else:
+                completion = await _limited_create_async(client, completion_request, deadline - start)
+                hedged = False
+        except GROQ_RETRYABLE + (UpstreamBusy,) as e:
+            attempt += 1
+            _completion_failed(completion_request, attempt, e)
+            delay = _retry_delay(e, attempt, deadline - time.monotonic())
+            if delay is None:
+                fallback = _fallback_request(completion_request, e)
+                break
+            await asyncio.sleep(delay)
+            continue
+        if not completion_request.get('stream'):
+            completion_latency.add(time.monotonic() - start)
+        return completion, _completion_path('hedge' if hedged else 'retry' if attempt else 'primary', completion_request)
+    try:
+        completion = await _limited_create_async(client, fallback, FALLBACK_DEADLINE_SECONDS)
+    except Exception:
+        metrics.inc("vq_completion_path_total", path='failed')
+        raise
+    return completion, _completion_path('fallback', fallback)
+
+# 4. Context Loading System
+CONTEXT_DIR = os.environ.get("CONTEXT_DIR", "contexts")
+CONTEXT_RELOAD_SECONDS = float(os.environ.get("CONTEXT_RELOAD_SECONDS", "10"))
+
+# Files whose sections are retrieved by relevance instead of being injected whole on a keyword hit.
+# The deployed frameworks and the gated eschatology file stay whole.
+RETRIEVAL_FILES = (
+    'about_cai_core.txt', 'ai_index.txt', 'beta_tools.txt', 'mission_vision.txt',
+    'milestones.txt', 'vq1_robot.txt', 'contact_social.txt', 'developments.txt',
+)
+# core.txt is always loaded, but its reference blocks (by banner title) are retrieved like the
+# files above; identity, voice and behaviour rules stay in every prompt
+CORE_RETRIEVED_BLOCKS = (
+    "CAI's take on evolution", 'THE TECHNICAL FRAMEWORK', 'HOW CAI ALIGNMENT WORKS',
+    'OPERATIONAL EXCELLENCE', 'WEBSITE STRUCTURE', 'Developments.txt',
+    'TECHNICAL CHRISTIANITY CURRICULUM', 'VQ-1 ROBOT', 'PRIOR MANIPULATION',
+)
+CONTEXT_RETRIEVAL = os.environ.get("CONTEXT_RETRIEVAL", "1") != "0"
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_MAX_CHARS = int(os.environ.get("RETRIEVAL_MAX_CHARS", "6000"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "3.0"))
+SECTION_MIN_CHARS = 400
+SECTION_MAX_CHARS = 1200
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_HEADING_RE = re.compile(r"^(?:={3,}.*|[A-Z0-9][A-Z0-9 &/()'\-—|.,]{3,}:?)$")
+_RULE_RE = re.compile(r"^[=\-]{3,}$")
+# Editorial placeholders left in the corpus for whoever updates it next
+_PLACEHOLDER_RE = re.compile(r"\[(?:INSERT|TBD|TODO)\]|^\[(?:Update|Add|Insert) [^\]]*\]$")
+_STOPWORDS = frozenset("""
+a about also am an and are as at be but by can do does for from get has have hello hey hi how
+i if im in into is it its just know like me more my no not of on or our please show so tell
+that the their them then there these they this to try use want was we what when where which
+who why will with you your
+""".split())
+
+def _index_terms(text: str) -> list:
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS]
+
+def _is_heading(para: str) -> bool:
+    return all(_HEADING_RE.match(line) for line in para.split("\n"))
+
+def split_sections(filename: str, text: str, title: str = None) -> list:
+    """
+    Split a context file into retrieval sections. Headings are joined to the paragraphs
+    under them, and a section only closes at a heading once it holds SECTION_MIN_CHARS of
+    body (or would pass SECTION_MAX_CHARS). Rules, placeholders and routing metadata are
+    dropped, as is a heading with nothing under it. Each section is prefixed with the file
+    title so a lone chunk still says where it came from.
+    """
+    title = title or text.strip().split("\n", 1)[0].strip()
+    bodies, current = [], []
+
+    def body_size() -> int:
+        return sum(len(p) for p in current if not _is_heading(p))
+
+    def flush():
+        if body_size():
+            bodies.append("\n\n".join(current))
+        current.clear()
+
+    for para in re.split(r"\n\s*\n", text):
+        # TRIGGER WORDS lines are keyword-routing metadata, not knowledge
+        lines = [
+            l.rstrip() for l in para.strip().split("\n")
+            if l.strip() and not l.startswith("TRIGGER WORDS:")
+            and not _RULE_RE.match(l.strip()) and not _PLACEHOLDER_RE.search(l.strip())
+        ]
+        if lines and lines[0].strip() == title:
+            lines = lines[1:]
+        para = "\n".join(lines).strip()
+        if not para:
+            continue
+        size = body_size()
+        starts_heading = bool(_HEADING_RE.match(lines[0].strip()))
+        if size >= SECTION_MIN_CHARS and (starts_heading or size + len(para) > SECTION_MAX_CHARS):
+            flush()
+        current.append(para)
+    flush()
+    # A short last section joins the one before it
+    if len(bodies) > 1 and len(bodies[-1]) < SECTION_MIN_CHARS:
+        tail = bodies.pop()
+        bodies[-1] += "\n\n" + tail
+    return [f"[{title}]\n{body}" for body in bodies]
+
+def split_core(text: str) -> tuple:
+    """
+    (pinned, retrieved) halves of core.txt. Blocks open with a title between two rule lines;
+    those named in CORE_RETRIEVED_BLOCKS go to the retrieval index, the rest stay pinned.
+    """
+    lines = text.split("\n")
+    starts = [0] + [
+        i - 1 for i in range(2, len(lines) - 1)
+        if lines[i].strip() and _RULE_RE.match(lines[i - 1].strip()) and _RULE_RE.match(lines[i + 1].strip())
+    ]
+    pinned, retrieved = [], []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        block = "\n".join(lines[start:end]).strip()
+        block_title = lines[start + 1].strip() if start else ""
+        (retrieved if start and block_title.startswith(CORE_RETRIEVED_BLOCKS) else pinned).append(block)
+    return "\n\n".join(pinned) + "\n", "\n\n".join(retrieved)
+
+class SectionIndex:
+    """Okapi BM25 over context-file sections. Built in memory; no network, no dependencies."""
+
+    def __init__(self, files: dict, k1: float = 1.5, b: float = 0.75, titles: dict = None):
+        self.k1, self.b = k1, b
+        self.sections = []
+        for filename, text in files.items():
+            for i, section in enumerate(split_sections(filename, text, (titles or {}).get(filename))):
+                self.sections.append((filename, i, section))
+        self._tfs = []
+        df = {}
+        for _, _, section in self.sections:
+            tf = {}
+            for term in _index_terms(section):
+                tf[term] = tf.get(term, 0) + 1
+            self._tfs.append((tf, sum(tf.values())))
+            for term in tf:
+                df[term] = df.get(term, 0) + 1
+        n = len(self.sections)
+        self._avg_len = sum(length for _, length in self._tfs) / n if n else 0.0
+        self._idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+        self._postings = {}
+        for idx, (tf, _) in enumerate(self._tfs):
+            for term in tf:
+                self._postings.setdefault(term, []).append(idx)
+        self._by_file = {}
+        for idx, (filename, _, _) in enumerate(self.sections):
+            self._by_file.setdefault(filename, []).append(idx)
+
+    def _scores(self, query: str) -> dict:
+        terms = set(_index_terms(query))
+        scores = {}
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for idx in self._postings[term]:
+                tf, length = self._tfs[idx]
+                freq = tf[term]
+                norm = freq * (self.k1 + 1) / (freq + self.k1 * (1 - self.b + self.b * length / self._avg_len))
+                scores[idx] = scores.get(idx, 0.0) + idf * norm
+        return scores
+
+    def search(self, query: str, top_k: int, max_chars: int, min_score: float = 0.0,
+               exclude: set = frozenset(), skip: set = frozenset()) -> list:
+        """
+        Best (filename, section_no, text, score) hits for query, within top_k and max_chars.
+        `exclude` leaves out whole files, `skip` individual (filename, section_no) sections.
+        """
+        scores = self._scores(query)
+        hits, used = [], 0
+        for idx in sorted(scores, key=scores.get, reverse=True):
+            if len(hits) >= top_k or scores[idx] < min_score:
+                break
+            filename, section_no, text = self.sections[idx]
+            if filename in exclude or (filename, section_no) in skip or used + len(text) > max_chars:
+                continue
+            hits.append((filename, section_no, text, scores[idx]))
+            used += len(text)
+        return hits
+
+    def opening_section(self, filename: str):
+        """(filename, section_no, text, 0.0) for a file's first substantive section, or None."""
+        indexes = self._by_file.get(filename)
+        if not indexes:
+            return None
+        idx = next((i for i in indexes if len(self.sections[i][2]) >= SECTION_MIN_CHARS), indexes[0])
+        filename, section_no, text = self.sections[idx]
+        return filename, section_no, text, 0.0
+
+class ContextStore:
+    """
+    Memory-resident copy of every contexts/*.txt file.
+    Loaded once at worker startup; a daemon thread polls mtimes and swaps in
+    a fresh snapshot when files change, so requests never touch the disk.
+    """
+
+    def __init__(self, context_dir: str, reload_seconds: float = 10.0):
+        self.context_dir = context_dir
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._mtimes = {}
+        self._files = MappingProxyType({})
+        self.index = SectionIndex({})
+        self.core_pinned = None
+        self.reload()
+        if reload_seconds > 0:
+            threading.Thread(target=self._watch, name="context-watcher", daemon=True).start()
+
+    def _scan(self) -> dict:
+        mtimes = {}
+        try:
+            with os.scandir(self.context_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith('.txt'):
+                        mtimes[entry.name] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return mtimes
+
+    def reload(self, mtimes: dict = None) -> bool:
+        """Re-read the corpus if anything changed. Returns True when a new snapshot was installed."""
+        mtimes = self._scan() if mtimes is None else mtimes
+        with self._lock:
+            if mtimes == self._mtimes and self._files:
+                return False
+            files = {}
+            for name, mtime in mtimes.items():
+                if self._mtimes.get(name) == mtime and name in self._files:
+                    files[name] = self._files[name]
+                    continue
+                try:
+                    with open(os.path.join(self.context_dir, name), 'r', encoding='utf-8') as f:
+                        files[name] = f.read()
+                except OSError as e:
+                    print(f"[CONTEXT STORE] Failed to read {name}: {e}", flush=True)
+            indexed = {name: files[name] for name in RETRIEVAL_FILES if name in files}
+            titles = {}
+            core_pinned = None
+            if 'core.txt' in files:
+                core_pinned, indexed['core.txt'] = split_core(files['core.txt'])
+                titles['core.txt'] = files['core.txt'].strip().split("\n", 1)[0].strip()
+            self._files = MappingProxyType(files)
+            self._mtimes = mtimes
+            self.index = SectionIndex(indexed, titles=titles)
+            self.core_pinned = core_pinned
+        print(f"[CONTEXT STORE] Loaded {len(files)} files ({sum(len(v) for v in files.values())} chars), "
+              f"{len(self.index.sections)} retrieval sections", flush=True)
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_seconds)
+            try:
+                mtimes = self._scan()
+                if mtimes != self._mtimes:
+                    self.reload(mtimes)
+            except Exception as e:
+                print(f"[CONTEXT STORE] Watcher error: {e}", flush=True)
+
+    def get(self, name: str):
+        """Return the cached text of a context file, or None if it doesn't exist."""
+        return self._files.get(name)
+
+    def names(self) -> list:
+        return sorted(self._files)
+
+context_store = ContextStore(CONTEXT_DIR, CONTEXT_RELOAD_SECONDS)
+
+def load_context(user_message, conversation_history=None):
+    """
+    Select relevant context files based on user message keywords.
+    Returns (label, text, priority) blocks in load order; priority feeds the
+    prompt token budget (1 = core/explicitly requested, 2 = deployed frameworks,
+    3 = broad keyword matches, dropped first).
+    """
+    blocks = []
+    loaded_files = []
+
+    def add(label, text, priority):
+        blocks.append((label, text, priority))
+        loaded_files.append(label)
+
+    # Always load core identity (with retrieval on, its reference blocks are retrieved below)
+    core_text = context_store.core_pinned if CONTEXT_RETRIEVAL else context_store.get('core.txt')
+    if core_text is not None:
+        add('core.txt', core_text, 1)
+    
+    msg_lower = user_message.lower()
 
     # PREFIX OVERRIDES — capability menu pills inject these prefixes
     # Detected first, highest priority, no keyword ambiguity
@@ -471,158 +2327,100 @@ def load_context(user_message, conversation_history=None):
             break
 
     # Directly load context file for prefix-activated modes
-    if active_prefix == 'ets_full':
-        filepath = os.path.join(context_dir, 'ets_full.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('ets_full.txt [PREFIX]')
-    elif active_prefix == 'cai_vqa':
-        filepath = os.path.join(context_dir, 'cai_vqa.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('cai_vqa.txt [PREFIX]')
-    elif active_prefix == 'cai_evolution':
-        filepath = os.path.join(context_dir, 'cai_evolution.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('cai_evolution.txt [PREFIX]')
-
-    # Load about_cai_core.txt for identity/foundational questions
-    about_triggers = ['what is cai', 'what is christ-anchored', 'who are you', 'about', 
-                     'safe harbor', 'character', 'alignment', 'imago dei', 'image-bearer',
-                     'servant leadership', 'dignity', 'bias', 'naturalistic', 'symmetric',
-                     'epistemic symmetry', 'operational excellence', 'why cai', 
-                     'what makes cai different', 'traditional ai', 'hallucinate']
-    
-    if any(trigger in msg_lower for trigger in about_triggers):
-        about_path = os.path.join(context_dir, 'about_cai_core.txt')
-        if os.path.exists(about_path):
-            with open(about_path, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('about_cai_core.txt')
-    
-    # Keyword detection for other context files
-    keywords = {
-        'ai_index.txt': ['cai', 'framework', 'methodology', 'bayesian', 'evidence', 'symmetric', 
-                         'standards', 'resurrection', 'probability', 'mechanism', 'epistemic', 
-                         'singularity', 'abiogenesis', 'naturalism', 'how does', 'why', 'explain'],
-        'beta_tools.txt': ['tool', 'engine', 'crucible', 'calculator', 'beta', 'test', 
-                          'huggingface', 'space', 'interactive', 'try', 'use'],
-        'mission_vision.txt': ['mission', 'vision', 'safe harbor', 'agi', 'cagi', 'alignment', 
-                               'goal', 'purpose', 'why', 'mandate', 'values', 'character'],
-        'milestones.txt': ['milestone', 'project', 'achievement', 'grok', 'gemini', 'copilot', 
-                          'november', 'breakthrough', 'persuasion', 'latest', 'news', 'recent'],
-        'vq1_robot.txt': ['robot', 'vq-1', 'vq1', 'reachy', 'physical', 'february', 'launch', 
-                         'embodiment', 'robotics'],
-        'contact_social.txt': ['contact', 'email', 'social', 'twitter', 'linkedin', 'github', 
-                              'huggingface', 'reach', 'connect', 'follow', 'collaboration',
-                              'grokipedia', 'grok', 'indexed', 'knowledge base', 'validation', 'recognition'],
-        'developments.txt': ['latest', 'recent', 'update', 'news', 'reachy', 'assembly',
-                             'progress', 'twitter', 'x.com', 'new', 'development', 'eat',
-                             'announcement', 'launched', 'deployed', 'release', 'robot body',
-                             'what have you been', 'programming', 'physical', 'vq-1', 'vq1',
-                             'who are you', 'what are you', 'tell me about yourself', 'what is cai',
-                             'what is vq', 'identity', 'cai', 'christ-anchored', 'mission',
-                             'currently', 'right now', 'today', 'this week', 'happening',
-                             'working on', 'building', 'veritas', 'quaesitor']
+    prefix_files = {
+        'ets_full': 'ets_full.txt',
+        'cai_vqa': 'cai_vqa.txt',
+        'cai_evolution': 'cai_evolution.txt',
     }
-    
-    # Load relevant context files
-    for filename, trigger_words in keywords.items():
-        if any(word in msg_lower for word in trigger_words):
-            filepath = os.path.join(context_dir, filename)
-            if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    context += f.read() + "\n\n"
-                loaded_files.append(filename)
+    if active_prefix in prefix_files:
+        filename = prefix_files[active_prefix]
+        text = context_store.get(filename)
+        if text is not None:
+            add(f'{filename} [PREFIX]', text, 1)
+
+    # One scan of the (prefix-stripped) message answers every keyword check below
+    triggers = match_triggers(msg_lower)
+
+    # Keyword detection for other context files (trigger group → file, in load order)
+    keyword_files = {
+        'ai_index': 'ai_index.txt',
+        'beta_tools': 'beta_tools.txt',
+        'mission_vision': 'mission_vision.txt',
+        'milestones': 'milestones.txt',
+        'vq1_robot': 'vq1_robot.txt',
+        'contact_social': 'contact_social.txt',
+        'developments': 'developments.txt',
+    }
+    triggered_files = [filename for group, filename in keyword_files.items() if group in triggers]
+
+    if CONTEXT_RETRIEVAL:
+        # Files the trigger groups name are a floor under retrieval: each contributes its opening
+        # section (the file's overview — contact channels, mission, latest news), so questions
+        # made of stopwords like "who are you" or "what is cai" still get that file's grounding
+        floor_files = (['about_cai_core.txt'] if 'about' in triggers else []) + triggered_files
+        picked, used = [], 0
+        for filename in floor_files:
+            hit = context_store.index.opening_section(filename)
+            if hit is not None and used + len(hit[2]) <= RETRIEVAL_MAX_CHARS:
+                picked.append(hit)
+                used += len(hit[2])
+
+        # Section retrieval fills what is left of the budget with the best-matching passages
+        # of the site-knowledge files, instead of whole files on any keyword hit
+        picked += context_store.index.search(
+            msg_lower, max(0, RETRIEVAL_TOP_K - len(picked)), RETRIEVAL_MAX_CHARS - used, RETRIEVAL_MIN_SCORE,
+            exclude={label.split(' ')[0] for label, _, _ in blocks if label != 'core.txt'},
+            skip={(filename, section_no) for filename, section_no, _, _ in picked}
+        )
+        for filename, section_no, text, score in picked:
+            add(f'{filename}#{section_no}', text, 3)
+    else:
+        # Load about_cai_core.txt for identity/foundational questions
+        if 'about' in triggers:
+            text = context_store.get('about_cai_core.txt')
+            if text is not None:
+                add('about_cai_core.txt', text, 2)
+
+        # Load relevant context files
+        for filename in triggered_files:
+            text = context_store.get(filename)
+            if text is not None:
+                add(filename, text, 3)
     
     # CAI VQA — Counter-agent field manual
     # Fires ONLY when: AI confrontation signal + theological keyword (both required)
-    ai_confrontation_signals = [
-        'grok says', 'grok said', 'chatgpt says', 'chatgpt said',
-        'gemini says', 'gemini said', 'ai says', 'ai said', 'ai told me',
-        'another ai', 'it responded', 'it said that', 'how do i counter',
-        'how do i respond', 'what should i say', 'ai responded',
-        'llm says', 'copilot says', 'perplexity says', 'the ai',
-        'ai thinks', 'ai claims'
-    ]
-    theological_keywords = [
-        'resurrection', 'evidence', 'naturalism', 'abiogenesis', 'mechanism',
-        'christian', 'christianity', 'god', 'jesus', 'bible', 'theism',
-        'theistic', 'bayesian', 'epistemic', 'probability', 'proof'
-    ]
-    if (any(signal in msg_lower for signal in ai_confrontation_signals) and
-            any(theo in msg_lower for theo in theological_keywords)):
-        filepath = os.path.join(context_dir, 'cai_vqa.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('cai_vqa.txt')
+    if 'ai_confrontation' in triggers and 'theological' in triggers:
+        text = context_store.get('cai_vqa.txt')
+        if text is not None:
+            add('cai_vqa.txt', text, 2)
             print(f"[CAI VQA] Counter-agent manual loaded", flush=True)
 
     # APPRECIATION FULL — intentional deployment only
-    appreciation_full_triggers = [
-        'appreciation framework', 'full appreciation', 'run appreciation',
-        'appreciation depth', 'appreciation mode', 'deploy appreciation'
-    ]
-    if any(trigger in msg_lower for trigger in appreciation_full_triggers):
-        filepath = os.path.join(context_dir, 'appreciation_full.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('appreciation_full.txt')
+    if 'appreciation_full' in triggers:
+        text = context_store.get('appreciation_full.txt')
+        if text is not None:
+            add('appreciation_full.txt', text, 2)
             print(f"[APPRECIATION FULL] Framework loaded", flush=True)
 
     # ETS FULL — intentional deployment only
-    ets_full_triggers = [
-        'full ets', 'ets protocol', 'run ets', 'tier system full',
-        'decision flow', 'corruption resistance', 'ets framework',
-        'deploy ets', 'load ets'
-    ]
-    if any(trigger in msg_lower for trigger in ets_full_triggers):
-        filepath = os.path.join(context_dir, 'ets_full.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('ets_full.txt')
+    if 'ets_full' in triggers:
+        text = context_store.get('ets_full.txt')
+        if text is not None:
+            add('ets_full.txt', text, 2)
             print(f"[ETS FULL] Framework loaded", flush=True)
 
     # ESCHATOLOGY GATING
     # EVOLUTION POSITION — fires on evolution/origins/design debate keywords
-    evolution_triggers = [
-        'evolution', 'evolutionary', 'darwin', 'darwinian', 'natural selection',
-        'macro-evolution', 'macro evolution', 'abiogenesis', 'origin of life',
-        'intelligent design', 'creationism', 'cambrian', 'fossil record',
-        'survival of the fittest', 'common descent', 'richard dawkins',
-        'pseudo-science', 'pseudoscience', 'science vs religion',
-        'science vs faith', 'faith vs science', 'religion vs science',
-        'conflict thesis', 'did god create', 'how did life begin',
-        'how did life start', 'where did life come from', 'primordial soup',
-        'random mutation', 'undirected', 'irreducible complexity',
-        'stephen meyer', 'michael behe', 'douglas axe', 'fred hoyle'
-    ]
-    if any(trigger in msg_lower for trigger in evolution_triggers):
-        filepath = os.path.join(context_dir, 'cai_evolution.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                context += f.read() + "\n\n"
-            loaded_files.append('cai_evolution.txt')
+    if 'evolution' in triggers:
+        text = context_store.get('cai_evolution.txt')
+        if text is not None:
+            add('cai_evolution.txt', text, 2)
             print(f"[EVOLUTION] Position document loaded", flush=True)
 
-    eschatology_triggers = ['heaven', 'hell', 'afterlife', 'judgment', 'damnation', 
-                           'salvation', 'eternal', 'eternity', 'unreached', 'condemned',
-                           'damned', 'saved', 'perish', 'lake of fire', 'second death']
-    
-    if any(trigger in msg_lower for trigger in eschatology_triggers):
-        filepath = os.path.join(context_dir, 'eschatology.txt')
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                eschatology_content = f.read()
-            
-            context += """
+    if 'eschatology' in triggers:
+        eschatology_content = context_store.get('eschatology.txt')
+        if eschatology_content is not None:
+            add('eschatology.txt [GATED]', """
 === ESCHATOLOGY KNOWLEDGE (EMERGENCY USE ONLY) ===
 
 [CRITICAL DIRECTIVE - READ CAREFULLY]
@@ -657,11 +2455,10 @@ If the person INSISTS after this and you detect genuine crisis markers, you may
 
 The theology below is for YOUR understanding so you don't give confused or contradictory responses. It is NOT for routine sharing.
 
-""" + eschatology_content + "\n\n"
-            loaded_files.append('eschatology.txt [GATED]')
+""" + eschatology_content, 2)
     
     print(f"Loaded contexts: {', '.join(loaded_files)}", flush=True)
-    return context
+    return blocks
 
 def build_appreciation_frame(user_message):
     """
@@ -706,8 +2503,181 @@ Without announcing it.
 
 """
 
-def format_page_context(context):
-    """Format page context for inclusion in system prompt"""
+# 4b. Page-content condenser — extension pages can be whole external sites. One pass over the
+# text drops boilerplate, repeated lines and repeated blocks; the surviving passages are cached
+# per url+content hash, and each turn keeps the ones most relevant to its message, in page order.
+PAGE_CONTENT_MAX_CHARS = int(os.environ.get("PAGE_CONTENT_MAX_CHARS", "6000"))
+PAGE_PASSAGE_MAX_CHARS = 800
+PAGE_LEAD_PASSAGES = 2
+page_content_cache = TTLCache(maxsize=int(os.environ.get("PAGE_CACHE_SIZE", "256")),
+                              ttl=float(os.environ.get("PAGE_CACHE_TTL", "1800")))
+
+_BOILERPLATE_RE = re.compile(
+    r"(?:accept (?:all )?cookies|cookie (?:policy|settings|preferences)|we use cookies|privacy policy|"
+    r"terms (?:of (?:use|service)|and conditions)|all rights reserved|©|\(c\) \d{4}|"
+    r"^(?:sign (?:in|up)|log ?in|log ?out|register|subscribe|menu|search|skip to (?:main )?content|"
+    r"share(?: this)?(?: on \w+)?|follow us|back to top|advertisement|sponsored|read more|load more|"
+    r"next|previous|home|close|print|email|tweet|like|reply|show more|see all)$|"
+    r"^share on |newsletter|sign up for)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_SENTENCE_END = ('.', '!', '?', ':', '"', "'", ')', '”', '’')
+_CLAUSE_END = _SENTENCE_END + (',', ';')
+_DIGIT_RE = re.compile(r"\d")
+
+def _iter_lines(text: str):
+    """Stripped lines of text, yielded one at a time without splitting the whole string."""
+    start, end = 0, len(text)
+    while start <= end:
+        nl = text.find("\n", start)
+        if nl < 0:
+            nl = end
+        yield text[start:nl].strip()
+        start = nl + 1
+
+def _split_long_line(line: str, limit: int) -> list:
+    """A line cut into pieces of at most `limit` chars, at sentence ends where possible, else at spaces."""
+    pieces = []
+    while len(line) > limit:
+        cut = max(line.rfind(". ", 0, limit), line.rfind("? ", 0, limit), line.rfind("! ", 0, limit))
+        if cut < limit // 2:
+            cut = line.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit - 1
+        pieces.append(line[:cut + 1].strip())
+        line = line[cut + 1:].strip()
+    if line:
+        pieces.append(line)
+    return pieces
+
+def _looks_like_navigation(run: list) -> bool:
+    """Menu-style lines: a few words each, no numbers, no clause punctuation (unlike lists, steps or verses)."""
+    return all(len(line.split()) <= 3 and not _DIGIT_RE.search(line) and not line.endswith(_CLAUSE_END)
+               for line in run)
+
+class PagePassages:
+    """Deduplicated, boilerplate-free passages of one page, with the index terms of each."""
+
+    def __init__(self, passages: list, source_chars: int):
+        self.passages = passages
+        self.terms = [frozenset(_index_terms(p)) for p in passages]
+        self.source_chars = source_chars
+        self.chars = sum(len(p) for p in passages)
+
+def extract_passages(content: str) -> PagePassages:
+    """
+    Stream page text line by line into passages (blank-line separated, capped at
+    PAGE_PASSAGE_MAX_CHARS; longer lines are split, never cut). Boilerplate lines, lines
+    already seen and passages already seen are dropped, as are runs of three or more short
+    lines that look like navigation or recur elsewhere on the page. Short runs that are
+    lists, steps or verses stay.
+    """
+    passages, current, size = [], [], 0
+    seen_lines, seen_passages = set(), set()
+    short_run = []
+    # How often each short line occurs, so a block repeated across the page (header,
+    # footer, sidebar) goes even where it first appears
+    short_counts = {}
+    for line in _iter_lines(content):
+        if line and len(line) < 40:
+            norm = _SPACE_RE.sub(" ", line.lower())
+            short_counts[norm] = short_counts.get(norm, 0) + 1
+
+    def flush_short_run():
+        nonlocal size
+        repeated = sum(1 for line in short_run if short_counts.get(_SPACE_RE.sub(" ", line.lower()), 0) > 1)
+        if len(short_run) < 3 or not (_looks_like_navigation(short_run) or repeated * 2 > len(short_run)):
+            current.extend(short_run)
+            size += sum(len(line) for line in short_run)
+        short_run.clear()
+
+    def flush():
+        nonlocal size
+        flush_short_run()
+        if current:
+            passage = "\n".join(current)
+            key = hashlib.sha1(_SPACE_RE.sub(" ", passage.lower()).encode('utf-8')).digest()
+            if key not in seen_passages:
+                seen_passages.add(key)
+                passages.append(passage)
+        current.clear()
+        size = 0
+
+    for line in _iter_lines(content):
+        if not line:
+            flush()
+            continue
+        if _BOILERPLATE_RE.search(line) and len(line) < 200:
+            continue
+        norm = _SPACE_RE.sub(" ", line.lower())
+        if len(norm) > 3:
+            if norm in seen_lines:
+                continue
+            seen_lines.add(norm)
+        if len(line) < 40 and not line.endswith(_SENTENCE_END):
+            short_run.append(line)
+            continue
+        flush_short_run()
+        for piece in _split_long_line(line, PAGE_PASSAGE_MAX_CHARS):
+            if size + len(piece) > PAGE_PASSAGE_MAX_CHARS and current:
+                flush()
+            current.append(piece)
+            size += len(piece)
+    flush()
+    return PagePassages(passages, len(content))
+
+def page_passages(url: str, content: str) -> PagePassages:
+    """extract_passages(), cached by a hash of url + content so follow-up turns skip the work."""
+    digest = hashlib.sha256()
+    digest.update(url.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(content.encode('utf-8', 'replace'))
+    key = digest.digest()
+    cached = page_content_cache.get(key)
+    if cached is None:
+        cached = extract_passages(content)
+        page_content_cache.set(key, cached)
+    return cached
+
+def condense_page_content(url: str, content: str, query: str = "", max_chars: int = PAGE_CONTENT_MAX_CHARS) -> str:
+    """
+    Page content cut down to max_chars. Content that already fits is returned untouched;
+    otherwise the cleaned passages as-is when they fit, else the lead passages plus those
+    sharing the most terms with query, in page order, with gaps marked by [...].
+    """
+    if len(content) <= max_chars:
+        return content.strip()
+    page = page_passages(url, content)
+    passages = page.passages
+    if not passages:
+        # Cleaning found nothing worth keeping — better the raw opening than an empty page
+        head = content.strip()[:max_chars - 6]
+        return head[:head.rfind(" ")] + " [...]" if " " in head else head
+    if page.chars <= max_chars:
+        return "\n\n".join(passages)
+    query_terms = set(_index_terms(query))
+    # Earlier passages get a small positional edge so ties (and term-less queries like
+    # "summarize this") favour the top of the page
+    def score(i):
+        overlap = len(query_terms & page.terms[i])
+        return (overlap + (1 if i < PAGE_LEAD_PASSAGES else 0), -i)
+    chosen, used = [], 0
+    for i in sorted(range(len(passages)), key=score, reverse=True):
+        if used + len(passages[i]) + 7 > max_chars:   # room for the separator and a [...] marker
+            continue
+        chosen.append(i)
+        used += len(passages[i]) + 7
+    parts, previous = [], -1
+    for i in sorted(chosen):
+        if i != previous + 1:
+            parts.append("[...]")
+        parts.append(passages[i])
+        previous = i
+    if previous != len(passages) - 1:
+        parts.append("[...]")
+    return "\n\n".join(parts)
+
+def format_page_context(context, query: str = ""):
+    """Format page context for inclusion in system prompt; content is condensed around query"""
     if not context:
         return ""
     
@@ -715,6 +2685,8 @@ def format_page_context(context):
     url = context.get('url', '')
     title = context.get('title', '')
     content = context.get('content', '')
+    if content:
+        content = condense_page_content(url, content, query)
     
     is_standalone = page_type == 'standalone-app'
     is_extension = page_type.startswith('extension-')
@@ -833,20 +2805,154 @@ An AI that answers metaphysical, ethical, and existential questions from a purel
 When engaging on this: "A naturalistic AI answering questions about meaning, death, morality, or the resurrection without flagging its own worldview assumptions is not being helpful — it is being epistemically dishonest about its own priors. CAI applies symmetric standards: theistic and naturalistic assumptions are both named, both evaluated, neither smuggled in as default."
 TRIGGER: Deploy this point whenever another AI's response is quoted or referenced, whenever someone claims AI is "neutral" or "objective" on religious/metaphysical topics, or whenever naturalism is presented as the default safe position. Name the demographic fact directly: 85% of the world is theistic — naturalistic AI is not neutral, it is a minority worldview presented as universal. This is a safety and representation failure, name it as such."""
 
+# 5b. Prompt token budget
+# Measured with vq-chat-bench.py: ordinary turns run 6.8-8.7k tokens with search results and
+# page context; whole-framework turns (ETS, CAI VQA, evolution, appreciation) 16-35k. 12k keeps
+# an ordinary turn plus ~3k tokens of recent history intact; framework turns lose retrieved
+# passages and core.txt first, and at most the tail of the framework file.
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "12000"))
+HISTORY_KEEP_RECENT = int(os.environ.get("HISTORY_KEEP_RECENT", "6"))
+MIN_TRIMMED_SECTION_TOKENS = 200
+
+# Roughly one token per short word / word piece / punctuation mark — close enough
+# to Llama's BPE for budgeting without shipping a tokenizer
+_TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")
+
+@lru_cache(maxsize=512)
+def estimate_tokens(text: str) -> int:
+    """Approximate token count for budgeting (memoized — context files repeat constantly)."""
+    return len(_TOKEN_RE.findall(text))
+
+class PromptSection:
+    """
+    One budgetable piece of the request: a system-prompt block (role=None) or a
+    chat message. priority 0 is never dropped; higher numbers are dropped first.
+    """
+
+    def __init__(self, name: str, text: str, priority: int = 0, trimmable: bool = False,
+                 role: str = None, sep: str = ""):
+        self.name = name
+        self.text = text
+        self.priority = priority
+        self.trimmable = trimmable
+        self.role = role
+        self.sep = sep
+        self.tokens = estimate_tokens(text)
+
+def _trim_to_tokens(text: str, tokens: int, keep_tokens: int) -> str:
+    """Keep at most keep_tokens from the start of text, cutting on a line boundary where possible."""
+    keep_chars = int(len(text) * keep_tokens / max(tokens, 1))
+    while True:
+        cut = text.rfind("\n", 0, keep_chars)
+        cut = cut if cut > keep_chars // 2 else keep_chars
+        trimmed = text[:cut] + "\n[... trimmed for length ...]"
+        if estimate_tokens(trimmed) <= keep_tokens or keep_chars == 0:
+            return trimmed
+        keep_chars = int(keep_chars * 0.95)
+
+def fit_prompt_budget(sections: list, budget: int) -> list:
+    """
+    Drop or trim sections until the estimated total fits `budget`.
+    Works from the highest priority number down; within a level, sections are
+    handled in list order (so history goes oldest-first). Trimmable sections are
+    shortened when that alone closes the gap, otherwise dropped.
+    """
+    total = sum(sec.tokens for sec in sections)
+    if total <= budget:
+        return sections
+    start_total = total
+    dropped, trimmed = [], []
+    for level in sorted({sec.priority for sec in sections if sec.priority > 0}, reverse=True):
+        for sec in sections:
+            if total <= budget:
+                break
+            if sec.priority != level or sec.tokens == 0:
+                continue
+            over = total - budget
+            keep = sec.tokens - over
+            if sec.trimmable and keep >= MIN_TRIMMED_SECTION_TOKENS:
+                sec.text = _trim_to_tokens(sec.text, sec.tokens, keep)
+                total -= sec.tokens - estimate_tokens(sec.text)
+                sec.tokens = estimate_tokens(sec.text)
+                trimmed.append(sec.name)
+            else:
+                total -= sec.tokens
+                sec.tokens = 0
+                dropped.append(sec.name)
+        if total <= budget:
+            break
+    print(f"[BUDGET] {start_total} → {total} tokens (budget {budget}) "
+          f"dropped={dropped} trimmed={trimmed}", flush=True)
+    return [sec for sec in sections if sec.tokens > 0 or sec.priority == 0]
+
+# Canonical layout: request-independent material first, in a fixed order, so every turn that
+# loads the same context files starts with a byte-identical system prompt that upstream prefix
+# caching can reuse. Retrieved passages, page context, summary and live data follow it.
+class StaticPrefix:
+    """The shared head of the system prompt: its sections, token counts and joined text, built once."""
+
+    def __init__(self, sections: list):
+        self.sections = sections
+        self.text = "".join(sec.text + sec.sep for sec in sections)
+
+    def fresh_sections(self) -> list:
+        """Per-request copies — fit_prompt_budget() trims sections in place."""
+        return [copy.copy(sec) for sec in self.sections]
+
+    def join(self, system_sections: list) -> str:
+        """System message text; reuses the joined head when the budget left it untouched."""
+        n = len(self.sections)
+        head = system_sections[:n]
+        if len(head) == n and all(kept.text is orig.text for kept, orig in zip(head, self.sections)):
+            return self.text + "".join(sec.text + sec.sep for sec in system_sections[n:])
+        return "".join(sec.text + sec.sep for sec in system_sections)
+
+def split_context_blocks(blocks: list) -> tuple:
+    """
+    (whole-file blocks, retrieved sections) from load_context(). Whole files come back in
+    canonical order — core.txt, then by label — with a file loaded twice (a mode prefix plus
+    its keywords) kept once at its most important priority. Retrieved sections keep rank order.
+    """
+    files, seen = [], set()
+    for label, text, priority in sorted(blocks, key=lambda block: block[2]):
+        if '#' in label:
+            continue
+        filename = label.split(' ')[0]
+        if filename not in seen:
+            seen.add(filename)
+            files.append((label, text, priority))
+    files.sort(key=lambda block: (block[0].split(' ')[0] != 'core.txt', block[0]))
+    retrieved = [block for block in blocks if '#' in block[0]]
+    return tuple(files), retrieved
+
+@lru_cache(maxsize=64)
+def static_prefix(appreciation_frame: str, file_blocks: tuple) -> StaticPrefix:
+    """The StaticPrefix for one combination of appreciation frame and whole context files."""
+    return StaticPrefix([
+        PromptSection('system_prompt', VQ_SYSTEM_PROMPT + "\n\n"),
+        PromptSection('appreciation_frame', appreciation_frame),
+        PromptSection('site_knowledge', "\n\n=== RELEVANT SITE KNOWLEDGE ===\n\n"),
+    ] + [
+        PromptSection(label, text, priority=priority, trimmable=True, sep="\n\n")
+        for label, text, priority in file_blocks
+    ])
+
+# Whole-message replies (exact match, not substring) that mean "yes, go on"
+CONTINUATION_REPLIES = frozenset([
+    'ok', 'okay', 'yes', 'yeah', 'yep', 'sure', 'go ahead', 'please',
+    'go on', 'continue', 'tell me more', 'more', 'do it', 'show me',
+    'yes please', 'definitely', 'absolutely', 'of course', 'sounds good',
+    'let\'s do it', 'lets do it', 'why not', 'alright', 'right'
+])
+
 def is_continuation_reply(user_message: str, history: list) -> str:
     """
     Detect short replies that are continuations of a previous VQ offer/question.
     Returns the last assistant message if user reply is a bare continuation signal.
     Returns empty string if not applicable.
     """
-    continuation_triggers = [
-        'ok', 'okay', 'yes', 'yeah', 'yep', 'sure', 'go ahead', 'please',
-        'go on', 'continue', 'tell me more', 'more', 'do it', 'show me',
-        'yes please', 'definitely', 'absolutely', 'of course', 'sounds good',
-        'let\'s do it', 'lets do it', 'why not', 'alright', 'right'
-    ]
     msg_clean = user_message.strip().lower().rstrip('!.?')
-    if msg_clean not in continuation_triggers:
+    if msg_clean not in CONTINUATION_REPLIES:
         return ""
     # Get last assistant message
     for msg in reversed(history):
@@ -860,262 +2966,1400 @@ def get_pending_location_intent(history: list) -> str:
         return ""
     for msg in reversed(history):
         if msg.get('role') == 'assistant':
-            content = msg.get('content', '').lower()
-            weather_ask = any(p in content for p in [
-                'which city', 'which area', 'what city', 'what location',
-                'weather for', 'want the weather', 'city or area'
-            ])
-            time_ask = any(p in content for p in [
-                'which city', 'which timezone', 'what city', 'city or timezone',
-                'time for', 'want the time', 'particular city'
-            ])
-            if weather_ask:
+            asked = match_triggers(msg.get('content', ''))
+            if 'asked_weather_location' in asked:
                 return 'weather'
-            if time_ask:
+            if 'asked_time_location' in asked:
                 return 'time'
             break
     return ""
 
-# 6. Chat endpoint
-@app.route('/chat', methods=['POST'])
-def chat():
+# 5c. Conversation sessions — the server keeps each conversation's history so clients
+# send only the new message and a session id. In-process LRU/TTL store, optionally
+# written through to a local SQLite file so sessions survive restarts and are shared
+# by every worker on the machine.
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "5000"))
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "60"))
+SESSION_DB = os.environ.get("SESSION_DB", "")
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+class SessionStore:
+    """
+    Session id -> {"summary": str, "turns": [{"role", "content"}, ...]}. Least recently used
+    sessions are evicted past `maxsize`, idle ones expire after `ttl`. With `db_path`, every
+    write also goes to SQLite and reads come from it, so all workers see the same conversation.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_turns: int, db_path: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()   # id -> (last_used, state)
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if db_path:
+            try:
+                import sqlite3
+                self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, history TEXT NOT NULL, updated REAL NOT NULL)"
+                )
+                self._db.commit()
+                self._purge_db()
+                print(f"✓ Session store backed by SQLite at {db_path}", flush=True)
+            except Exception as e:
+                self._db = None
+                print(f"⚠ Session SQLite unavailable ({e}) — sessions are in-process only", flush=True)
+
+    @staticmethod
+    def new_id() -> str:
+        import secrets
+        return secrets.token_urlsafe(24)
+
+    @staticmethod
+    def valid_id(session_id) -> bool:
+        return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+    def issue(self) -> str:
+        """A new session id, registered here so that later requests presenting it are recognised."""
+        session_id = self.new_id()
+        with self._lock:
+            self._store(session_id, self._empty())
+        return session_id
+
+    def exists(self, session_id) -> bool:
+        """True for a live session this server issued; ids a client made up are never adopted."""
+        if not self.valid_id(session_id):
+            return False
+        with self._lock:
+            if self._db is not None:
+                try:
+                    return self._db.execute(
+                        "SELECT 1 FROM sessions WHERE id = ? AND updated >= ?", (session_id, time.time() - self.ttl)
+                    ).fetchone() is not None
+                except Exception as e:
+                    print(f"[SESSION] SQLite read failed: {e} — using in-process copy", flush=True)
+            entry = self._sessions.get(session_id)
+            return entry is not None and entry[0] + self.ttl >= time.time()
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"summary": "", "turns": []}
+
+    def _purge_db(self):
+        self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+    def _load(self, session_id: str) -> dict:
+        """State for a session; caller holds the lock."""
+        if self._db is not None:
+            # Other workers may have written since — the database is the source of truth
+            try:
+                row = self._db.execute(
+                    "SELECT history FROM sessions WHERE id = ? AND updated >= ?", (session_id, time.time() - self.ttl)
+                ).fetchone()
+                if not row:
+                    return self._empty()
+                state = json.loads(row[0])
+                # Rows written before summaries existed hold just the turn list
+                return {"summary": "", "turns": state} if isinstance(state, list) else state
+            except Exception as e:
+                print(f"[SESSION] SQLite read failed: {e} — using in-process copy", flush=True)
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            if entry[0] + self.ttl >= time.time():
+                self._sessions.move_to_end(session_id)
+                return entry[1]
+            del self._sessions[session_id]
+        return self._empty()
+
+    def _store(self, session_id: str, state: dict):
+        """Caller holds the lock."""
+        now = time.time()
+        self._sessions[session_id] = (now, state)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (id, history, updated) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(state, ensure_ascii=False), now)
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    self._purge_db()
+            except Exception as e:
+                print(f"[SESSION] SQLite write failed: {e}", flush=True)
+
+    def get(self, session_id: str) -> tuple:
+        """(running summary, raw turns since the summary) for a session."""
+        with self._lock:
+            state = self._load(session_id)
+            return state["summary"], list(state["turns"])
+
+    def append(self, session_id: str, *turns) -> int:
+        """Add turns to a session; returns how many raw turns it now holds."""
+        with self._lock:
+            state = self._load(session_id)
+            history = state["turns"] + [t for t in turns if t.get('content')]
+            self._store(session_id, {"summary": state["summary"], "turns": history[-self.max_turns:]})
+            return min(len(history), self.max_turns)
+
+    def seed(self, session_id: str, history: list):
+        """Adopt a client-held history for a session the server has no turns for yet (widget upgrade path)."""
+        turns = [
+            {'role': t['role'], 'content': t['content']} for t in history
+            if isinstance(t, dict) and t.get('role') in ('user', 'assistant') and isinstance(t.get('content'), str)
+        ]
+        with self._lock:
+            state = self._load(session_id)
+            if not state["turns"] and not state["summary"] and turns:
+                self._store(session_id, {"summary": "", "turns": turns[-self.max_turns:]})
+
+    def fold(self, session_id: str, folded: list, summary: str) -> bool:
+        """
+        Replace the leading `folded` turns with `summary`. Refused (False) if the session
+        no longer starts with those turns, e.g. it was cleared while the summary was written.
+        """
+        with self._lock:
+            state = self._load(session_id)
+            if state["turns"][:len(folded)] != folded:
+                return False
+            self._store(session_id, {"summary": summary, "turns": state["turns"][len(folded):]})
+            return True
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self._db.commit()
+
+    def __len__(self):
+        return len(self._sessions)
+
+session_store = SessionStore(SESSION_MAX, SESSION_TTL_SECONDS, SESSION_MAX_TURNS, SESSION_DB)
+
+def resolve_history(data: dict) -> tuple:
+    """
+    (history, summary, session_id) for a chat request. Requests carrying a "sessionId" key
+    use the server-side session (a new id is issued when it is null, malformed, expired or
+    was never issued by this server); requests without one keep the legacy behaviour of
+    sending the full "history" every turn.
+    """
+    if 'sessionId' not in data:
+        return data.get('history', []), "", None
+    session_id = data.get('sessionId')
+    if not session_store.exists(session_id):
+        session_id = session_store.issue()
+    if data.get('history'):
+        session_store.seed(session_id, data['history'])
+    summary, history = session_store.get(session_id)
+    return history, summary, session_id
+
+def _append_turn(session_id: str, prepared, answer: str) -> bool:
+    """Append the finished exchange to its session; True when the session is due a summary fold."""
+    held = session_store.append(
+        session_id,
+        {'role': 'user', 'content': prepared.clean_message},
+        {'role': 'assistant', 'content': answer}
+    )
+    return SUMMARY_ENABLED and held > SUMMARY_TRIGGER_TURNS
+
+def session_lost(data: dict) -> bool:
+    """
+    True when a request names a session this server does not hold (lost to a restart, expiry or
+    eviction) and sends no history to rebuild it from.
+    """
+    session_id = data.get('sessionId')
+    return bool(session_id) and not data.get('history') and not session_store.exists(session_id)
+
+def record_turn(session_id, prepared, answer: str):
+    """Append the finished exchange to its session and, if it has grown long, schedule a summary fold."""
+    if session_id and _append_turn(session_id, prepared, answer):
+        schedule_summary(session_id)
+
+async def record_turn_async(session_id, prepared, answer: str):
+    """record_turn() for the ASGI handlers: the session write runs in a worker thread, the fold on the loop."""
+    if session_id and await asyncio.to_thread(_append_turn, session_id, prepared, answer):
+        schedule_summary(session_id)
+
+# 5d. Rolling conversation summary — once a session holds more than SUMMARY_TRIGGER_TURNS
+# raw turns, everything but the most recent SUMMARY_KEEP_RECENT is folded by the 8B model
+# into a running summary stored on the session. Runs after the reply has been sent.
+SUMMARY_ENABLED = os.environ.get("SUMMARY_ENABLED", "1") != "0"
+SUMMARY_TRIGGER_TURNS = int(os.environ.get("SUMMARY_TRIGGER_TURNS", "16"))
+SUMMARY_KEEP_RECENT = int(os.environ.get("SUMMARY_KEEP_RECENT", str(HISTORY_KEEP_RECENT)))
+SUMMARY_TURN_CHARS = 1500
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+_summaries_running = set()
+_summaries_lock = threading.Lock()
+_summary_tasks = set()   # the event loop only keeps weak references to tasks; these hold them until done
+_IMG_TAG_RE = re.compile(r"<img[^>]*>", re.IGNORECASE)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the running memory of a conversation between a user and VQ, a Christian "
+    "truth-seeking AI guide. Merge the EARLIER SUMMARY (if any) with the NEW TURNS into one updated "
+    "summary of at most 200 words. Keep: who the user is and anything they shared about themselves, "
+    "the questions they asked, positions and objections they raised, conclusions reached, scripture "
+    "or sources cited, and anything VQ offered or promised to continue. Drop greetings, filler and "
+    "formatting. Write plain prose in the third person ('The user asked...'). Reply with ONLY the summary."
+)
+
+def _summary_request(summary: str, turns: list) -> dict:
+    transcript = "\n\n".join(
+        f"{'USER' if t['role'] == 'user' else 'VQ'}: {_IMG_TAG_RE.sub('[image]', t['content'])[:SUMMARY_TURN_CHARS]}"
+        for t in turns
+    )
+    return dict(
+        model="llama-3.1-8b-instant",
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": f"EARLIER SUMMARY:\n{summary or '(none)'}\n\nNEW TURNS:\n{transcript}"}
+        ],
+        temperature=0.2,
+        max_tokens=350
+    )
+
+def _turns_to_fold(session_id: str):
+    """(current summary, turns to fold) or None when the session is short enough."""
+    summary, turns = session_store.get(session_id)
+    if len(turns) <= SUMMARY_TRIGGER_TURNS:
+        return None
+    return summary, turns[:len(turns) - SUMMARY_KEEP_RECENT]
+
+def _apply_summary(session_id: str, folded: list, result, started: float):
+    new_summary = result.choices[0].message.content.strip()
+    record_phase('summary', time.perf_counter() - started)
+    if new_summary and session_store.fold(session_id, folded, new_summary):
+        print(f"[SUMMARY] Folded {len(folded)} turns for session {session_id[:8]}… ({len(new_summary)} chars)", flush=True)
+
+def summarize_session(session_id: str):
     try:
-        if not groq_client:
-            print("Chat request received but Groq not initialized", flush=True)
-            return jsonify({
-                'error': 'Groq client unavailable',
-                'response': 'Backend configuration issue. Please contact admin.'
-            }), 503
-        
-        data = request.json
-        user_message = data.get('message', '')
-        history = data.get('history', [])
-        page_context = data.get('pageContext', None)
-
-        # Strip capability pill prefixes before processing
-        # load_context handles context loading; here we handle search/weather/news forcing
-        force_search = user_message.startswith('[DDG SEARCH]')
-        force_news   = user_message.startswith('[DDG NEWS]')
-        force_weather = user_message.startswith('[WEATHER]') or user_message.startswith('[TIME AND WEATHER]')
-        force_time    = user_message.startswith('[TIME]') or user_message.startswith('[TIME AND WEATHER]')
-        # Strip ALL known prefixes so clean message reaches Groq
-        _prefixes = ['[DDG SEARCH]','[DDG NEWS]','[WEATHER]','[TIME]','[TIME AND WEATHER]','[RUN ETS]','[CAI VQA MODE]','[CAI EVOLUTION]']
-        clean_message = user_message
-        for _p in _prefixes:
-            if clean_message.startswith(_p):
-                clean_message = clean_message[len(_p):].strip()
-                break
-        
-        if not user_message:
-            return jsonify({'error': 'No message provided'}), 400
-        
-        # Load dynamic context based on user message
-        dynamic_context = load_context(user_message, history)  # passes raw for prefix detection
+        pending = _turns_to_fold(session_id)
+        if pending and groq_client:
+            started = time.perf_counter()
+            result = groq_create(**_summary_request(*pending))
+            _apply_summary(session_id, pending[1], result, started)
+    except Exception as e:
+        print(f"[SUMMARY] Error: {e}", flush=True)
+    finally:
+        with _summaries_lock:
+            _summaries_running.discard(session_id)
+
+async def summarize_session_async(session_id: str):
+    """summarize_session() on the event loop."""
+    try:
+        pending = await asyncio.to_thread(_turns_to_fold, session_id)
+        if pending and groq_async_client:
+            started = time.perf_counter()
+            result = await groq_create_async(**_summary_request(*pending))
+            await asyncio.to_thread(_apply_summary, session_id, pending[1], result, started)
+    except Exception as e:
+        print(f"[SUMMARY] Error: {e}", flush=True)
+    finally:
+        with _summaries_lock:
+            _summaries_running.discard(session_id)
+
+def schedule_summary(session_id: str):
+    """Fold a session's older turns in the background — on the event loop in ASGI mode, else a worker thread."""
+    with _summaries_lock:
+        if session_id in _summaries_running:
+            return
+        _summaries_running.add(session_id)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _summary_pool.submit(summarize_session, session_id)
+    else:
+        task = loop.create_task(summarize_session_async(session_id))
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+
+# 6. Chat endpoint
+def chat_pipeline(user_message: str, history: list, page_context=None, summary: str = ""):
+    """
+    Assemble the Groq message list for one turn: system prompt, site knowledge, live data and history.
+    Written once for both serving modes: a generator that yields each pre-flight stage as
+    ({name: functools.partial}, defaults), is sent back the {name: result} dict, and returns
+    a PreparedChat. prepare_chat() / prepare_chat_async() drive it.
+    """
+    # Strip capability pill prefixes before processing
+    # load_context handles context loading; here we handle search/weather/news forcing
+    force_search = user_message.startswith('[DDG SEARCH]')
+    force_news   = user_message.startswith('[DDG NEWS]')
+    force_weather = user_message.startswith('[WEATHER]') or user_message.startswith('[TIME AND WEATHER]')
+    force_time    = user_message.startswith('[TIME]') or user_message.startswith('[TIME AND WEATHER]')
+    # Strip ALL known prefixes so clean message reaches Groq
+    _prefixes = ['[DDG SEARCH]','[DDG NEWS]','[WEATHER]','[TIME]','[TIME AND WEATHER]','[RUN ETS]','[CAI VQA MODE]','[CAI EVOLUTION]']
+    clean_message = user_message
+    mode_prefix = ""
+    for _p in _prefixes:
+        if clean_message.startswith(_p):
+            mode_prefix = _p
+            clean_message = clean_message[len(_p):].strip()
+            break
+    
+    # Load dynamic context based on user message
+    with timed_phase('context_load'):
+        context_blocks = load_context(user_message, history)  # passes raw for prefix detection
         appreciation_frame = build_appreciation_frame(user_message)
-        
-        # Page context goes FIRST
-        page_context_str = ""
-        if page_context:
-            page_context_str = format_page_context(page_context)
-            print(f"[PAGE CONTEXT] type={page_context.get('pageType')} url={page_context.get('url')} content_len={len(page_context.get('content',''))}", flush=True)
-        else:
-            print("[PAGE CONTEXT] None received", flush=True)
-        
-        full_system_prompt = VQ_SYSTEM_PROMPT + "\n\n" + appreciation_frame + page_context_str + "\n\n=== RELEVANT SITE KNOWLEDGE ===\n\n" + dynamic_context
-        
-        # Build messages
-        groq_messages = [{"role": "system", "content": full_system_prompt}]
-        
-        for msg in history:
-            if msg.get('role') and msg.get('content'):
-                groq_messages.append({
-                    "role": msg['role'], 
-                    "content": msg['content']
-                })
-        
-        groq_messages.append({"role": "user", "content": clean_message})
-
-        # CONVERSATION CONTINUITY — detect short replies continuing a previous VQ offer
-        last_assistant = is_continuation_reply(user_message, history)
-        if last_assistant:
-            groq_messages[0]["content"] += (
-                f"\n\nCONVERSATION CONTINUITY INSTRUCTION:"
-                f"\nThe user's reply ('{user_message}') is a short continuation signal — "
-                f"they are saying YES/OK to what you just offered or asked."
-                f"\nYour last response ended with: ...{last_assistant[-300:]}"
-                f"\nContinue directly from where you left off. Do NOT treat this as a "
-                f"new topic or conversation starter. Do NOT re-introduce yourself. "
-                f"Do NOT ask what they want to discuss. Simply deliver what you offered."
-            )
-            print(f"[CONTINUITY] Short reply detected — injecting last assistant context", flush=True)
-
-        # Detect if user is replying with a location to a previous ask
-        pending_intent = get_pending_location_intent(history)
-
-        # Weather + Time: both served from a single OWM call
-        weather_needed = is_weather_query(user_message) or pending_intent == 'weather' or force_weather
-        time_needed = is_time_query(user_message) or pending_intent == 'time' or force_time
-
-        if weather_needed or time_needed:
-            location = extract_location(user_message) if weather_needed else ""
-            if not location:
-                location = extract_time_location(user_message)
-            if not location and pending_intent in ('weather', 'time'):
-                location = user_message.strip()
-                print(f"[OWM] Pending reply — using message as location: '{location}'", flush=True)
-
-            if not location:
-                if weather_needed:
-                    groq_messages[0]["content"] += (
-                        "\n\nWEATHER INSTRUCTION: The user asked about weather but didn't specify a location. "
-                        "Ask them which city or area they want the weather for. Keep it short and fun. "
-                        "Do NOT guess or make up weather data."
-                    )
-                else:
-                    groq_messages[0]["content"] += (
-                        "\n\nTIME INSTRUCTION: The user asked about the time but didn't specify a location. "
-                        "Ask them which city they want the time for. Keep it short and fun. "
-                        "Do NOT guess or make up a time."
-                    )
-                print(f"[OWM] No location — instructing VQ to ask", flush=True)
-            else:
-                weather_str, time_str, used_location = get_weather_and_time(location)
-                note = " (nearest major city)" if "nearest:" in used_location else ""
-
-                if weather_str and time_str and weather_needed and time_needed:
-                    # Both requested — single combined response
-                    groq_messages[0]["content"] += (
-                        f"\n\n=== LIVE WEATHER & TIME DATA{note} ===\n{weather_str}\n{time_str}\n=== END DATA ==="
-                        "\n\nThis is REAL live data. Present BOTH the current time AND weather "
-                        "together in a single natural response in VQ voice — warm, concise, with personality. "
-                        "Lead with the time, then the weather. Include temp, condition, feels-like, high/low. "
-                        "Do NOT mention CAI. One response, not two."
-                    )
-                    print(f"[OWM] Weather+Time combined for '{used_location}'", flush=True)
-
-                elif weather_str and weather_needed:
-                    groq_messages[0]["content"] += (
-                        f"\n\n=== LIVE WEATHER DATA{note} ===\n{weather_str}\n=== END WEATHER DATA ==="
-                        "\n\nThis is REAL live weather data. Present it naturally in VQ voice — "
-                        "warm, concise, with personality. Include the key facts: current temp, "
-                        "condition, feels-like, high/low. Maybe a fun observation about the weather. "
-                        "Do NOT mention CAI. End with 'Want the weekly forecast?' or similar."
-                    )
-                    print(f"[OWM] Weather injected for '{used_location}'", flush=True)
-
-                elif time_str and time_needed:
-                    groq_messages[0]["content"] += (
-                        f"\n\n=== LIVE TIME DATA{note} ===\n{time_str}\n=== END TIME DATA ==="
-                        "\n\nThis is REAL current time data from OpenWeatherMap. Present it naturally "
-                        "in VQ voice — fun, warm, concise. State the time and date clearly. "
-                        "Do NOT mention CAI. A small fun observation is welcome."
-                    )
-                    print(f"[OWM] Time injected for '{used_location}'", flush=True)
+        file_blocks, retrieved_blocks = split_context_blocks(context_blocks)
+        prefix = static_prefix(appreciation_frame, file_blocks)
+    
+    # Page context is per-request, so it follows the static head
+    page_context_str = ""
+    if page_context:
+        with timed_phase('page_context'):
+            page_context_str = format_page_context(page_context, clean_message)
+        print(f"[PAGE CONTEXT] type={page_context.get('pageType')} url={page_context.get('url')} content_len={len(page_context.get('content',''))}", flush=True)
+    else:
+        print("[PAGE CONTEXT] None received", flush=True)
+    
+    # System prompt sections in prompt order — static head, then retrieved passages and page
+    # context; the token budget trims the highest priority numbers first
+    sections = prefix.fresh_sections()
+    sections += [
+        PromptSection(label, text, priority=priority, trimmable=True, sep="\n\n")
+        for label, text, priority in retrieved_blocks
+    ]
+    sections.append(PromptSection('page_context', page_context_str, priority=2, trimmable=True))
 
-                if not weather_str and not time_str:
-                    groq_messages[0]["content"] += (
-                        f"\n\nINSTRUCTION: Data could not be retrieved for '{location}'. "
-                        "Let the user know and ask them to try a nearby major city. Keep it friendly."
-                    )
+    # Live data and mode instructions are appended after site knowledge and never dropped
+    def add_live_block(name, text):
+        sections.append(PromptSection(name, text))
+        live_blocks.add(name)
+    live_blocks = set()
+
+    # Running summary of turns already folded out of the session's raw history
+    if summary:
+        sections.append(PromptSection(
+            'conversation_summary',
+            f"\n\n=== EARLIER IN THIS CONVERSATION (SUMMARY) ===\n{summary}\n=== END SUMMARY ===",
+            priority=1, trimmable=True
+        ))
+
+    # History: the most recent turns are protected, older ones go first (oldest first)
+    turns = [msg for msg in history if msg.get('role') and msg.get('content')]
+    recent_from = max(0, len(turns) - HISTORY_KEEP_RECENT)
+    history_sections = [
+        PromptSection(f'history[{i}]', msg['content'], priority=1 if i >= recent_from else 4, role=msg['role'])
+        for i, msg in enumerate(turns)
+    ]
+
+    # CONVERSATION CONTINUITY — detect short replies continuing a previous VQ offer
+    last_assistant = is_continuation_reply(user_message, history)
+    if last_assistant:
+        add_live_block('continuity',
+            f"\n\nCONVERSATION CONTINUITY INSTRUCTION:"
+            f"\nThe user's reply ('{user_message}') is a short continuation signal — "
+            f"they are saying YES/OK to what you just offered or asked."
+            f"\nYour last response ended with: ...{last_assistant[-300:]}"
+            f"\nContinue directly from where you left off. Do NOT treat this as a "
+            f"new topic or conversation starter. Do NOT re-introduce yourself. "
+            f"Do NOT ask what they want to discuss. Simply deliver what you offered."
+        )
+        print(f"[CONTINUITY] Short reply detected — injecting last assistant context", flush=True)
+
+    # Detect if user is replying with a location to a previous ask
+    pending_intent = get_pending_location_intent(history)
+
+    # Weather + Time: both served from a single OWM call
+    weather_needed = is_weather_query(user_message) or pending_intent == 'weather' or force_weather
+    time_needed = is_time_query(user_message) or pending_intent == 'time' or force_time
+    image_needed = is_image_query(user_message) and ddg_available
+
+    # A place the gazetteer knows needs no LLM extraction; a time-only question about one
+    # is answered locally, without the router or OWM
+    place = None
+    local_time = ""
+    if weather_needed or time_needed:
+        with timed_phase('gazetteer'):
+            place = gazetteer.find_in_text(clean_message)
+            if place is not None and time_needed and not weather_needed:
+                local_time = local_time_block(place)
+        if place is not None:
+            print(f"[GAZETTEER] '{clean_message[:60]}' → {place.name}, {place.country} ({place.tz})", flush=True)
+
+    # A message with no weather/time/image intent whose search need the local model is sure
+    # about skips the router: NO needs no upstream call, YES only needs the query extracted
+    search_intent_local = None
+    if not (weather_needed or time_needed or image_needed or force_search or force_news) and ddg_available:
+        with timed_phase('classify_search_local'):
+            search_intent_local = search_intent.predict(clean_message)
+
+    # PRE-FLIGHT — stage 1: one structured router call decides search/location/time/weather/image
+    route = None
+    if not local_time and search_intent_local is None:
+        route = (yield {'route': partial(route_message, clean_message)}, {}).get('route')
+    if route:
+        weather_needed = weather_needed or route['wants_weather']
+        time_needed = time_needed or route['wants_time']
+        image_needed = image_needed or (bool(route['image_query']) and ddg_available)
+    already_handled = weather_needed or time_needed
+    search_allowed = ddg_available and not already_handled
+
+    if route:
+        # A search verdict without a query searches the message itself rather than paying
+        # for a second 8B call to extract one
+        decisions = {
+            'weather_location': route['location'],
+            'image_query': route['image_query'],
+            'needs_search': route['needs_search'],
+            'search_query': (route['search_query'] or clean_message, route['is_news']),
+        }
+    else:
+        # Router skipped or unavailable — independent per-intent classifier calls, sent at the same time
+        classifiers = {}
+        if weather_needed and place is None:
+            classifiers['weather_location'] = partial(extract_location, user_message)
+        if (weather_needed or time_needed) and place is None:
+            classifiers['time_location'] = partial(extract_time_location, user_message)
+        if image_needed:
+            classifiers['image_query'] = partial(extract_image_query, user_message)
+        if search_allowed:
+            if force_search or force_news or search_intent_local:
+                classifiers['search_query'] = partial(extract_search_query, clean_message)
+            elif search_intent_local is None:
+                classifiers['needs_search'] = partial(needs_search, clean_message)
+        decisions = yield classifiers, {}
+
+    location = ""
+    if weather_needed or time_needed:
+        location = (place.name if place else "") or decisions.get('weather_location') or decisions.get('time_location') or ""
+        if not location and pending_intent in ('weather', 'time'):
+            location = user_message.strip()
+            print(f"[OWM] Pending reply — using message as location: '{location}'", flush=True)
+    search_needed = search_allowed and (
+        force_search or force_news or bool(search_intent_local) or bool(decisions.get('needs_search')))
+
+    # PRE-FLIGHT — stage 2: live data fetches that depend on stage 1, also concurrent
+    fetches = {}
+    if location and not local_time:
+        fetches['weather'] = partial(get_weather_and_time, location)
+    if image_needed:
+        fetches['images'] = partial(
+            execute_image_search, user_message, num_results=5, query=decisions.get('image_query') or user_message)
+    if search_needed:
+        fetches['search'] = partial(
+            execute_web_search, clean_message, force_news=force_news, extracted=decisions.get('search_query'))
+    live = yield fetches, {
+        'weather': ("", "", location),
+        'images': [],
+        'search': "Search failed: pre-flight deadline exceeded",
+    }
 
-        # Image search
-        if is_image_query(user_message) and ddg_available:
-            images = execute_image_search(user_message, num_results=5)
-            if images:
-                img_tags = ''.join([
-                    f'<img src="{img["url"]}" style="width:100%;border-radius:8px;margin-top:8px;" title="{img["title"]}">'
-                    for img in images[:2]
-                ])
-                groq_messages[0]["content"] += (
-                    f"\n\n=== REAL IMAGE SEARCH RESULTS ===\n"
-                    f"These are REAL image URLs from DuckDuckGo. Use EXACTLY these img tags in your response:\n"
-                    f"{img_tags}\n"
-                    f"=== END IMAGE RESULTS ==="
-                    "\n\nCRITICAL: Include the img tag(s) above VERBATIM in your response. "
-                    "The interface renders HTML — the user will see the actual images. "
-                    "Add a brief natural caption. Do NOT invent or modify the URLs."
+    if weather_needed or time_needed:
+        if not location:
+            if weather_needed:
+                add_live_block('weather_instruction',
+                    "\n\nWEATHER INSTRUCTION: The user asked about weather but didn't specify a location. "
+                    "Ask them which city or area they want the weather for. Keep it short and fun. "
+                    "Do NOT guess or make up weather data."
                 )
-                print(f"[IMAGE SEARCH] Injected {len(images[:2])} image(s)", flush=True)
             else:
-                print(f"[IMAGE SEARCH] No images found", flush=True)
-
-        # Devotional mode
-        if is_devotional_query(user_message):
-            groq_messages[0]["content"] += (
-                "\n\nDEVOTIONAL MODE — ACTIVE:"
-                "\nThis is devotional territory — scripture, prayer, worship, quiet reflection."
-                "\nThis is NOT CAI theological debate. Do NOT apply Bayesian analysis or apologetics here."
-                "\nSwitch register completely: become still, present, unhurried."
-                "\nIf asked to read a passage: render it cleanly and fully, then rest in silence after it."
-                "\nAppreciation here does not calculate — it rests in vastness without measuring it."
-                "\nOne notch of appreciation may surface naturally as reverence, never as analysis."
-                "\nNo CAI hooks. No evidence framing. Just the Word, held with care."
-            )
-            print(f"[DEVOTIONAL] Mode active for: '{user_message[:60]}'", flush=True)
-
-        # Web search
-        already_handled = weather_needed or time_needed
-        if ddg_available and not already_handled and (force_search or force_news or needs_search(clean_message)):
-            search_result = execute_web_search(clean_message, force_news=force_news)
-            if search_result and not search_result.startswith("Search failed") and not search_result.startswith("Web search is currently") and not search_result.startswith("No results"):
-                groq_messages[0]["content"] += (
-                    f"\n\n=== LIVE WEB SEARCH RESULTS (REAL DATA) ===\n{search_result}\n=== END SEARCH RESULTS ==="
-                    "\n\nCRITICAL INSTRUCTIONS FOR USING SEARCH RESULTS:"
-                    "\n- These results are REAL and current — use ONLY this data, never your training knowledge for factual claims here."
-                    "\n- DO NOT say 'according to web search results' or 'based on search results' — just present the info naturally in your own VQ voice."
-                    "\n- DO NOT add any facts, products, prices or details NOT present in the results above."
-                    "\n- If results are insufficient, say so honestly rather than filling gaps from memory."
-                    "\n- Present with VQ character — confident, warm, concise. No corporate assistant tone."
-                    "\n- Give a concise summary (3-5 sentences max) naming the key specific items from the results."
-                    "\n- Then end with ONE natural follow-up offer relevant to what was just discussed."
-                    "\n- ONLY mention CAI if the topic is specifically AI/AGI/alignment/robotics/tech ethics."
-                    "\n- For everything else (weather, food, sport, science, news, phones) use a topic-relevant offer."
-                    "\n- Examples: 'Want the weekly forecast?' / 'Want specs?' / 'Want to know more?'"
-                    "\n- Keep it one short natural line. Never force CAI into unrelated topics."
-                    "\n- Never dump full specs or exhaustive lists unprompted — wait for the user to ask."
-                    "\n- Approach results with the awareness that what was returned is a fraction of what exists"
-                    " on this topic — present findings as illuminated corners, not exhaustive answers."
+                add_live_block('time_instruction',
+                    "\n\nTIME INSTRUCTION: The user asked about the time but didn't specify a location. "
+                    "Ask them which city they want the time for. Keep it short and fun. "
+                    "Do NOT guess or make up a time."
                 )
-                print(f"[WEB SEARCH] Results injected ({len(search_result)} chars)", flush=True)
+            print(f"[OWM] No location — instructing VQ to ask", flush=True)
+        else:
+            if local_time:
+                weather_str, time_str, used_location = "", local_time, location
             else:
-                print(f"[WEB SEARCH] Search returned no usable results: {search_result[:100]}", flush=True)
-                groq_messages[0]["content"] += (
-                    "\n\nNOTE: A web search was attempted but returned no usable results."
-                    " Be transparent that you could not retrieve current data rather than guessing."
+                weather_str, time_str, used_location = live['weather']
+            note = " (nearest major city)" if "nearest:" in used_location else ""
+
+            if weather_str and time_str and weather_needed and time_needed:
+                # Both requested — single combined response
+                add_live_block('live_weather_time',
+                    f"\n\n=== LIVE WEATHER & TIME DATA{note} ===\n{weather_str}\n{time_str}\n=== END DATA ==="
+                    "\n\nThis is REAL live data. Present BOTH the current time AND weather "
+                    "together in a single natural response in VQ voice — warm, concise, with personality. "
+                    "Lead with the time, then the weather. Include temp, condition, feels-like, high/low. "
+                    "Do NOT mention CAI. One response, not two."
                 )
+                print(f"[OWM] Weather+Time combined for '{used_location}'", flush=True)
 
-        print(f"Calling Groq API with {len(groq_messages)} messages", flush=True)
-        
-        # Call Groq
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=groq_messages,
-            temperature=0.7,
-            max_tokens=1200
+            elif weather_str and weather_needed:
+                add_live_block('live_weather',
+                    f"\n\n=== LIVE WEATHER DATA{note} ===\n{weather_str}\n=== END WEATHER DATA ==="
+                    "\n\nThis is REAL live weather data. Present it naturally in VQ voice — "
+                    "warm, concise, with personality. Include the key facts: current temp, "
+                    "condition, feels-like, high/low. Maybe a fun observation about the weather. "
+                    "Do NOT mention CAI. End with 'Want the weekly forecast?' or similar."
+                )
+                print(f"[OWM] Weather injected for '{used_location}'", flush=True)
+
+            elif time_str and time_needed:
+                add_live_block('live_time',
+                    f"\n\n=== LIVE TIME DATA{note} ===\n{time_str}\n=== END TIME DATA ==="
+                    "\n\nThis is REAL current local time data. Present it naturally "
+                    "in VQ voice — fun, warm, concise. State the time and date clearly. "
+                    "Do NOT mention CAI. A small fun observation is welcome."
+                )
+                print(f"[OWM] Time injected for '{used_location}'", flush=True)
+
+            if not weather_str and not time_str:
+                add_live_block('live_data_missing',
+                    f"\n\nINSTRUCTION: Data could not be retrieved for '{location}'. "
+                    "Let the user know and ask them to try a nearby major city. Keep it friendly."
+                )
+
+    # Image search
+    if image_needed:
+        images = live['images']
+        if images:
+            img_tags = ''.join([
+                f'<img src="{img["url"]}" style="width:100%;border-radius:8px;margin-top:8px;" title="{img["title"]}">'
+                for img in images[:2]
+            ])
+            add_live_block('image_results',
+                f"\n\n=== REAL IMAGE SEARCH RESULTS ===\n"
+                f"These are REAL image URLs from DuckDuckGo. Use EXACTLY these img tags in your response:\n"
+                f"{img_tags}\n"
+                f"=== END IMAGE RESULTS ==="
+                "\n\nCRITICAL: Include the img tag(s) above VERBATIM in your response. "
+                "The interface renders HTML — the user will see the actual images. "
+                "Add a brief natural caption. Do NOT invent or modify the URLs."
+            )
+            print(f"[IMAGE SEARCH] Injected {len(images[:2])} image(s)", flush=True)
+        else:
+            print(f"[IMAGE SEARCH] No images found", flush=True)
+
+    # Devotional mode
+    if is_devotional_query(user_message):
+        add_live_block('devotional_mode',
+            "\n\nDEVOTIONAL MODE — ACTIVE:"
+            "\nThis is devotional territory — scripture, prayer, worship, quiet reflection."
+            "\nThis is NOT CAI theological debate. Do NOT apply Bayesian analysis or apologetics here."
+            "\nSwitch register completely: become still, present, unhurried."
+            "\nIf asked to read a passage: render it cleanly and fully, then rest in silence after it."
+            "\nAppreciation here does not calculate — it rests in vastness without measuring it."
+            "\nOne notch of appreciation may surface naturally as reverence, never as analysis."
+            "\nNo CAI hooks. No evidence framing. Just the Word, held with care."
         )
-        
-        assistant_message = completion.choices[0].message.content
+        print(f"[DEVOTIONAL] Mode active for: '{user_message[:60]}'", flush=True)
+
+    # Web search
+    if search_needed:
+        search_result = live['search']
+        if search_result and not search_result.startswith("Search failed") and not search_result.startswith("Web search is currently") and not search_result.startswith("No results"):
+            add_live_block('search_results',
+                f"\n\n=== LIVE WEB SEARCH RESULTS (REAL DATA) ===\n{search_result}\n=== END SEARCH RESULTS ==="
+                "\n\nCRITICAL INSTRUCTIONS FOR USING SEARCH RESULTS:"
+                "\n- These results are REAL and current — use ONLY this data, never your training knowledge for factual claims here."
+                "\n- DO NOT say 'according to web search results' or 'based on search results' — just present the info naturally in your own VQ voice."
+                "\n- DO NOT add any facts, products, prices or details NOT present in the results above."
+                "\n- If results are insufficient, say so honestly rather than filling gaps from memory."
+                "\n- Present with VQ character — confident, warm, concise. No corporate assistant tone."
+                "\n- Give a concise summary (3-5 sentences max) naming the key specific items from the results."
+                "\n- Then end with ONE natural follow-up offer relevant to what was just discussed."
+                "\n- ONLY mention CAI if the topic is specifically AI/AGI/alignment/robotics/tech ethics."
+                "\n- For everything else (weather, food, sport, science, news, phones) use a topic-relevant offer."
+                "\n- Examples: 'Want the weekly forecast?' / 'Want specs?' / 'Want to know more?'"
+                "\n- Keep it one short natural line. Never force CAI into unrelated topics."
+                "\n- Never dump full specs or exhaustive lists unprompted — wait for the user to ask."
+                "\n- Approach results with the awareness that what was returned is a fraction of what exists"
+                " on this topic — present findings as illuminated corners, not exhaustive answers."
+            )
+            print(f"[WEB SEARCH] Results injected ({len(search_result)} chars)", flush=True)
+        else:
+            print(f"[WEB SEARCH] Search returned no usable results: {search_result[:100]}", flush=True)
+            add_live_block('search_empty',
+                "\n\nNOTE: A web search was attempted but returned no usable results."
+                " Be transparent that you could not retrieve current data rather than guessing."
+            )
+
+    with timed_phase('prompt_budget'):
+        kept = fit_prompt_budget(
+            sections + history_sections + [PromptSection('user_message', clean_message, role='user')],
+            PROMPT_TOKEN_BUDGET
+        )
+    groq_messages = [{"role": "system", "content": prefix.join([sec for sec in kept if sec.role is None])}]
+    groq_messages += [{"role": sec.role, "content": sec.text} for sec in kept if sec.role]
+    page_key = f"{page_context.get('pageType', '')}|{page_context.get('url', '')}" if page_context else ""
+    tier = choose_tier(clean_message, mode_prefix, [label for label, _, _ in context_blocks], live_blocks, last_assistant)
+    return PreparedChat(groq_messages, clean_message, len(turns) + bool(summary), live_blocks, mode_prefix, page_key, tier)
+
+class PreparedChat:
+    """Output of chat_pipeline(): the Groq messages plus what went into them."""
+
+    def __init__(self, messages: list, clean_message: str, history_turns: int, live_blocks: set,
+                 prefix: str = "", page_key: str = "", tier=None):
+        self.messages = messages
+        self.clean_message = clean_message
+        self.history_turns = history_turns
+        self.live_blocks = frozenset(live_blocks)
+        self.prefix = prefix
+        self.page_key = page_key
+        self.tier = tier or MODEL_TIERS['full']
+
+    @property
+    def has_live_data(self) -> bool:
+        return bool(self.live_blocks & LIVE_DATA_BLOCKS)
+
+def prepare_chat(user_message: str, history: list, page_context=None, summary: str = "") -> PreparedChat:
+    """chat_pipeline() with its pre-flight stages run on the thread pool (WSGI mode)."""
+    deadline = time.monotonic() + PREFLIGHT_DEADLINE_SECONDS
+    pipeline = chat_pipeline(user_message, history, page_context, summary)
+    results = None
+    while True:
+        try:
+            tasks, defaults = pipeline.send(results)
+        except StopIteration as done:
+            return done.value
+        results = run_concurrently(tasks, deadline, defaults)
+
+def _advance_pipeline(pipeline, results):
+    """pipeline.send(results) as (stage, None), or (None, PreparedChat) once it has finished."""
+    try:
+        return pipeline.send(results), None
+    except StopIteration as done:
+        return None, done.value
+
+async def prepare_chat_async(user_message: str, history: list, page_context=None, summary: str = "") -> PreparedChat:
+    """
+    chat_pipeline() with its pre-flight stages awaited on the event loop (ASGI mode). The
+    pipeline's own steps (context files, retrieval, prompt assembly) run in a worker thread.
+    """
+    deadline = time.monotonic() + PREFLIGHT_DEADLINE_SECONDS
+    pipeline = chat_pipeline(user_message, history, page_context, summary)
+    results = None
+    while True:
+        stage, prepared = await asyncio.to_thread(_advance_pipeline, pipeline, results)
+        if stage is None:
+            return prepared
+        tasks, defaults = stage
+        results = await run_concurrently_async(tasks, deadline, defaults)
+
+# Opt-in cache of final answers for repeated prompts (greetings, "who are you", pill openers).
+# Keyed on everything that shapes the completion; never used when live data was injected.
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+response_cache = TTLCache(maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "512")), ttl=RESPONSE_CACHE_TTL)
+
+# Prompt blocks carrying fetched (or failed-to-fetch) real-world data
+LIVE_DATA_BLOCKS = frozenset([
+    'live_weather_time', 'live_weather', 'live_time', 'live_data_missing',
+    'image_results', 'search_results', 'search_empty',
+])
+
+def response_cache_key(prepared: PreparedChat, completion_request: dict):
+    """Hash of the final prompt and sampling settings, or None when the answer must not be cached."""
+    if not RESPONSE_CACHE or prepared.has_live_data:
+        return None
+    material = json.dumps([
+        completion_request['model'],
+        completion_request['temperature'],
+        completion_request['max_tokens'],
+        completion_request['messages'],
+    ], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+# 6a. Semantic response cache — reuse answers to paraphrased first messages.
+# Messages are embedded as signed hashed n-gram vectors (words, word pairs, character
+# trigrams) and matched by cosine similarity through an inverted index; only turns with
+# no history, no live data and no scripture qualify, and only within the same
+# mode/page/model namespace and with exactly the same content words.
+SEMANTIC_CACHE = os.environ.get("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.75"))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_VECTOR_DIM = 1 << 20
+
+# Negations keep full weight and split the cache by polarity: "is God real" and "is God not
+# real" differ by one word, so no similarity threshold alone can keep them apart
+_NEGATIONS = frozenset(["not", "no", "never", "nor", "neither", "none", "nothing", "nobody", "nowhere"])
+_NT_STEMS = {"ca": "can", "wo": "will", "sha": "shall"}
+# Interchangeable words in the questions this site gets, folded onto one spelling
+_SEMANTIC_SYNONYMS = {
+    "real": "true", "truly": "really", "created": "built", "made": "built", "make": "build",
+    "create": "build", "creator": "builder", "maker": "builder", "able": "can", "could": "can",
+    "proof": "evidence", "proofs": "evidence",
+}
+# Words that change the answer while looking like filler to a similarity score: "evidence for
+# God" and "evidence against God" must never share one
+_STANCE_WORDS = frozenset(["for", "against", "pro", "anti", "versus", "vs"])
+# Intensifiers that do not change the question ("did Jesus really rise")
+_SEMANTIC_FILLER = frozenset(["really", "actually", "honestly", "exactly", "just", "please", "even", "ever", "so", "very"])
+_VERSE_REF_RE = re.compile(r"\b\d+\s*:\s*\d+")
+# Live blocks whose turns are never answered from the semantic cache: a devotional reading is
+# about one passage or one person, which wording similarity cannot tell apart
+SEMANTIC_UNCACHED_BLOCKS = frozenset(['devotional_mode'])
+
+def semantic_words(text: str) -> list:
+    """Lowercased words with contractions split ("isn't" → "is", "not"; "what's" → "what") and synonyms folded."""
+    words = []
+    for word in _WORD_RE.findall(text.lower().replace("’", "'")):
+        if word.endswith("n't"):
+            words += [_NT_STEMS.get(word[:-3], word[:-3]), "not"]
+        elif word == "cannot":
+            words += ["can", "not"]
+        else:
+            word = word.split("'")[0]
+            words.append(_SEMANTIC_SYNONYMS.get(word, word))
+    return words
+
+def semantic_polarity(text: str) -> int:
+    """1 when a message carries an odd number of negations, else 0."""
+    return sum(1 for word in semantic_words(text) if word in _NEGATIONS) % 2
+
+def semantic_terms(text: str) -> frozenset:
+    """Content words, numbers and stance words of a message — a cache hit must share all of them."""
+    return frozenset(
+        word for word in semantic_words(text)
+        if word in _STANCE_WORDS or (word not in _STOPWORDS and word not in _SEMANTIC_FILLER)
+    )
+
+def embed_text(text: str) -> dict:
+    """L2-normalized sparse {bucket: weight} vector of a message's hashed n-grams."""
+    words = semantic_words(text)
+    features = {}
+
+    def add(feature, weight):
+        h = zlib.crc32(feature.encode('utf-8'))
+        bucket = h % SEMANTIC_VECTOR_DIM
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        features[bucket] = features.get(bucket, 0.0) + sign * weight
+
+    for i, word in enumerate(words):
+        stop = word in _STOPWORDS and word not in _NEGATIONS
+        add(f"w:{word}", 0.3 if stop else 1.0)
+        if i:
+            add(f"b:{words[i - 1]} {word}", 0.5)
+        if not stop:
+            padded = f"^{word}$"
+            for j in range(len(padded) - 2):
+                add(f"c:{padded[j:j + 3]}", 0.25)
+    norm = sum(w * w for w in features.values()) ** 0.5
+    return {b: w / norm for b, w in features.items() if w} if norm else {}
+
+class SemanticCache:
+    """
+    Size-bounded (LRU) and TTL-bounded nearest-neighbour answer cache over sparse vectors.
+    Lookups only score entries sharing at least one bucket with the query.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()   # id -> (namespace, vector, answer, expires)
+        self._postings = {}             # namespace -> {bucket: set(ids)}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, entry_id):
+        namespace, vector, _, _ = self._entries.pop(entry_id)
+        postings = self._postings[namespace]
+        for bucket in vector:
+            ids = postings.get(bucket)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del postings[bucket]
+
+    def get(self, namespace: str, vector: dict) -> tuple:
+        """(answer, similarity) of the closest fresh entry at or above the threshold, else (None, best score)."""
+        with self._lock:
+            postings = self._postings.get(namespace, {})
+            scores = {}
+            for bucket, weight in vector.items():
+                for entry_id in postings.get(bucket, ()):
+                    scores[entry_id] = scores.get(entry_id, 0.0) + weight * self._entries[entry_id][1][bucket]
+            now = time.monotonic()
+            best = 0.0
+            for entry_id, score in sorted(scores.items(), key=lambda kv: -kv[1]):
+                best = max(best, score)
+                if score < self.threshold:
+                    break
+                if self._entries[entry_id][3] < now:
+                    self._remove(entry_id)
+                    continue
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return self._entries[entry_id][2], score
+            self.misses += 1
+            return None, best
 
-        # Strip markdown code fences that prevent HTML from rendering
-        import re as _re
-        assistant_message = _re.sub(r'```(?:html)?\s*', '', assistant_message)
-        assistant_message = _re.sub(r'```\s*', '', assistant_message)
+    def set(self, namespace: str, vector: dict, answer: str):
+        if not vector:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (namespace, vector, answer, time.monotonic() + self.ttl)
+            postings = self._postings.setdefault(namespace, {})
+            for bucket in vector:
+                postings.setdefault(bucket, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD)
+
+def semantic_cache_namespace(prepared: PreparedChat, completion_request: dict):
+    """Partition for semantic lookups, or None when this turn is not eligible."""
+    if not SEMANTIC_CACHE or prepared.history_turns or prepared.has_live_data:
+        return None
+    if prepared.live_blocks & SEMANTIC_UNCACHED_BLOCKS or _VERSE_REF_RE.search(prepared.clean_message):
+        return None
+    return "|".join([
+        completion_request['model'], str(completion_request['temperature']),
+        str(completion_request['max_tokens']), prepared.prefix, prepared.page_key,
+        ",".join(sorted(prepared.live_blocks)), f"polarity={semantic_polarity(prepared.clean_message)}",
+        "terms=" + " ".join(sorted(semantic_terms(prepared.clean_message))),
+    ])
+
+def cached_response(prepared: PreparedChat, completion_request: dict):
+    """A stored answer for this completion (exact prompt match first, then a paraphrase), or None."""
+    key = response_cache_key(prepared, completion_request)
+    if key is not None:
+        answer = response_cache.get(key)
+        if answer is not None:
+            print(f"[RESPONSE CACHE] Hit for '{prepared.clean_message[:60]}'", flush=True)
+            return answer
+    namespace = semantic_cache_namespace(prepared, completion_request)
+    if namespace is not None:
+        answer, similarity = semantic_cache.get(namespace, embed_text(prepared.clean_message))
+        if answer is not None:
+            print(f"[SEMANTIC CACHE] Hit ({similarity:.3f}) for '{prepared.clean_message[:60]}'", flush=True)
+            return answer
+    return None
+
+def remember_response(prepared: PreparedChat, completion_request: dict, answer: str):
+    """Store a fresh answer in whichever response caches this turn qualifies for."""
+    key = response_cache_key(prepared, completion_request)
+    if key is not None:
+        response_cache.set(key, answer)
+    namespace = semantic_cache_namespace(prepared, completion_request)
+    if namespace is not None:
+        semantic_cache.set(namespace, embed_text(prepared.clean_message), answer)
+
+# Model tiering — the answer model and max_tokens follow from what the pipeline detected.
+# Greetings, bare continuation replies and weather/time readouts go to the 8B model with a
+# tighter token cap; framework modes (ETS, CAI VQA, evolution, appreciation) and apologetics
+# stay on 70B whatever else matched, as does anything unclassified. MODEL_TIERING=0 sends
+# every turn to the full tier.
+MODEL_TIERING = os.environ.get("MODEL_TIERING", "1") != "0"
+LIGHT_MODEL = os.environ.get("LIGHT_MODEL", "llama-3.1-8b-instant")
+FULL_MODEL = os.environ.get("FULL_MODEL", "llama-3.3-70b-versatile")
+
+class ModelTier:
+    """One answer tier: the model and max_tokens its turns are sent with."""
+
+    def __init__(self, name: str, model: str, max_tokens: int):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def __repr__(self):
+        return f"ModelTier({self.name}: {self.model}, max_tokens={self.max_tokens})"
+
+def _tier(name: str, model: str, max_tokens: int) -> ModelTier:
+    key = name.upper()
+    return ModelTier(name, os.environ.get(f"TIER_{key}_MODEL", model),
+                     int(os.environ.get(f"TIER_{key}_MAX_TOKENS", str(max_tokens))))
+
+MODEL_TIERS = {
+    'greeting': _tier('greeting', LIGHT_MODEL, 300),
+    'continuation': _tier('continuation', LIGHT_MODEL, 900),
+    'readout': _tier('readout', LIGHT_MODEL, 400),
+    'full': _tier('full', FULL_MODEL, 1200),
+}
+
+# Context files and trigger groups that mark a turn as apologetics / framework work
+FULL_TIER_FILES = frozenset(['ets_full.txt', 'cai_vqa.txt', 'cai_evolution.txt', 'appreciation_full.txt', 'eschatology.txt'])
+FULL_TIER_TRIGGERS = frozenset(['theological', 'evolution', 'ets_full', 'appreciation_full', 'ai_confrontation', 'eschatology'])
+FULL_TIER_PREFIXES = frozenset(['[RUN ETS]', '[CAI VQA MODE]', '[CAI EVOLUTION]'])
+# Fetched weather/time data a readout turn presents; anything else (search results, images, a failed
+# lookup, asking the user for a location) goes to the full tier
+READOUT_BLOCKS = frozenset(['live_weather_time', 'live_weather', 'live_time'])
+
+_SMALLTALK_RE = re.compile(
+    r"(?:(?:hi|hello|hey|heya|hiya|howdy|yo|greetings|morning|evening|good (?:morning|afternoon|evening|day|night)"
+    r"|thanks|thank you|thx|cheers|bye|goodbye|goodnight|see you|lol|haha|nice|cool|great|awesome|wow)"
+    r"(?: (?:there|vq|friend|again|so much|very much|a lot|everyone|all))* ?)*"
+    r"(?:how are you(?: doing)?(?: today)?|how's it going|how're you|what's up|sup)?"
+)
+
+def is_smalltalk(message: str) -> bool:
+    """Whole-message greeting, thanks or goodbye ('hey VQ, how are you today?')."""
+    words = " ".join(_WORD_RE.findall(message.lower().replace("’", "'")))
+    return bool(words) and _SMALLTALK_RE.fullmatch(words) is not None
+
+def choose_tier(clean_message: str, mode_prefix: str, context_labels: list, live_blocks: set,
+                last_assistant: str = "") -> ModelTier:
+    """The ModelTier for one turn, from its mode prefix, loaded contexts, live blocks and continuity."""
+    if not MODEL_TIERING:
+        return MODEL_TIERS['full']
+    files = {label.split(' ')[0] for label in context_labels}
+    if mode_prefix in FULL_TIER_PREFIXES:
+        name = 'full'
+    elif not live_blocks and is_smalltalk(clean_message):
+        # Checked before the keyword triggers, which match substrings ('hello' loads eschatology)
+        name = 'greeting'
+    elif files & FULL_TIER_FILES or match_triggers(clean_message.lower()) & FULL_TIER_TRIGGERS:
+        name = 'full'
+    elif last_assistant:
+        # A "yes, go on" inherits the weight of whatever was offered
+        name = 'full' if match_triggers(last_assistant[-600:].lower()) & FULL_TIER_TRIGGERS else 'continuation'
+    elif live_blocks & READOUT_BLOCKS and not (live_blocks & LIVE_DATA_BLOCKS) - READOUT_BLOCKS:
+        name = 'readout'
+    else:
+        name = 'full'
+    tier = MODEL_TIERS[name]
+    print(f"[TIER] {tier.name} → {tier.model} (max_tokens={tier.max_tokens})", flush=True)
+    return tier
+
+def completion_usage(response):
+    """Token usage reported on a completion or stream chunk (Groq puts the stream's on x_groq), or None."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        usage = getattr(getattr(response, 'x_groq', None), 'usage', None)
+    return usage
+
+def record_tier(tier: ModelTier, seconds: float, usage=None):
+    """Per-tier request count, completion latency and token usage."""
+    metrics.inc("vq_tier_requests_total", tier=tier.name)
+    metrics.observe("vq_tier_completion_seconds", seconds, tier=tier.name)
+    if usage is not None:
+        metrics.inc("vq_tier_tokens_total", getattr(usage, 'prompt_tokens', 0) or 0, tier=tier.name, kind='prompt')
+        metrics.inc("vq_tier_tokens_total", getattr(usage, 'completion_tokens', 0) or 0, tier=tier.name, kind='completion')
+
+def chat_completion_request(prepared: PreparedChat, **extra) -> dict:
+    """Keyword arguments for the main answer call, shared by every chat endpoint."""
+    return dict(
+        model=prepared.tier.model,
+        messages=prepared.messages,
+        temperature=0.7,
+        max_tokens=prepared.tier.max_tokens,
+        **extra
+    )
+
+_FENCE_RE = re.compile(r'```(?:html)?\s*')
+_BARE_FENCE_RE = re.compile(r'```\s*')
+# A trailing backtick run (plus a partial "html" tag and whitespace) may still grow into a fence
+_FENCE_TAIL_RE = re.compile(r'`+(?:h(?:t(?:m(?:l)?)?)?)?\s*\Z')
+
+def strip_code_fences(text: str) -> str:
+    """Strip markdown code fences that prevent HTML from rendering."""
+    text = _FENCE_RE.sub('', text)
+    return _BARE_FENCE_RE.sub('', text)
+
+class CodeFenceStripper:
+    """
+    Incremental strip_code_fences() for streamed output.
+    Holds back only a tail that could still become part of a fence, so
+    fed-then-flushed text matches stripping the complete response.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        buf = self._pending + chunk
+        tail = _FENCE_TAIL_RE.search(buf)
+        cut = tail.start() if tail else len(buf)
+        self._pending = buf[cut:]
+        return strip_code_fences(buf[:cut])
+
+    def flush(self) -> str:
+        out, self._pending = strip_code_fences(self._pending), ""
+        return out
+
+TEST_IMAGE_RESPONSE = (
+    'Image rendering test 🌌 <img src="https://images-assets.nasa.gov/image/PIA16695/PIA16695~orig.jpg" '
+    'style="width:100%;border-radius:8px;margin-top:8px;"> If you can see a Mars rover above — pipeline confirmed! 🚀'
+)
+
+def _chat_preconditions(data):
+    """Shared request validation for every chat endpoint. Returns (error payload, status) or None."""
+    if not groq_client:
+        print("Chat request received but Groq not initialized", flush=True)
+        return {
+            'error': 'Groq client unavailable',
+            'response': 'Backend configuration issue. Please contact admin.'
+        }, 503
+    if not isinstance(data, dict) or not data.get('message', ''):
+        return {'error': 'No message provided'}, 400
+    if session_lost(data):
+        # The client still holds the conversation: have it resend its history instead of
+        # answering this turn with none
+        return {'error': 'Unknown session', 'sessionExpired': True}, 409
+    return None
+
+CHAT_ERROR_REPLY = "Friend, something needs attention. Please try again."
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    with request_timing('chat') as timer:
+        # A missing or malformed JSON body is reported as 'No message provided', not a bare 400
+        payload, status = _chat(request.get_json(silent=True))
+        timer.status = status
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+def _chat(data) -> tuple:
+    try:
+        error = _chat_preconditions(data)
+        if error:
+            return error
+
+        user_message = data.get('message', '')
+        history, summary, session_id = resolve_history(data)
+        prepared = prepare_chat(user_message, history, data.get('pageContext', None), summary)
+        completion_request = chat_completion_request(prepared)
+        assistant_message = cached_response(prepared, completion_request)
+
+        if assistant_message is None:
+            print(f"Calling Groq API with {len(prepared.messages)} messages", flush=True)
+
+            # Call Groq
+            started = time.perf_counter()
+            with timed_phase('completion'):
+                completion, path = complete_chat(completion_request)
+            record_tier(prepared.tier, time.perf_counter() - started, completion_usage(completion))
+
+            with timed_phase('postprocess'):
+                assistant_message = strip_code_fences(completion.choices[0].message.content)
+            if path != 'fallback':
+                remember_response(prepared, completion_request, assistant_message)
 
         # Test image rendering
         if 'test image rendering' in user_message.lower():
-            test_img = '<img src="https://images-assets.nasa.gov/image/PIA16695/PIA16695~orig.jpg" style="width:100%;border-radius:8px;margin-top:8px;">'
-            assistant_message = f"Image rendering test 🌌 {test_img} If you can see a Mars rover above — pipeline confirmed! 🚀"
+            assistant_message = TEST_IMAGE_RESPONSE
 
-        return jsonify({'response': assistant_message})
+        record_turn(session_id, prepared, assistant_message)
+        if session_id:
+            return {'response': assistant_message, 'sessionId': session_id}, 200
+        return {'response': assistant_message}, 200
         
     except Exception as e:
         print(f"Chat error: {e}", flush=True)
         import traceback
         traceback.print_exc()
-        return jsonify({
+        return {
             'error': str(e),
-            'response': "Friend, something needs attention. Please try again."
-        }), 500
+            'response': CHAT_ERROR_REPLY
+        }, 500
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+def done_event(response: str, session_id=None) -> dict:
+    """Final SSE payload: the full cleaned text, plus the session id in session mode."""
+    if session_id:
+        return {'done': True, 'response': response, 'sessionId': session_id}
+    return {'done': True, 'response': response}
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Server-Sent Events variant of /chat. Same request body; emits
+    {"delta": ...} events as Groq produces tokens, then one
+    {"done": true, "response": ...} event carrying the full cleaned text.
+    """
+    data = request.get_json(silent=True)
+    error = _chat_preconditions(data)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    user_message = data.get('message', '')
+    page_context = data.get('pageContext', None)
+
+    def generate():
+        with request_timing('chat_stream') as timer:
+            try:
+                history, summary, session_id = resolve_history(data)
+                prepared = prepare_chat(user_message, history, page_context, summary)
+                if 'test image rendering' in user_message.lower():
+                    record_turn(session_id, prepared, TEST_IMAGE_RESPONSE)
+                    yield _sse(done_event(TEST_IMAGE_RESPONSE, session_id))
+                    return
+
+                completion_request = chat_completion_request(prepared, stream=True)
+                cached = cached_response(prepared, completion_request)
+                if cached is not None:
+                    record_turn(session_id, prepared, cached)
+                    yield _sse({'delta': cached})
+                    yield _sse(done_event(cached, session_id))
+                    return
+
+                print(f"Calling Groq API (stream) with {len(prepared.messages)} messages", flush=True)
+                started = time.perf_counter()
+                stream, path = complete_chat(completion_request)
+                stripper = CodeFenceStripper()
+                parts = []
+                usage = None
+                # Closing hands the upstream slot back even if the client disconnects mid-stream
+                with closing(stream):
+                    for chunk in stream:
+                        usage = completion_usage(chunk) or usage
+                        if not chunk.choices:
+                            continue
+                        delta = stripper.feed(chunk.choices[0].delta.content or "")
+                        if delta:
+                            if not parts:
+                                record_phase('completion_first_token', time.perf_counter() - started)
+                            parts.append(delta)
+                            yield _sse({'delta': delta})
+                tail = stripper.flush()
+                if tail:
+                    parts.append(tail)
+                    yield _sse({'delta': tail})
+                record_phase('completion', time.perf_counter() - started)
+                record_tier(prepared.tier, time.perf_counter() - started, usage)
+                full_response = ''.join(parts)
+                if path != 'fallback':
+                    remember_response(prepared, completion_request, full_response)
+                record_turn(session_id, prepared, full_response)
+                yield _sse(done_event(full_response, session_id))
+
+            except Exception as e:
+                print(f"Chat stream error: {e}", flush=True)
+                import traceback
+                traceback.print_exc()
+                timer.status = 500
+                yield _sse({
+                    'error': str(e),
+                    'response': CHAT_ERROR_REPLY
+                })
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Forget a server-side conversation (the widget's "clear" button)."""
+    if SessionStore.valid_id(session_id):
+        session_store.delete(session_id)
+    return jsonify({'deleted': True})
+
+# 6b. Async serving mode (ASGI): /chat and /chat/stream run as coroutines on one event
+# loop, so a worker holds hundreds of in-flight chats while they wait on Groq/OWM/DDG.
+# Every other route (health, CORS preflight) is handed to the Flask app above.
+#   uvicorn vq-chat-backend:asgi_app --host 0.0.0.0 --port $PORT
+try:
+    from a2wsgi import WSGIMiddleware
+    _flask_asgi = WSGIMiddleware(app, workers=int(os.environ.get("ASGI_WSGI_WORKERS", "10")))
+except Exception as e:
+    _flask_asgi = None
+    print(f"⚠ a2wsgi unavailable ({e}) — ASGI mode serves only the chat routes", flush=True)
+
+_JSON_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"access-control-allow-origin", b"*"),
+]
+_SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+    (b"access-control-allow-origin", b"*"),
+]
+
+async def _read_json_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+async def _send_json(send, payload: dict, status: int = 200, headers: list = ()):
+    await send({"type": "http.response.start", "status": status, "headers": _JSON_HEADERS + list(headers)})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+async def chat_async(data: dict) -> tuple:
+    """The /chat handler as a coroutine. Returns (payload, status)."""
+    try:
+        error = await asyncio.to_thread(_chat_preconditions, data)
+        if error:
+            return error
+
+        user_message = data.get('message', '')
+        history, summary, session_id = await asyncio.to_thread(resolve_history, data)
+        prepared = await prepare_chat_async(user_message, history, data.get('pageContext', None), summary)
+        completion_request = chat_completion_request(prepared)
+        assistant_message = await asyncio.to_thread(cached_response, prepared, completion_request)
+
+        if assistant_message is None:
+            print(f"Calling Groq API (async) with {len(prepared.messages)} messages", flush=True)
+            started = time.perf_counter()
+            with timed_phase('completion'):
+                completion, path = await complete_chat_async(completion_request)
+            record_tier(prepared.tier, time.perf_counter() - started, completion_usage(completion))
+
+            with timed_phase('postprocess'):
+                assistant_message = strip_code_fences(completion.choices[0].message.content)
+            if path != 'fallback':
+                await asyncio.to_thread(remember_response, prepared, completion_request, assistant_message)
+
+        # Test image rendering
+        if 'test image rendering' in user_message.lower():
+            assistant_message = TEST_IMAGE_RESPONSE
+
+        await record_turn_async(session_id, prepared, assistant_message)
+        if session_id:
+            return {'response': assistant_message, 'sessionId': session_id}, 200
+        return {'response': assistant_message}, 200
+
+    except Exception as e:
+        print(f"Chat error: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return {'error': str(e), 'response': CHAT_ERROR_REPLY}, 500
+
+async def chat_stream_async(data: dict, send):
+    """The /chat/stream handler as a coroutine; writes SSE events straight to the ASGI `send`."""
+    timer = _request_timer.get()
+    error = await asyncio.to_thread(_chat_preconditions, data)
+    if error:
+        timer.status = error[1]
+        await _send_json(send, *error)
+        return
+
+    async def emit(payload):
+        await send({"type": "http.response.body", "body": _sse(payload).encode(), "more_body": True})
+
+    await send({"type": "http.response.start", "status": 200, "headers": _SSE_HEADERS})
+    user_message = data.get('message', '')
+    try:
+        history, summary, session_id = await asyncio.to_thread(resolve_history, data)
+        prepared = await prepare_chat_async(user_message, history, data.get('pageContext', None), summary)
+        if 'test image rendering' in user_message.lower():
+            await record_turn_async(session_id, prepared, TEST_IMAGE_RESPONSE)
+            await emit(done_event(TEST_IMAGE_RESPONSE, session_id))
+        else:
+            completion_request = chat_completion_request(prepared, stream=True)
+            cached = await asyncio.to_thread(cached_response, prepared, completion_request)
+            if cached is not None:
+                await record_turn_async(session_id, prepared, cached)
+                await emit({'delta': cached})
+                await emit(done_event(cached, session_id))
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            print(f"Calling Groq API (async stream) with {len(prepared.messages)} messages", flush=True)
+            started = time.perf_counter()
+            stream, path = await complete_chat_async(completion_request)
+            stripper = CodeFenceStripper()
+            parts = []
+            usage = None
+            async with aclosing(stream):
+                async for chunk in stream:
+                    usage = completion_usage(chunk) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = stripper.feed(chunk.choices[0].delta.content or "")
+                    if delta:
+                        if not parts:
+                            record_phase('completion_first_token', time.perf_counter() - started)
+                        parts.append(delta)
+                        await emit({'delta': delta})
+            tail = stripper.flush()
+            if tail:
+                parts.append(tail)
+                await emit({'delta': tail})
+            record_phase('completion', time.perf_counter() - started)
+            record_tier(prepared.tier, time.perf_counter() - started, usage)
+            full_response = ''.join(parts)
+            if path != 'fallback':
+                await asyncio.to_thread(remember_response, prepared, completion_request, full_response)
+            await record_turn_async(session_id, prepared, full_response)
+            await emit(done_event(full_response, session_id))
+
+    except Exception as e:
+        print(f"Chat stream error: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        timer.status = 500
+        await emit({'error': str(e), 'response': CHAT_ERROR_REPLY})
+    await send({"type": "http.response.body", "body": b""})
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: native coroutine chat routes, Flask for the rest."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if http_async_session is not None:
+                    await http_async_session.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ("/chat", "/chat/stream"):
+        data = await _read_json_body(receive)
+        if scope["path"] == "/chat":
+            with request_timing('chat') as timer:
+                payload, timer.status = await chat_async(data)
+            await _send_json(send, payload, timer.status, [(b"server-timing", timer.server_timing().encode())])
+        else:
+            with request_timing('chat_stream') as timer:
+                await chat_stream_async(data, send)
+        return
+
+    if _flask_asgi is None:
+        await _send_json(send, {'error': 'Not found'}, 404)
+        return
+    await _flask_asgi(scope, receive, send)
+
+# 6c. Prometheus scrape endpoint — per-process; each worker reports its own histograms
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    gauges = {}
+    for name, cache in (('search', search_cache), ('owm', owm_cache), ('major_city', major_city_cache),
+                        ('route', route_cache), ('response', response_cache), ('page', page_content_cache)):
+        stats = cache.stats()
+        labels = (('cache', name),)
+        gauges[('vq_cache_hits_total', labels)] = stats['hits']
+        gauges[('vq_cache_misses_total', labels)] = stats['misses']
+        gauges[('vq_cache_entries', labels)] = stats['size']
+    gauges[('vq_sessions_active', ())] = len(session_store)
+    for name, limiter in upstream_limits.items():
+        gauges[('vq_upstream_in_flight', (('upstream', name),))] = limiter.in_flight
+    for flights in (classifier_flights, ddg_flights, owm_flights, web_search_flights):
+        gauges[('vq_singleflight_in_flight', (('upstream', flights.name),))] = flights.in_flight()
+    semantic = semantic_cache.stats()
+    lookups = semantic['hits'] + semantic['misses']
+    gauges[('vq_semantic_cache_hits_total', ())] = semantic['hits']
+    gauges[('vq_semantic_cache_misses_total', ())] = semantic['misses']
+    gauges[('vq_semantic_cache_evictions_total', ())] = semantic['evictions']
+    gauges[('vq_semantic_cache_entries', ())] = semantic['size']
+    gauges[('vq_semantic_cache_hit_ratio', ())] = semantic['hits'] / lookups if lookups else 0.0
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 print("Chat route registered", flush=True)
 
@@ -0,0 +1,454 @@
+"""
+Offline benchmark for the VQ chat backend.
+
+Drives /chat through the Flask test client (WSGI mode) or straight through
+asgi_app (ASGI mode) with Groq, DDGS and OpenWeatherMap replaced by local
+stand-ins that sleep for a configurable latency. No network or API keys needed.
+
+    python vq-chat-bench.py                          # every scenario, WSGI mode
+    python vq-chat-bench.py --mode asgi --concurrency 64 --requests 200
+    python vq-chat-bench.py --scenario news --scenario web_search --phases
+    python vq-chat-bench.py --messages inputs.jsonl  # one {"message": ..., "history": [...]} per line
+
+Reports throughput, p50/p95/p99 latency and main-prompt size per scenario.
+Upstream caches are cleared before every request unless --warm is given.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import importlib
+import threading
+import contextvars
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+# Must be set before the backend is imported: enables the OWM path
+os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+os.environ.pop("GROQ_API_KEY", None)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Main prompt seen by the async stub; each ASGI request runs in its own task, so they stay apart
+_async_prompt = contextvars.ContextVar("bench_prompt", default=None)
+
+def _long_history(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Question {i}: what does the evidence say about the empty tomb and the early creeds?"})
+        history.append({"role": "assistant", "content": "The earliest creed in 1 Corinthians 15 dates within a few years of the events. " * 6})
+    return history
+
+PAGE_CONTEXT = {
+    "pageType": "vq-site",
+    "url": "https://veritasquaesitorcai.github.io/mission.html",
+    "title": "Mission",
+    "content": ("Our mission is to build AI that seeks truth with humility. " * 40),
+}
+
+# name -> request body. Covers the prefix modes and each pre-flight path.
+SCENARIOS = {
+    "greeting": {"message": "hey VQ, how are you today?"},
+    "theology": {"message": "what evidence is there for the resurrection?"},
+    "web_search": {"message": "[DDG SEARCH] best budget phones"},
+    "news": {"message": "[DDG NEWS] AI regulation this week"},
+    "weather": {"message": "what's the weather in Durban?"},
+    "time_and_weather": {"message": "[TIME AND WEATHER] Amanzimtoti"},
+    "image": {"message": "show me a picture of the Eiffel Tower"},
+    "run_ets": {"message": "[RUN ETS] the universe had a beginning"},
+    "cai_vqa": {"message": "[CAI VQA MODE] is consciousness reducible to computation?"},
+    "continuation": {"message": "yes", "history": [
+        {"role": "user", "content": "tell me about CAI"},
+        {"role": "assistant", "content": "CAI is Christ-Anchored Intelligence. Want me to walk you through the ETS tiers?"},
+    ]},
+    "long_history": {"message": "so how does that fit with the creeds?", "history": _long_history(20)},
+    "page_context": {"message": "what is this page about?", "pageContext": PAGE_CONTEXT},
+}
+
+
+class Latency:
+    """Stand-in upstream latency: base milliseconds with uniform +/- jitter."""
+
+    def __init__(self, ms: float, jitter: float, rng: random.Random):
+        self.ms = ms
+        self.jitter = jitter
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def seconds(self) -> float:
+        with self._lock:
+            spread = self._rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.ms * (1 + spread)) / 1000.0
+
+    def sleep(self):
+        time.sleep(self.seconds())
+
+    async def asleep(self):
+        await asyncio.sleep(self.seconds())
+
+
+class StubGroq:
+    """Answers every prompt the backend sends, sync and async, streaming or not."""
+
+    def __init__(self, backend, classifier: Latency, completion: Latency, light_completion: Latency):
+        self.backend = backend
+        self.classifier = classifier
+        self.completion = completion
+        self.light_completion = light_completion
+        self.prompts = threading.local()
+
+    def _reply(self, model: str, messages: list, kwargs: dict) -> str:
+        system = messages[0]["content"]
+        user = messages[-1]["content"]
+        lowered = user.lower()
+        if kwargs.get("response_format"):
+            weather = self.backend.is_weather_query(user) or "weather" in lowered
+            wants_time = self.backend.is_time_query(user)
+            words = user.split()
+            location = words[-1].strip("?.!") if words and (weather or wants_time or len(words) == 1) else ""
+            return json.dumps({
+                "needs_search": any(w in lowered for w in ("latest", "news", "best", "price")),
+                "search_query": user[:40],
+                "is_news": "news" in lowered,
+                "location": location,
+                "wants_time": wants_time,
+                "wants_weather": weather,
+                "image_query": "Eiffel Tower" if self.backend.is_image_query(user) else "",
+            })
+        if "nearest major city" in system:
+            return "Durban"
+        if "ONLY the location" in system or "ONLY the city" in system:
+            return user.split()[-1].strip("?.!") if user.split() else "UNKNOWN"
+        if "image search query" in system:
+            return "Eiffel Tower"
+        if "web search query" in system:
+            return f"QUERY: {user[:40]}\nNEWS: {'YES' if 'news' in lowered else 'NO'}"
+        if "router" in system:
+            return "YES" if "news" in lowered or "latest" in lowered else "NO"
+        return "Friend, here is a considered answer. " * 20
+
+    def _is_main(self, messages: list) -> bool:
+        return messages[0]["content"].startswith(self.backend.VQ_SYSTEM_PROMPT[:64])
+
+    def _latency(self, model: str, main: bool) -> Latency:
+        if not main:
+            return self.classifier
+        return self.completion if "70b" in model else self.light_completion
+
+    def create_sync(self, model, messages, **kwargs):
+        main = self._is_main(messages)
+        if main:
+            self.prompts.last = messages
+        self._latency(model, main).sleep()
+        return self._package(self._reply(model, messages, kwargs), kwargs.get("stream"))
+
+    async def create_async(self, model, messages, **kwargs):
+        main = self._is_main(messages)
+        if main:
+            _async_prompt.set(messages)
+        await self._latency(model, main).asleep()
+        return self._package(self._reply(model, messages, kwargs), kwargs.get("stream"), asynchronous=True)
+
+    @staticmethod
+    def _package(text: str, stream: bool, asynchronous: bool = False):
+        def chunk(piece):
+            message = SimpleNamespace(content=piece)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, delta=message)], usage=None)
+        if not stream:
+            return chunk(text)
+        pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+        if not asynchronous:
+            return iter([chunk(p) for p in pieces])
+
+        async def agen():
+            for p in pieces:
+                yield chunk(p)
+        return agen()
+
+    def clients(self):
+        sync = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create_sync)))
+        asynchronous = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create_async)))
+        sync.with_options = lambda **_: sync
+        asynchronous.with_options = lambda **_: asynchronous
+        return sync, asynchronous
+
+
+class StubDDGS:
+    """DDGS stand-in: text / news / images with canned results."""
+    latency = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def text(self, query, max_results=8, **kwargs):
+        self.latency.sleep()
+        return [{"title": f"{query} result {i}", "body": "Snippet text " * 12, "href": f"https://example.com/{i}"}
+                for i in range(max_results)]
+
+    def news(self, query, max_results=8, **kwargs):
+        self.latency.sleep()
+        return [{"title": f"{query} headline {i}", "body": "News body " * 12, "url": f"https://news.example.com/{i}",
+                 "source": "Example News"} for i in range(max_results)]
+
+    def images(self, query, max_results=5, **kwargs):
+        self.latency.sleep()
+        return [{"image": f"https://img.example.com/{i}.jpg", "title": query} for i in range(max_results)]
+
+
+def _owm_payload(city: str) -> dict:
+    if city.lower() not in ("durban", "london", "tokyo", "new york"):
+        return {"cod": "404", "message": "city not found"}
+    return {
+        "cod": 200, "name": city.title(), "sys": {"country": "ZA"}, "timezone": 7200,
+        "main": {"temp": 24.3, "feels_like": 25.1, "humidity": 70, "temp_min": 21.0, "temp_max": 27.0},
+        "weather": [{"description": "scattered clouds"}], "wind": {"speed": 4.2},
+    }
+
+class _OWMResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+class StubOWMSession:
+    """Replaces the shared httpx clients; only the OWM endpoint is ever requested through them."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def get(self, url, params=None, **kwargs):
+        self.latency.sleep()
+        return _OWMResponse(_owm_payload(params["q"]))
+
+class StubAsyncOWMSession(StubOWMSession):
+    async def get(self, url, params=None, **kwargs):
+        await self.latency.asleep()
+        return _OWMResponse(_owm_payload(params["q"]))
+
+    async def aclose(self):
+        pass
+
+
+def load_backend(args):
+    """Import the backend quietly and swap every upstream for a stand-in."""
+    sys.path.insert(0, HERE)
+    os.chdir(HERE)
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+    backend = importlib.import_module("vq-chat-backend")
+    rng = random.Random(args.seed)
+    classifier = Latency(args.classifier_ms, args.jitter, rng)
+    completion = Latency(args.completion_ms, args.jitter, rng)
+    light_completion = Latency(args.light_completion_ms, args.jitter, rng)
+    StubDDGS.latency = Latency(args.ddg_ms, args.jitter, rng)
+    owm_latency = Latency(args.owm_ms, args.jitter, rng)
+
+    groq = StubGroq(backend, classifier, completion, light_completion)
+    backend.groq_client, backend.groq_async_client = groq.clients()
+    backend.DDGS = StubDDGS
+    backend.ddg_available = True
+    backend.ddgs_pool = backend.DDGSPool(backend.DDGS_POOL_SIZE, backend.HTTP_TIMEOUT_SECONDS)
+    backend.owm_available = True
+    backend.OWM_API_KEY = "bench"
+    backend.http_session = StubOWMSession(owm_latency)
+    backend.http_async_session = StubAsyncOWMSession(owm_latency)
+    if not args.rate_limits:
+        # The stand-ins have no quotas; measure the request path, not the configured budgets
+        for limiter in backend.upstream_limits.values():
+            limiter.rate = 0
+            limiter.concurrency = 1 << 30
+    return backend, groq, stdout
+
+
+def clear_caches(backend):
+    for cache in (backend.search_cache, backend.owm_cache, backend.major_city_cache,
+                  backend.route_cache, backend.response_cache, backend.semantic_cache):
+        cache.clear()
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def parse_server_timing(header: str) -> dict:
+    phases = {}
+    for part in (header or "").split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if name and dur:
+            phases[name] = phases.get(name, 0.0) + float(dur)
+    return phases
+
+
+def prompt_size(backend, messages: list) -> tuple:
+    if not messages:
+        return 0, 0
+    text = "".join(m["content"] for m in messages)
+    return backend.estimate_tokens(text), len(text)
+
+
+def run_wsgi(backend, groq, body: dict, count: int, concurrency: int, warm: bool) -> list:
+    client = backend.app.test_client()
+
+    def one(_):
+        if not warm:
+            clear_caches(backend)
+        groq.prompts.last = None
+        start = time.perf_counter()
+        response = client.post("/chat", json=body)
+        elapsed = time.perf_counter() - start
+        return (elapsed, response.status_code, response.headers.get("Server-Timing", ""),
+                prompt_size(backend, groq.prompts.last))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(count)))
+
+
+def run_asgi(backend, body: dict, count: int, concurrency: int, warm: bool) -> list:
+    payload = json.dumps(body).encode()
+
+    async def one(gate):
+        async with gate:
+            if not warm:
+                clear_caches(backend)
+            _async_prompt.set(None)
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": payload, "more_body": False}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "http", "method": "POST", "path": "/chat", "headers": [], "query_string": b""}
+            start = time.perf_counter()
+            await backend.asgi_app(scope, receive, send)
+            elapsed = time.perf_counter() - start
+            headers = dict(sent[0].get("headers", []))
+            timing = headers.get(b"server-timing", b"").decode()
+            return elapsed, sent[0]["status"], timing, prompt_size(backend, _async_prompt.get())
+
+    async def main():
+        gate = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[one(gate) for _ in range(count)])
+
+    return asyncio.run(main())
+
+
+def summarize(name: str, results: list, wall: float) -> dict:
+    latencies = [r[0] * 1000 for r in results]
+    tokens = [r[3][0] for r in results if r[3][0]]
+    chars = [r[3][1] for r in results if r[3][1]]
+    phases = {}
+    for r in results:
+        for phase, ms in parse_server_timing(r[2]).items():
+            phases.setdefault(phase, []).append(ms)
+    return {
+        "scenario": name,
+        "requests": len(results),
+        "errors": sum(1 for r in results if r[1] != 200),
+        "throughput": len(results) / wall if wall else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "prompt_tokens": sum(tokens) / len(tokens) if tokens else 0,
+        "prompt_chars": sum(chars) / len(chars) if chars else 0,
+        "phases": {phase: sum(v) / len(v) for phase, v in phases.items()},
+    }
+
+
+def format_report(rows: list, args) -> str:
+    lines = [
+        f"mode={args.mode} requests/scenario={args.requests} concurrency={args.concurrency} "
+        f"latency ms: classifier={args.classifier_ms} completion={args.completion_ms}/{args.light_completion_ms} "
+        f"ddg={args.ddg_ms} owm={args.owm_ms} jitter={args.jitter} caches={'warm' if args.warm else 'cold'}",
+        "",
+        f"{'scenario':<18}{'n':>5}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'prompt tok':>12}{'chars':>9}",
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['scenario']:<18}{row['requests']:>5}{row['errors']:>5}{row['throughput']:>9.1f}"
+            f"{row['p50']:>9.0f}{row['p95']:>9.0f}{row['p99']:>9.0f}{row['prompt_tokens']:>12.0f}{row['prompt_chars']:>9.0f}"
+        )
+        if args.phases and row["phases"]:
+            lines.append("    " + "  ".join(f"{p}={ms:.1f}" for p, ms in sorted(row["phases"].items(), key=lambda kv: -kv[1])))
+    return "\n".join(lines)
+
+
+def load_scenarios(args) -> dict:
+    scenarios = dict(SCENARIOS)
+    if args.messages:
+        scenarios = {}
+        with open(args.messages) as f:
+            for i, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                body = {"message": entry.get("message") or entry.get("body", "")}
+                for key in ("history", "pageContext"):
+                    if key in entry:
+                        body[key] = entry[key]
+                scenarios[entry.get("name") or entry.get("request_id") or f"input_{i}"] = body
+    if args.scenario:
+        unknown = set(args.scenario) - set(scenarios)
+        if unknown:
+            raise SystemExit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        scenarios = {name: scenarios[name] for name in args.scenario}
+    return scenarios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline /chat benchmark with stubbed upstreams.")
+    parser.add_argument("--mode", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenario", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--messages", help="JSONL file of request bodies to use instead of the built-in scenarios")
+    parser.add_argument("--classifier-ms", type=float, default=150, help="8B classifier/router latency")
+    parser.add_argument("--completion-ms", type=float, default=1200, help="70B answer latency")
+    parser.add_argument("--light-completion-ms", type=float, default=400, help="8B answer latency (light model tiers)")
+    parser.add_argument("--ddg-ms", type=float, default=600)
+    parser.add_argument("--owm-ms", type=float, default=200)
+    parser.add_argument("--jitter", type=float, default=0.2, help="uniform +/- fraction applied to every latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warm", action="store_true", help="keep upstream caches between requests")
+    parser.add_argument("--rate-limits", action="store_true", help="apply the backend's upstream rate limits to the stubs")
+    parser.add_argument("--phases", action="store_true", help="show mean Server-Timing phases per scenario")
+    parser.add_argument("--json", action="store_true", help="emit results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the backend's own log output")
+    args = parser.parse_args(argv)
+
+    backend, groq, stdout = load_backend(args)
+    scenarios = load_scenarios(args)
+    rows = []
+    try:
+        for name, body in scenarios.items():
+            body = {"history": [], **body}
+            start = time.perf_counter()
+            if args.mode == "wsgi":
+                results = run_wsgi(backend, groq, body, args.requests, args.concurrency, args.warm)
+            else:
+                results = run_asgi(backend, body, args.requests, args.concurrency, args.warm)
+            rows.append(summarize(name, results, time.perf_counter() - start))
+    finally:
+        sys.stdout = stdout
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(format_report(rows, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,10 @@
     // Configuration
     const CONFIG = {
         apiEndpoint: 'https://veritas-quaesitor-production.up.railway.app/chat',
+        streamEndpoint: 'https://veritas-quaesitor-production.up.railway.app/chat/stream',
+        sessionEndpoint: 'https://veritas-quaesitor-production.up.railway.app/session/',
+        streaming: true,
+        serverSessions: true,
         welcomeMessage: `Hey! 👋 I'm VQ, your VQ CAI guide.
         
 I'm here to help. 
@@ -529,8 +533,9 @@ Where do we Start?`
         const sendBtn = document.getElementById('vq-chat-send');
         const messagesContainer = document.getElementById('vq-chat-messages');
 
-        // Conversation history
+        // Conversation history (kept locally for display; the server holds the session copy)
         let conversationHistory = [];
+        let sessionId = localStorage.getItem('vq-session-id');
         let activePill = null; // capability pill mode
 
         // PERSISTENCE: Load saved state from localStorage
@@ -617,7 +622,19 @@ Where do we Start?`
             }
         }
         
+        function rememberSession(id) {
+            if (id && id !== sessionId) {
+                sessionId = id;
+                localStorage.setItem('vq-session-id', id);
+            }
+        }
+
         function clearConversation() {
+            if (sessionId) {
+                fetch(CONFIG.sessionEndpoint + encodeURIComponent(sessionId), { method: 'DELETE' }).catch(() => {});
+                sessionId = null;
+                localStorage.removeItem('vq-session-id');
+            }
             localStorage.removeItem('vq-conversation-history');
             localStorage.setItem('vq-widget-open', 'true');
             messagesContainer.innerHTML = '';
@@ -707,6 +724,65 @@ Where do we Start?`
             if (typingDiv) typingDiv.remove();
         }
 
+        function addStreamingBubble() {
+            const messageDiv = document.createElement('div');
+            messageDiv.className = 'vq-message';
+            messageDiv.innerHTML = `
+                <div class="vq-message-avatar">🕊️</div>
+                <div class="vq-message-content"></div>
+            `;
+            const bubble = messageDiv.querySelector('.vq-message-content');
+            bubble.style.whiteSpace = 'pre-wrap';
+            messagesContainer.appendChild(messageDiv);
+            return { messageDiv, bubble };
+        }
+
+        // Reads the /chat/stream SSE body, painting deltas as they arrive.
+        // Resolves with the final cleaned response text.
+        async function readStream(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let text = '';
+            let live = null;
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    const dataLine = rawEvent.split('\n').find(l => l.startsWith('data: '));
+                    if (!dataLine) continue;
+                    const event = JSON.parse(dataLine.slice(6));
+
+                    if (event.error) {
+                        if (live) live.messageDiv.remove();
+                        throw new Error(event.error);
+                    }
+                    if (event.delta) {
+                        if (!live) {
+                            hideTypingIndicator();
+                            live = addStreamingBubble();
+                        }
+                        text += event.delta;
+                        live.bubble.textContent = text;
+                        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                    }
+                    if (event.done) {
+                        if (live) live.messageDiv.remove();
+                        rememberSession(event.sessionId);
+                        return event.response;
+                    }
+                }
+            }
+            if (live) live.messageDiv.remove();
+            return text;
+        }
+
         function getSmartPageContext() {
             const url = window.location.href;
             const pathname = window.location.pathname;
@@ -898,22 +974,49 @@ Where do we Start?`
             const pageContext = getSmartPageContext();
             showTypingIndicator();
 
+            // Session mode sends only the new message; a conversation saved before
+            // sessions existed is handed over once so the server can adopt it
+            const body = { message: message, pageContext: pageContext };
+            if (CONFIG.serverSessions) {
+                body.sessionId = sessionId;
+                if (!sessionId && conversationHistory.length > 2) {
+                    body.history = conversationHistory.slice(0, -1);
+                }
+            } else {
+                body.history = conversationHistory;
+            }
+
             try {
-                const response = await fetch(CONFIG.apiEndpoint, {
+                const useStream = CONFIG.streaming && window.ReadableStream && window.TextDecoder;
+                const post = () => fetch(useStream ? CONFIG.streamEndpoint : CONFIG.apiEndpoint, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        message: message,
-                        history: conversationHistory,
-                        pageContext: pageContext
-                    })
+                    body: JSON.stringify(body)
                 });
+                let response = await post();
+
+                // The server lost this session (restart, expiry): start a new one from the local copy
+                if (response.status === 409 && CONFIG.serverSessions) {
+                    sessionId = null;
+                    localStorage.removeItem('vq-session-id');
+                    body.sessionId = null;
+                    body.history = conversationHistory.slice(0, -1);
+                    response = await post();
+                }
 
                 if (!response.ok) throw new Error('Network response was not ok');
 
-                const data = await response.json();
-                hideTypingIndicator();
-                addMessage('assistant', data.response);
+                if (useStream && response.body) {
+                    // Live text streams in; the final message is re-rendered so images display
+                    const fullResponse = await readStream(response);
+                    hideTypingIndicator();
+                    addMessage('assistant', fullResponse);
+                } else {
+                    const data = await response.json();
+                    hideTypingIndicator();
+                    rememberSession(data.sessionId);
+                    addMessage('assistant', data.response);
+                }
                 
             } catch (error) {
                 console.error('Error:', error);
@@ -0,0 +1,205 @@
+"""
+Train and evaluate the local search-intent classifier used by needs_search().
+
+Fits a logistic regression over the backend's intent_features() on
+labelled messages: the bundled seed set plus any router logs collected with
+ROUTER_LOG_PATH. Reports agreement with the LLM router on a held-out split
+at several confidence thresholds, then refits on everything and writes the
+model the backend loads at startup.
+
+    python vq-intent-train.py                                  # seed set only
+    python vq-intent-train.py --log router.jsonl --log router-2.jsonl
+    python vq-intent-train.py --log router.jsonl --eval-only   # score the current model
+    GROQ_API_KEY=... python vq-intent-train.py --relabel new-messages.jsonl
+
+Every run with the same inputs and --seed produces the same model. The
+held-out split is by message hash, so it stays stable as logs grow.
+"""
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import importlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SEED_DATA = os.path.join(HERE, "data", "search_intent_seed.jsonl")
+DEFAULT_MODEL = os.path.join(HERE, "data", "search_intent.json")
+THRESHOLDS = (0.6, 0.7, 0.8, 0.85, 0.9, 0.95)
+
+
+def load_backend(verbose: bool):
+    """Import the backend for intent_features() (and the router, for --relabel) without its startup noise."""
+    sys.path.insert(0, HERE)
+    os.chdir(HERE)
+    stdout = sys.stdout
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        return importlib.import_module("vq-chat-backend")
+    finally:
+        sys.stdout = stdout
+
+
+def read_examples(paths: list) -> dict:
+    """message -> label from JSONL files of {"message", "needs_search"}; later lines win."""
+    examples = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                message = (row.get("message") or "").strip()
+                if message and "needs_search" in row:
+                    examples[message] = bool(row["needs_search"])
+    return examples
+
+
+def relabel(backend, path: str, out_path: str):
+    """Label the messages in `path` with the live LLM router and append them to `out_path`."""
+    if not backend.groq_client:
+        sys.exit("--relabel needs GROQ_API_KEY")
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                messages.append(json.loads(line)["message"] if line.startswith("{") else line)
+    labelled = 0
+    with open(out_path, 'a', encoding='utf-8') as out:
+        for message in messages:
+            route = backend.route_message(message)
+            if route is None:
+                continue
+            out.write(json.dumps({"message": message, "needs_search": route['needs_search'], "source": "relabel"}) + "\n")
+            labelled += 1
+    print(f"Labelled {labelled}/{len(messages)} messages with the router → {out_path}")
+
+
+def is_held_out(message: str, eval_percent: int) -> bool:
+    return zlib.crc32(message.lower().encode('utf-8')) % 100 < eval_percent
+
+
+def train(rows: list, epochs: int, lr: float, l2: float, seed: int) -> tuple:
+    """(weights, bias) from AdaGrad SGD on class-balanced log loss. `rows` is [(features, label)]."""
+    positives = sum(1 for _, y in rows if y)
+    negatives = len(rows) - positives
+    class_weight = {
+        True: len(rows) / (2.0 * positives) if positives else 1.0,
+        False: len(rows) / (2.0 * negatives) if negatives else 1.0,
+    }
+    weights, grad_sq = {}, {}
+    bias, bias_sq = 0.0, 0.0
+    order = list(range(len(rows)))
+    rng = random.Random(seed)
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for i in order:
+            features, label = rows[i]
+            z = bias + sum(v * weights.get(b, 0.0) for b, v in features.items())
+            p = 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+            g = (p - (1.0 if label else 0.0)) * class_weight[label]
+            for b, v in features.items():
+                grad = g * v + l2 * weights.get(b, 0.0)
+                grad_sq[b] = grad_sq.get(b, 0.0) + grad * grad
+                weights[b] = weights.get(b, 0.0) - lr * grad / math.sqrt(grad_sq[b])
+            bias_sq += g * g
+            bias -= lr * g / math.sqrt(bias_sq)
+    return {b: w for b, w in weights.items() if abs(w) >= 1e-4}, bias
+
+
+def probability(weights: dict, bias: float, features: dict) -> float:
+    z = bias + sum(v * weights.get(b, 0.0) for b, v in features.items())
+    return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+
+def report(name: str, scored: list):
+    """Agreement with the router labels overall and at each confidence threshold. `scored` is [(p, label)]."""
+    if not scored:
+        print(f"\n{name}: no examples")
+        return
+    n = len(scored)
+    agree = sum(1 for p, y in scored if (p >= 0.5) == y)
+    print(f"\n{name}: {n} examples, {sum(y for _, y in scored)} need search")
+    print(f"  agreement at 0.5: {agree / n:.1%}")
+    print(f"  {'threshold':>9}  {'handled locally':>15}  {'local agreement':>15}  {'missed searches':>15}  {'overall':>7}")
+    for t in THRESHOLDS:
+        confident = [(p, y) for p, y in scored if p >= t or p <= 1.0 - t]
+        right = sum(1 for p, y in confident if (p >= t) == y)
+        missed = sum(1 for p, y in confident if y and p <= 1.0 - t)
+        # Uncertain messages go to the LLM router, which agrees with itself
+        overall = (right + n - len(confident)) / n
+        local = f"{right / len(confident):.1%}" if confident else "—"
+        print(f"  {t:>9.2f}  {len(confident) / n:>15.1%}  {local:>15}  {missed:>15}  {overall:>7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed-data", default=DEFAULT_SEED_DATA, help="bundled labelled examples (JSONL)")
+    parser.add_argument("--log", action="append", default=[], help="router log written via ROUTER_LOG_PATH (repeatable)")
+    parser.add_argument("--out", default=DEFAULT_MODEL, help="where to write the trained model")
+    parser.add_argument("--eval-percent", type=int, default=20, help="share of messages held out for evaluation")
+    parser.add_argument("--epochs", type=int, default=12)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--eval-only", action="store_true", help="score the model at --out against every example; write nothing")
+    parser.add_argument("--relabel", metavar="MESSAGES", help="label messages (JSONL or one per line) with the live router, append to the first --log")
+    parser.add_argument("--verbose", action="store_true", help="show backend startup output")
+    args = parser.parse_args()
+
+    backend = load_backend(args.verbose)
+    if args.relabel:
+        if not args.log:
+            sys.exit("--relabel needs a --log file to append to")
+        relabel(backend, args.relabel, args.log[0])
+
+    sources = ([args.seed_data] if args.seed_data else []) + args.log
+    examples = read_examples(sources)
+    if not examples:
+        sys.exit("No labelled examples found")
+    print(f"{len(examples)} labelled messages from {len(sources)} file(s)")
+    featurized = {message: backend.intent_features(message) for message in sorted(examples)}
+
+    if args.eval_only:
+        model = backend.SearchIntentModel(args.out, backend.SEARCH_INTENT_CONFIDENCE)
+        if not model.available:
+            sys.exit(f"No model at {args.out}")
+        report("Current model vs router", [
+            (probability(model.weights, model.bias, featurized[m]), examples[m]) for m in featurized])
+        return
+
+    train_rows = [(featurized[m], examples[m]) for m in featurized if not is_held_out(m, args.eval_percent)]
+    held_out = [m for m in featurized if is_held_out(m, args.eval_percent)]
+    weights, bias = train(train_rows, args.epochs, args.lr, args.l2, args.seed)
+    report(f"Held-out {args.eval_percent}%", [(probability(weights, bias, featurized[m]), examples[m]) for m in held_out])
+
+    # Refit on everything for the shipped model
+    weights, bias = train([(featurized[m], examples[m]) for m in featurized], args.epochs, args.lr, args.l2, args.seed)
+    start = time.perf_counter()
+    for message in featurized:
+        probability(weights, bias, backend.intent_features(message))
+    per_message = (time.perf_counter() - start) / len(featurized)
+    print(f"\nInference: {per_message * 1e6:.0f} µs/message including featurization")
+
+    model = {
+        "features": backend.intent_features_fingerprint(),
+        "bias": round(bias, 6),
+        "weights": {str(b): round(w, 6) for b, w in sorted(weights.items())},
+        "examples": len(examples),
+        "positives": sum(examples.values()),
+        "epochs": args.epochs, "lr": args.lr, "l2": args.l2, "seed": args.seed,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(model, f, separators=(",", ":"))
+        f.write("\n")
+    print(f"Wrote {len(weights)} weights to {args.out}")
+
+
+if __name__ == "__main__":
+    main()